@@ -0,0 +1,360 @@
+"""
+Нагрузочный замер маршрутов приложения: задержки p50/p95/p99 и пропускная
+способность для каждого маршрута на заданных уровнях параллельности.
+
+Приложение должно быть запущено (например, на данных из generate_data.py).
+Результат - JSON с коммитом и параметрами запуска, чтобы сравнивать замеры
+между версиями (--compare).
+
+Группы сценариев:
+  чтение (по умолчанию) - страницы main.py и GET-маршруты роутеров;
+  выгрузки (export_books, export_loans) - только при явном указании в --scenarios;
+  запись (--write) - выдача/возврат, пакетные операции, создание, изменение и
+  удаление книг и читателей; созданные записи удаляются в том же сценарии.
+Импорт каталога и DELETE /internal/lookup-cache не замеряются: первый оставляет
+данные в базе, второй - служебный.
+
+Запуск из корня репозитория:
+    python scripts/benchmark.py --concurrency 1 8 32 --duration 10 --output bench.json
+    python scripts/benchmark.py --write --scenarios loan_cycle batch_cycle
+    python scripts/benchmark.py --output new.json --compare bench.json
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import uuid
+from collections import Counter, defaultdict
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+from pagination import encode_cursor
+
+
+SEARCH_WORDS = ["анализ", "теория", "основы", "химия", "экономика", "физика", "системы", "курс"]
+SAMPLE_SIZE = 200
+
+
+class Context:
+    """Идентификаторы из базы, на которые ссылаются запросы сценариев."""
+
+    def __init__(self, books, readers):
+        self.books = books
+        self.readers = readers
+        self.available_books = [book for book in books if book["available_book_count"] > 0]
+
+    def book(self):
+        return random.choice(self.books)
+
+    def reader(self):
+        return random.choice(self.readers)
+
+
+async def load_context(client):
+    books = (await client.get("/api/books/", params={"limit": SAMPLE_SIZE})).json()["items"]
+    readers = (await client.get("/api/readers/", params={"limit": SAMPLE_SIZE})).json()["items"]
+    if not books or not readers:
+        raise SystemExit("В базе нет книг или читателей - заполните ее (sql/seed.sql или generate_data.py)")
+    return Context(books, readers)
+
+
+async def timed(client, record, route, method, url, **kwargs):
+    started = time.perf_counter()
+    try:
+        response = await client.request(method, url, **kwargs)
+        status = response.status_code
+    except httpx.HTTPError:
+        response, status = None, "error"
+    record(route, status, time.perf_counter() - started)
+    return response
+
+
+# Сценарии чтения
+
+async def home(client, ctx, record):
+    await timed(client, record, "GET /", "GET", "/")
+
+
+async def books_page(client, ctx, record):
+    await timed(client, record, "GET /books", "GET", "/books")
+
+
+async def books_page_deep(client, ctx, record):
+    book = ctx.book()
+    after = encode_cursor([book["name"], book["id"]])
+    await timed(client, record, "GET /books?after", "GET", "/books", params={"after": after})
+
+
+async def readers_page(client, ctx, record):
+    await timed(client, record, "GET /readers", "GET", "/readers")
+
+
+async def api_books(client, ctx, record):
+    await timed(client, record, "GET /api/books/", "GET", "/api/books/")
+
+
+async def api_books_search(client, ctx, record):
+    await timed(client, record, "GET /api/books/search", "GET", "/api/books/search",
+                params={"q": random.choice(SEARCH_WORDS)})
+
+
+async def api_book(client, ctx, record):
+    await timed(client, record, "GET /api/books/{id}", "GET", f"/api/books/{ctx.book()['id']}")
+
+
+async def api_readers(client, ctx, record):
+    await timed(client, record, "GET /api/readers/", "GET", "/api/readers/")
+
+
+async def api_reader(client, ctx, record):
+    await timed(client, record, "GET /api/readers/{id}", "GET", f"/api/readers/{ctx.reader()['id']}")
+
+
+async def api_reader_loans(client, ctx, record):
+    await timed(client, record, "GET /api/readers/{id}/loans", "GET", f"/api/readers/{ctx.reader()['id']}/loans")
+
+
+async def internal_pool(client, ctx, record):
+    await timed(client, record, "GET /internal/pool", "GET", "/internal/pool")
+
+
+async def internal_lookup_cache(client, ctx, record):
+    await timed(client, record, "GET /internal/lookup-cache", "GET", "/internal/lookup-cache")
+
+
+async def export_books(client, ctx, record):
+    await timed(client, record, "GET /api/books/export", "GET", "/api/books/export")
+
+
+async def export_loans(client, ctx, record):
+    await timed(client, record, "GET /api/loans/export", "GET", "/api/loans/export")
+
+
+# Сценарии записи
+
+def due_date():
+    return (datetime.date.today() + datetime.timedelta(days=30)).isoformat()
+
+
+async def loan_cycle(client, ctx, record):
+    book, reader = random.choice(ctx.available_books or ctx.books), ctx.reader()
+    response = await timed(client, record, "POST /api/books/{id}/loan", "POST", f"/api/books/{book['id']}/loan",
+                           json={"reader_fio": reader["fio"], "loan_due_date": due_date()})
+    if response is not None and response.status_code == 200:
+        await timed(client, record, "POST /api/loans/{id}/return", "POST",
+                    f"/api/loans/{response.json()['loan_id']}/return", json={})
+
+
+async def batch_cycle(client, ctx, record):
+    books = random.sample(ctx.available_books or ctx.books, min(5, len(ctx.available_books or ctx.books)))
+    response = await timed(client, record, "POST /api/loans/checkout", "POST", "/api/loans/checkout", json={
+        "reader_id": ctx.reader()["id"], "book_ids": [book["id"] for book in books], "loan_due_date": due_date()
+    })
+    if response is not None and response.status_code == 200:
+        loan_ids = [result["loan_id"] for result in response.json()["results"] if result["ok"]]
+        if loan_ids:
+            await timed(client, record, "POST /api/loans/return", "POST", "/api/loans/return",
+                        json={"loan_ids": loan_ids})
+
+
+async def book_lifecycle(client, ctx, record):
+    name = f"Замер {uuid.uuid4().hex[:12]}"
+    response = await timed(client, record, "POST /api/books/", "POST", "/api/books/", json={
+        "book_name": name, "authors": "Автор замера", "publisher": "Издательство замера",
+        "theme": "Тема замера", "number_of_books": 2
+    })
+    if response is None or response.status_code != 200:
+        return
+    book_id = response.json()["book_id"]
+    await timed(client, record, "PUT /api/books/{id}", "PUT", f"/api/books/{book_id}", json={
+        "book_name": name + " (изм.)", "authors": "Автор замера", "publisher": "Издательство замера",
+        "theme": "Тема замера"
+    })
+    await timed(client, record, "DELETE /api/books/{id}", "DELETE", f"/api/books/{book_id}")
+
+
+async def reader_lifecycle(client, ctx, record):
+    fio = f"Читатель замера {uuid.uuid4().hex[:12]}"
+    response = await timed(client, record, "POST /api/readers/", "POST", "/api/readers/", json={"fio": fio})
+    if response is None or response.status_code != 200:
+        return
+    reader_id = response.json()["reader_id"]
+    await timed(client, record, "PUT /api/readers/{id}", "PUT", f"/api/readers/{reader_id}",
+                json={"fio": fio + " (изм.)", "dolzhnost": "студент"})
+    await timed(client, record, "DELETE /api/readers/{id}", "DELETE", f"/api/readers/{reader_id}")
+
+
+READ_SCENARIOS = {
+    "home": home,
+    "books_page": books_page,
+    "books_page_deep": books_page_deep,
+    "readers_page": readers_page,
+    "api_books": api_books,
+    "api_books_search": api_books_search,
+    "api_book": api_book,
+    "api_readers": api_readers,
+    "api_reader": api_reader,
+    "api_reader_loans": api_reader_loans,
+    "internal_pool": internal_pool,
+    "internal_lookup_cache": internal_lookup_cache,
+}
+EXPORT_SCENARIOS = {
+    "export_books": export_books,
+    "export_loans": export_loans,
+}
+WRITE_SCENARIOS = {
+    "loan_cycle": loan_cycle,
+    "batch_cycle": batch_cycle,
+    "book_lifecycle": book_lifecycle,
+    "reader_lifecycle": reader_lifecycle,
+}
+ALL_SCENARIOS = {**READ_SCENARIOS, **EXPORT_SCENARIOS, **WRITE_SCENARIOS}
+
+
+def percentile(sorted_values, fraction):
+    """Перцентиль по ближайшему рангу."""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(scenario, concurrency, elapsed, latencies, statuses):
+    results = []
+    for route, values in latencies.items():
+        values = sorted(values)
+        errors = sum(count for status, count in statuses[route].items() if status == "error" or status >= 400)
+        results.append({
+            "scenario": scenario,
+            "route": route,
+            "concurrency": concurrency,
+            "requests": len(values),
+            "errors": errors,
+            "statuses": {str(status): count for status, count in sorted(statuses[route].items(), key=str)},
+            "throughput_rps": round(len(values) / elapsed, 2),
+            "mean_ms": round(sum(values) / len(values) * 1000, 2),
+            "p50_ms": round(percentile(values, 0.50) * 1000, 2),
+            "p95_ms": round(percentile(values, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+            "max_ms": round(values[-1] * 1000, 2),
+        })
+    return results
+
+
+async def run_scenario(client, ctx, name, concurrency, args):
+    scenario = ALL_SCENARIOS[name]
+    latencies = defaultdict(list)
+    statuses = defaultdict(Counter)
+
+    def record(route, status, seconds):
+        latencies[route].append(seconds)
+        statuses[route][status] += 1
+
+    # Прогрев: соединения пула и кэши не попадают в замер
+    for _ in range(min(concurrency, 4)):
+        await scenario(client, ctx, lambda *_: None)
+
+    remaining = args.requests
+    deadline = time.perf_counter() + args.duration
+
+    async def worker():
+        nonlocal remaining
+        while True:
+            if args.requests:
+                if remaining <= 0:
+                    return
+                remaining -= 1
+            elif time.perf_counter() >= deadline:
+                return
+            await scenario(client, ctx, record)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return summarize(name, concurrency, time.perf_counter() - started, latencies, statuses)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def print_table(results, baseline=None):
+    previous = {(item["route"], item["concurrency"]): item for item in (baseline or [])}
+    header = f"{'маршрут':<34} {'пар.':>4} {'запр.':>7} {'ошиб.':>5} {'зап/с':>9} {'p50':>8} {'p95':>8} {'p99':>8}"
+    if baseline:
+        header += f" {'p95 было':>9} {'зап/с было':>10}"
+    print(header, file=sys.stderr)
+
+    for item in results:
+        line = (f"{item['route']:<34} {item['concurrency']:>4} {item['requests']:>7} {item['errors']:>5} "
+                f"{item['throughput_rps']:>9.1f} {item['p50_ms']:>8.1f} {item['p95_ms']:>8.1f} {item['p99_ms']:>8.1f}")
+        old = previous.get((item["route"], item["concurrency"]))
+        if baseline and old:
+            line += f" {old['p95_ms']:>9.1f} {old['throughput_rps']:>10.1f}"
+        print(line, file=sys.stderr)
+
+
+async def main(args):
+    if args.scenarios:
+        unknown = set(args.scenarios) - set(ALL_SCENARIOS)
+        if unknown:
+            raise SystemExit(f"Неизвестные сценарии: {', '.join(sorted(unknown))}")
+        scenarios = args.scenarios
+    else:
+        scenarios = list(READ_SCENARIOS) + (list(WRITE_SCENARIOS) if args.write else [])
+
+    limits = httpx.Limits(max_connections=max(args.concurrency), max_keepalive_connections=max(args.concurrency))
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        ctx = await load_context(client)
+        results = []
+        for name in scenarios:
+            for concurrency in args.concurrency:
+                print(f"{name}, параллельно {concurrency} ...", file=sys.stderr, flush=True)
+                results.extend(await run_scenario(client, ctx, name, concurrency, args))
+
+    report = {
+        "commit": git_commit(),
+        "started_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "base_url": args.base_url,
+        "concurrency": args.concurrency,
+        "duration_seconds": None if args.requests else args.duration,
+        "requests_per_level": args.requests or None,
+        "results": results,
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+    print_table(results, baseline)
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Нагрузочный замер маршрутов приложения")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--duration", type=float, default=5.0, help="секунд на сценарий и уровень параллельности")
+    parser.add_argument("--requests", type=int, default=0, help="число итераций сценария вместо --duration")
+    parser.add_argument("--scenarios", nargs="+", help=f"сценарии: {', '.join(ALL_SCENARIOS)}")
+    parser.add_argument("--write", action="store_true", help="добавить сценарии записи")
+    parser.add_argument("--timeout", type=float, default=60.0, help="таймаут запроса, сек")
+    parser.add_argument("--output", help="файл для JSON-результата (по умолчанию - stdout)")
+    parser.add_argument("--compare", help="JSON прошлого замера для сравнения")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,256 @@
+"""
+Проверка планов основных запросов приложения: EXPLAIN для каждого запроса,
+ошибка (код выхода 1), если какой-либо из них читает большую таблицу целиком
+(Seq Scan). Таблицы меньше --min-rows строк не учитываются - для них полный
+просмотр дешевле индекса.
+
+С флагом --generate в базу добавляется синтетический объем данных; вставка,
+ANALYZE и EXPLAIN выполняются в одной транзакции, которая затем откатывается.
+
+Запуск из корня репозитория (используются настройки БД из .env):
+    python scripts/explain_check.py --generate
+    python scripts/explain_check.py --generate --scale 4 --verbose
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+from sqlalchemy import func, select, text
+
+from database import engine
+from models import *
+from catalog import (
+    books_statement, readers_statement, reader_loans_statement,
+    BOOK_SORT_KEY, READER_SORT_KEY, LOAN_SORT_KEY
+)
+from circulation import CHECKOUT_STATEMENT, READER_BY_FIO, AVAILABLE_COUNTS, checkout_params, checkout_many_statement, return_many_statement
+from pagination import apply_keyset, encode_cursor, DEFAULT_PAGE_SIZE
+from search import search_books_statement
+from projection import books_projection_statement, DEFAULT_BOOK_FIELDS
+from overdue import overdue_statement, OVERDUE_SORTS
+from reader_index import readers_prefix_statement
+from facets import facets_statement
+from inventory import item_state_statement
+
+
+# Синтетические данные на единицу масштаба
+BOOKS_PER_SCALE = 50000
+COPIES_PER_BOOK = 5
+READERS_PER_SCALE = 20000
+AUTHORS_PER_SCALE = 10000
+
+GENERATE_STATEMENTS = [
+    """
+    INSERT INTO readers (fio)
+    SELECT 'Синтетический читатель ' || md5(g::text) FROM generate_series(1, :readers) AS g
+    """,
+    # Темы существующие: фасеты и фильтр каталога по теме
+    """
+    INSERT INTO books (book_name, release_date, theme_id)
+    SELECT 'Синтетическая книга ' || md5(g::text), 1950 + g % 70, t.ids[1 + g % array_length(t.ids, 1)]
+    FROM generate_series(1, :books) AS g, (SELECT array_agg(theme_id) AS ids FROM themes) AS t
+    """,
+    """
+    INSERT INTO authors (author_name)
+    SELECT 'Синтетический автор ' || md5(g::text) FROM generate_series(1, :authors) AS g
+    """,
+    # Один автор у каждой книги, второй - у каждой третьей; id синтетических
+    # строк идут подряд, поэтому берутся смещением от первого
+    """
+    WITH synthetic_authors AS (
+        SELECT min(author_id) AS first_id FROM authors WHERE author_name LIKE 'Синтетический автор %'
+    )
+    INSERT INTO author_book (book_id, author_id)
+    SELECT b.book_id, a.first_id + (b.book_id + (k - 1) * 7919) % :authors
+    FROM books AS b, synthetic_authors AS a, generate_series(1, 2) AS k
+    WHERE b.book_name LIKE 'Синтетическая книга %' AND (k = 1 OR b.book_id % 3 = 0)
+    """,
+    # Примерно пятая часть экземпляров на руках
+    """
+    INSERT INTO book_items (book_id, book_state, acquisition_date)
+    SELECT b.book_id,
+        (CASE WHEN random() < 0.8 THEN 'Доступна' ELSE 'Займ' END)::book_states,
+        current_date
+    FROM books AS b, generate_series(1, :copies)
+    WHERE b.book_name LIKE 'Синтетическая книга %'
+    """,
+    # Один займ на каждый синтетический экземпляр; выданные - открытые займы
+    """
+    WITH synthetic_readers AS (
+        SELECT min(reader_id) AS first_id FROM readers WHERE fio LIKE 'Синтетический читатель %'
+    )
+    INSERT INTO book_loans (loan_date, loan_due_date, loan_return_date, book_item_id, reader_id)
+    SELECT
+        current_date - 60 - i.book_item_id % 300,
+        current_date + 30 - i.book_item_id % 300,
+        CASE WHEN i.book_state = 'Доступна' THEN current_date - i.book_item_id % 30 END,
+        i.book_item_id,
+        r.first_id + i.book_item_id % :readers
+    FROM book_items AS i
+    JOIN books AS b ON b.book_id = i.book_id, synthetic_readers AS r
+    WHERE b.book_name LIKE 'Синтетическая книга %'
+    """,
+    # Отчет о просрочках строится по синтетическим займам (откатывается вместе с ними)
+    "REFRESH MATERIALIZED VIEW overdue_loans",
+]
+
+ANALYZED_TABLES = ["books", "book_items", "readers", "book_loans", "authors", "author_book", "overdue_loans"]
+
+
+def hot_path_queries(conn):
+    """Запросы из обработчиков приложения с реальными параметрами из базы."""
+    book_id = conn.scalar(select(func.max(BookItem.book_id)))
+    reader_id = conn.scalar(
+        select(BookLoan.reader_id).group_by(BookLoan.reader_id).order_by(func.count().desc()).limit(1)
+    )
+    reader_fio = conn.scalar(select(Reader.fio).filter(Reader.reader_id == reader_id))
+    item_ids = conn.scalars(select(BookItem.book_item_id).order_by(BookItem.book_item_id.desc()).limit(100)).all()
+    loan_ids = conn.scalars(select(BookLoan.loan_id).order_by(BookLoan.loan_id.desc()).limit(10)).all()
+    theme_id, publisher_id = conn.execute(
+        select(Book.theme_id, Book.publisher_id)
+        .filter(Book.theme_id != None, Book.publisher_id != None).order_by(Book.book_id.desc()).limit(1)
+    ).one()
+    author_id = conn.scalar(select(AuthorBook.author_id).order_by(AuthorBook.book_id.desc()).limit(1))
+    today = datetime.date.today()
+
+    queries = {
+        "каталог: первая страница":
+            apply_keyset(books_statement(), BOOK_SORT_KEY, limit=DEFAULT_PAGE_SIZE),
+        "каталог: следующая страница":
+            apply_keyset(books_statement(), BOOK_SORT_KEY, after=encode_cursor(["М", 0]), limit=DEFAULT_PAGE_SIZE),
+        "каталог: тема и издатель":
+            apply_keyset(books_statement(theme_id=theme_id, publisher_id=publisher_id), BOOK_SORT_KEY,
+                         limit=DEFAULT_PAGE_SIZE),
+        "каталог: годы выпуска":
+            apply_keyset(books_statement(year_from=1990, year_to=1999), BOOK_SORT_KEY, limit=DEFAULT_PAGE_SIZE),
+        # Фасеты широкого фильтра (одна тема) планировщик вправе считать
+        # полным просмотром author_book - проверяется сочетание фильтров
+        "фасеты: тема и издатель":
+            facets_statement(theme_id=theme_id, publisher_id=publisher_id),
+        "фасеты: автор и годы выпуска":
+            facets_statement(author_id=author_id, year_from=1990, year_to=1999),
+        "читатели: первая страница":
+            apply_keyset(readers_statement(), READER_SORT_KEY, limit=DEFAULT_PAGE_SIZE),
+        "читатель по ФИО":
+            (READER_BY_FIO, {"fio": reader_fio}),
+        "подсказки ФИО читателя":
+            readers_prefix_statement(reader_fio[:3].lower()),
+        "история займов читателя":
+            apply_keyset(reader_loans_statement(reader_id), LOAN_SORT_KEY, limit=DEFAULT_PAGE_SIZE, descending=True),
+        "история займов: просроченные":
+            apply_keyset(reader_loans_statement(reader_id, status="Просрочена"), LOAN_SORT_KEY,
+                         limit=DEFAULT_PAGE_SIZE, descending=True),
+        "карточка книги: авторы":
+            select(Author.author_name).join(AuthorBook, Author.author_id == AuthorBook.author_id)
+            .filter(AuthorBook.book_id == book_id),
+        "удаление книги: активные займы":
+            select(func.count(BookLoan.loan_id)).join(BookItem)
+            .filter(BookItem.book_id == book_id, BookLoan.loan_return_date == None),
+        "удаление читателя: активные займы":
+            select(func.count(BookLoan.loan_id))
+            .filter(BookLoan.reader_id == reader_id, BookLoan.loan_return_date == None),
+        "выдача экземпляра":
+            (CHECKOUT_STATEMENT, checkout_params(book_id, reader_id, today, today)),
+        "выдача: свободные экземпляры":
+            (AVAILABLE_COUNTS, {"book_ids": [book_id, book_id - 1]}),
+        "пакетная выдача":
+            checkout_many_statement([book_id, book_id - 1, book_id - 2], reader_id, today, today),
+        "пакетный возврат":
+            return_many_statement(loan_ids, today),
+        "списание экземпляров: список":
+            item_state_statement("write_off", ids=item_ids, reason="Инвентаризация"),
+        "списание экземпляров: диапазон":
+            item_state_statement("write_off", id_range=(min(item_ids), max(item_ids)), reason="Инвентаризация"),
+        "просрочки: по дням":
+            apply_keyset(overdue_statement(), OVERDUE_SORTS["days"], limit=DEFAULT_PAGE_SIZE),
+        "просрочки: по читателю":
+            apply_keyset(overdue_statement(), OVERDUE_SORTS["reader"], limit=DEFAULT_PAGE_SIZE),
+        "API книг: по списку id":
+            books_projection_statement(DEFAULT_BOOK_FIELDS + ["authors"]).filter(Book.book_id.in_([book_id, book_id - 1])),
+    }
+
+    # Поиск по подстроке без триграммного индекса всегда читает таблицу целиком
+    if conn.scalar(text("SELECT to_regclass('books_name_trgm_idx') IS NOT NULL")):
+        queries["поиск книг"] = search_books_statement("книга")
+
+    return queries
+
+
+def seq_scans(plan):
+    """Таблицы, которые план читает полным просмотром."""
+    found = []
+    if plan.get("Node Type") == "Seq Scan":
+        found.append(plan["Relation Name"])
+    for child in plan.get("Plans", []):
+        found.extend(seq_scans(child))
+    return found
+
+
+def explain(conn, stmt, params=None):
+    compiled = stmt.compile(dialect=engine.dialect, compile_kwargs={"render_postcompile": True})
+    result = conn.exec_driver_sql("EXPLAIN (FORMAT JSON) " + str(compiled), compiled.construct_params(params)).scalar()
+    plan = result if isinstance(result, list) else json.loads(result)
+    return plan[0]["Plan"]
+
+
+def main(args):
+    failed = []
+
+    with engine.connect() as conn:
+        conn.execute(text("SET statement_timeout = 0"))
+
+        if args.generate:
+            params = {
+                "books": int(BOOKS_PER_SCALE * args.scale),
+                "readers": int(READERS_PER_SCALE * args.scale),
+                "authors": int(AUTHORS_PER_SCALE * args.scale),
+                "copies": COPIES_PER_BOOK
+            }
+            print(f"Генерация данных: книг {params['books']}, экземпляров {params['books'] * COPIES_PER_BOOK}, "
+                  f"читателей {params['readers']} ...", flush=True)
+            for statement in GENERATE_STATEMENTS:
+                conn.execute(text(statement), params)
+
+        for table in ANALYZED_TABLES:
+            conn.execute(text(f"ANALYZE {table}"))
+
+        # Все таблицы и представления схемы: полный просмотр в плане указывает
+        # на секцию (book_loans_open, book_loans_closed_ГГГГ), а не на book_loans
+        sizes = dict(conn.execute(text(
+            "SELECT relname, reltuples FROM pg_class "
+            "WHERE relkind IN ('r', 'm') AND relnamespace = 'public'::regnamespace"
+        )).all())
+
+        for name, stmt in hot_path_queries(conn).items():
+            # Готовые запросы с параметрами заданы парой (запрос, параметры)
+            plan = explain(conn, *stmt) if isinstance(stmt, tuple) else explain(conn, stmt)
+            scanned = sorted({table for table in seq_scans(plan) if sizes.get(table, 0) >= args.min_rows})
+
+            print(f"{'SEQ SCAN' if scanned else 'OK':<9} {name}" + (f": {', '.join(scanned)}" if scanned else ""))
+            if args.verbose:
+                print(json.dumps(plan, ensure_ascii=False, indent=2))
+            if scanned:
+                failed.append(name)
+
+        # Синтетические данные не сохраняются
+        conn.rollback()
+
+    if failed:
+        print(f"Полный просмотр больших таблиц в запросах: {', '.join(failed)}")
+        return 1
+
+    print("Все запросы используют индексы")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Проверка планов основных запросов")
+    parser.add_argument("--generate", action="store_true", help="добавить синтетические данные (откатываются)")
+    parser.add_argument("--scale", type=float, default=1.0, help="масштаб синтетических данных")
+    parser.add_argument("--min-rows", type=int, default=1000, help="таблицы меньшего размера не проверяются")
+    parser.add_argument("--verbose", action="store_true", help="печатать планы запросов")
+    sys.exit(main(parser.parse_args()))
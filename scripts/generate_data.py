@@ -0,0 +1,271 @@
+"""
+Генератор синтетических данных для проверки приложения на больших объемах.
+
+Строки создаются потоком и загружаются через COPY, память от объема не зависит.
+Вся загрузка - одна транзакция: триггеры на время загрузки отключаются
+(для суперпользователя - вместе с проверкой внешних ключей, данные
+согласованы по построению), после нее счетчики пересчитываются функциями
+reconcile_*.
+Открытые займы согласованы с состоянием экземпляров: каждый экземпляр
+в состоянии 'Займ' имеет ровно один невозвращенный займ.
+
+Запуск из корня репозитория (используются настройки БД из .env):
+    python scripts/generate_data.py --books 100000 --items 500000 --readers 50000 --loans 2000000
+    python scripts/generate_data.py --books 1000000 --items 5000000 --loans 20000000 --truncate
+"""
+import argparse
+import asyncio
+import datetime
+import os
+import random
+import sys
+import time
+
+import asyncpg
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from database import ASYNC_DATABASE_URL
+
+
+TABLES = ["publishers", "themes", "authors", "books", "author_book", "readers", "book_items", "book_loans"]
+
+# Экземпляр с book_item_id % 10 == ON_LOAN_REMAINDER выдан: так открытые займы
+# находятся без хранения списка выданных экземпляров
+ON_LOAN_REMAINDER = 3
+OTHER_STATES = [("Доступна", 0.96), ("Списана", 0.03), ("Утеряна", 0.01)]
+
+WORDS = [
+    "Анализ", "Теория", "Основы", "Методы", "Практикум", "Введение", "Курс", "Алгебра", "Геометрия",
+    "Механика", "Физика", "Химия", "Экономика", "Социология", "Право", "История", "Философия",
+    "Программирование", "Алгоритмы", "Системы", "Управление", "Моделирование", "Статистика",
+    "Электроника", "Материаловедение", "Аэродинамика", "Двигатели", "Конструкции", "Прочность",
+    "Оптика", "Термодинамика", "Вычислительная", "Прикладная", "Дискретная", "Линейная", "Общая",
+]
+SURNAMES = ["Иванов", "Петров", "Сидоров", "Смирнов", "Кузнецов", "Попов", "Волков", "Соколов",
+            "Лебедев", "Козлов", "Новиков", "Морозов", "Павлов", "Семенов", "Голубев", "Виноградов"]
+NAMES = ["Александр", "Дмитрий", "Сергей", "Андрей", "Алексей", "Михаил", "Николай", "Владимир"]
+PATRONYMICS = ["Александрович", "Дмитриевич", "Сергеевич", "Андреевич", "Петрович", "Иванович"]
+POSITIONS = ["студент", "аспирант", "ассистент", "старший преподаватель", "доцент", "профессор", None]
+DEGREES = ["Кандидат технических наук", "Доктор технических наук", "Кандидат физико-математических наук", None, None]
+
+
+def weighted_state(rng):
+    value = rng.random()
+    for state, weight in OTHER_STATES:
+        if value < weight:
+            return state
+        value -= weight
+    return OTHER_STATES[0][0]
+
+
+class Generator:
+    def __init__(self, args, start_ids):
+        self.args = args
+        self.start = start_ids
+        self.rng = random.Random(args.seed)
+        self.today = datetime.date.today()
+
+    def publishers(self):
+        first = self.start["publishers"]
+        for i in range(self.args.publishers):
+            yield (first + i, f"Синтетическое издательство {first + i}")
+
+    def themes(self):
+        first = self.start["themes"]
+        for i in range(self.args.themes):
+            yield (first + i, f"Синтетическая тема {first + i}")
+
+    def authors(self):
+        first = self.start["authors"]
+        rng = self.rng
+        for i in range(self.args.authors):
+            yield (first + i, f"{rng.choice(SURNAMES)} {rng.choice('АБВГДЕЖЗИКЛМНОПРС')}.{rng.choice('АБВГДЕЖЗИКЛМНОПРС')}. {first + i}")
+
+    def books(self):
+        first, rng = self.start["books"], self.rng
+        publishers = (self.start["publishers"], self.start["publishers"] + self.args.publishers - 1)
+        themes = (self.start["themes"], self.start["themes"] + self.args.themes - 1)
+        for book_id in range(first, first + self.args.books):
+            name = " ".join(rng.sample(WORDS, rng.randint(2, 4))) + f" {book_id}"
+            yield (
+                book_id,
+                name,
+                rng.randint(*publishers),
+                f"978-5-{book_id:09d}",
+                rng.randint(1950, self.today.year),
+                rng.randint(*themes),
+            )
+
+    def author_book(self):
+        rng = self.rng
+        authors = (self.start["authors"], self.start["authors"] + self.args.authors - 1)
+        first = self.start["books"]
+        for book_id in range(first, first + self.args.books):
+            for author_id in {rng.randint(*authors) for _ in range(rng.randint(1, 3))}:
+                yield (author_id, book_id)
+
+    def readers(self):
+        first, rng = self.start["readers"], self.rng
+        for reader_id in range(first, first + self.args.readers):
+            yield (
+                reader_id,
+                f"{rng.choice(SURNAMES)} {rng.choice(NAMES)} {rng.choice(PATRONYMICS)} {reader_id}",
+                rng.choice(POSITIONS),
+                rng.choice(DEGREES),
+            )
+
+    def book_items(self):
+        first, rng = self.start["book_items"], self.rng
+        books = (self.start["books"], self.start["books"] + self.args.books - 1)
+        for item_id in range(first, first + self.args.items):
+            # Первые экземпляры раздаются по одному на книгу, чтобы у каждой книги был экземпляр
+            book_id = books[0] + (item_id - first) if item_id - first < self.args.books else rng.randint(*books)
+            state = "Займ" if self.is_on_loan(item_id) else weighted_state(rng)
+            acquired = self.today - datetime.timedelta(days=rng.randint(0, 365 * 20))
+            yield (item_id, book_id, state, acquired, "Синтетические данные" if state == "Списана" else None)
+
+    def is_on_loan(self, item_id):
+        # Выданных экземпляров не больше, чем займов
+        offset = item_id - self.start["book_items"]
+        return item_id % 10 == ON_LOAN_REMAINDER and offset < self.args.loans * 10
+
+    def book_loans(self):
+        rng, today = self.rng, self.today
+        items = (self.start["book_items"], self.start["book_items"] + self.args.items - 1)
+        readers = (self.start["readers"], self.start["readers"] + self.args.readers - 1)
+        loan_id = self.start["book_loans"]
+
+        # Открытые займы: по одному на выданный экземпляр, часть просрочена
+        open_loans = 0
+        for item_id in range(items[0], items[1] + 1):
+            if not self.is_on_loan(item_id):
+                continue
+            loan_date = today - datetime.timedelta(days=rng.randint(0, 120))
+            yield (loan_id, loan_date, loan_date + datetime.timedelta(days=60), None, item_id, rng.randint(*readers))
+            loan_id += 1
+            open_loans += 1
+
+        # История: закрытые займы за последние пять лет, часть возвращена с опозданием
+        for _ in range(self.args.loans - open_loans):
+            loan_date = today - datetime.timedelta(days=rng.randint(121, 365 * 5))
+            due = loan_date + datetime.timedelta(days=rng.choice((14, 30, 60, 90)))
+            returned = loan_date + datetime.timedelta(days=rng.randint(1, 120))
+            yield (loan_id, loan_date, due, returned, rng.randint(*items), rng.randint(*readers))
+            loan_id += 1
+
+
+COLUMNS = {
+    "publishers": ["publisher_id", "publisher_name"],
+    "themes": ["theme_id", "theme_name"],
+    "authors": ["author_id", "author_name"],
+    "books": ["book_id", "book_name", "publisher_id", "isbn", "release_date", "theme_id"],
+    "author_book": ["author_id", "book_id"],
+    "readers": ["reader_id", "fio", "dolzhnost", "uchenaya_stepen"],
+    "book_items": ["book_item_id", "book_id", "book_state", "acquisition_date", "write_of_reasons"],
+    "book_loans": ["loan_id", "loan_date", "loan_due_date", "loan_return_date", "book_item_id", "reader_id"],
+}
+
+ID_COLUMNS = {
+    "publishers": "publisher_id", "themes": "theme_id", "authors": "author_id", "books": "book_id",
+    "readers": "reader_id", "book_items": "book_item_id", "book_loans": "loan_id",
+}
+
+
+async def main(args):
+    if args.items < args.books:
+        raise SystemExit("Экземпляров должно быть не меньше, чем книг")
+    if not args.readers or not args.publishers or not args.themes or not args.authors:
+        raise SystemExit("Количество читателей, издателей, тем и авторов должно быть больше нуля")
+
+    engine = create_async_engine(ASYNC_DATABASE_URL)
+    started = time.perf_counter()
+
+    try:
+        async with engine.connect() as connection:
+            raw_connection = await connection.get_raw_connection()
+            db = raw_connection.driver_connection
+
+            await db.execute("SET statement_timeout = 0")
+            async with db.transaction():
+                if args.truncate:
+                    await db.execute(f"TRUNCATE {', '.join(TABLES)} RESTART IDENTITY")
+
+                start_ids = {}
+                for table, column in ID_COLUMNS.items():
+                    start_ids[table] = await db.fetchval(f"SELECT coalesce(max({column}), 0) + 1 FROM {table}")
+
+                generator = Generator(args, start_ids)
+
+                # Годовые секции истории займов (миграция 009), иначе займы
+                # попадают в секцию по умолчанию
+                if await db.fetchval("SELECT to_regproc('create_book_loans_partition') IS NOT NULL"):
+                    await db.execute(
+                        "SELECT create_book_loans_partition(y) FROM generate_series($1::int, $2::int) AS y",
+                        generator.today.year - 5, generator.today.year + 1
+                    )
+
+                # Режим реплики отключает и пользовательские триггеры, и построчную
+                # проверку внешних ключей; без прав суперпользователя - только триггеры
+                try:
+                    async with db.transaction():
+                        await db.execute("SET LOCAL session_replication_role = replica")
+                    disabled_triggers = []
+                except asyncpg.InsufficientPrivilegeError:
+                    disabled_triggers = TABLES
+                for table in disabled_triggers:
+                    await db.execute(f"ALTER TABLE {table} DISABLE TRIGGER USER")
+
+                for table in TABLES:
+                    table_started = time.perf_counter()
+                    result = await db.copy_records_to_table(
+                        table, records=getattr(generator, table)(), columns=COLUMNS[table]
+                    )
+                    print(f"{table:<12} {result:<20} {time.perf_counter() - table_started:8.1f} с", flush=True)
+
+                for table in disabled_triggers:
+                    await db.execute(f"ALTER TABLE {table} ENABLE TRIGGER USER")
+                await db.execute("SET LOCAL session_replication_role = DEFAULT")
+
+                # Явные id не двигают последовательности serial
+                for table, column in ID_COLUMNS.items():
+                    await db.execute(
+                        f"SELECT setval(pg_get_serial_sequence('{table}', '{column}'), "
+                        f"(SELECT coalesce(max({column}), 1) FROM {table}))"
+                    )
+
+                print("Пересчет счетчиков ...", flush=True)
+                if await db.fetchval("SELECT to_regproc('reconcile_book_counts') IS NOT NULL"):
+                    await db.execute("SELECT reconcile_book_counts()")
+                await db.execute("SELECT reconcile_library_stats()")
+
+                # Триггеры версий при загрузке не срабатывали - ETag страниц сбрасываются явно
+                if await db.fetchval("SELECT to_regclass('table_versions') IS NOT NULL"):
+                    await db.execute("UPDATE table_versions SET version = version + 1")
+
+                # Отчет о просрочках строится заново по новым займам
+                if await db.fetchval("SELECT to_regclass('overdue_loans') IS NOT NULL"):
+                    await db.execute("REFRESH MATERIALIZED VIEW overdue_loans")
+
+            for table in TABLES:
+                await db.execute(f"ANALYZE {table}")
+    finally:
+        await engine.dispose()
+
+    print(f"Готово за {time.perf_counter() - started:.1f} с")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Генератор синтетических данных")
+    parser.add_argument("--books", type=int, default=100000)
+    parser.add_argument("--items", type=int, default=500000, help="экземпляров всего (не меньше числа книг)")
+    parser.add_argument("--readers", type=int, default=50000)
+    parser.add_argument("--loans", type=int, default=2000000)
+    parser.add_argument("--authors", type=int, default=20000)
+    parser.add_argument("--publishers", type=int, default=300)
+    parser.add_argument("--themes", type=int, default=60)
+    parser.add_argument("--seed", type=int, default=1, help="зерно генератора случайных чисел")
+    parser.add_argument("--truncate", action="store_true", help="удалить существующие данные перед загрузкой")
+    asyncio.run(main(parser.parse_args()))
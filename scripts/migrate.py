@@ -0,0 +1,224 @@
+"""
+Применение миграций из sql/migrations к рабочей базе без потери данных.
+
+Миграция - файл NNN_описание.sql. Примененные версии хранятся в таблице
+schema_migrations вместе с контрольной суммой файла. Каждая миграция
+выполняется в своей транзакции вместе с записью о версии; файл, начинающийся
+с "-- migrate: no-transaction", выполняется по одному оператору вне транзакции
+(нужно для CREATE INDEX CONCURRENTLY). Такие файлы не должны содержать
+функций: операторы разделяются по ";" в конце строки. Запрос, завершенный
+строкой "\\gexec" (как в psql), возвращает операторы, и каждый из них
+выполняется отдельно - например, индексы для секций, список которых
+зависит от данных.
+
+Запуск из корня репозитория (используются настройки БД из .env):
+    python scripts/migrate.py                  # применить новые миграции
+    python scripts/migrate.py status           # список миграций и их состояние
+    python scripts/migrate.py baseline 001     # отметить миграции до 001 как примененные,
+                                               # если они уже выполнены вручную через psql
+"""
+import argparse
+import hashlib
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+from database import engine
+
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sql", "migrations")
+NO_TRANSACTION_MARKER = "-- migrate: no-transaction"
+GEXEC = "\\gexec"
+
+# Ключ advisory-блокировки: две копии скрипта не применяют миграции одновременно
+LOCK_KEY = 7300125
+
+
+class Migration:
+    def __init__(self, path):
+        self.path = path
+        self.filename = os.path.basename(path)
+        self.version, _, name = self.filename[:-len(".sql")].partition("_")
+        self.name = name or self.version
+        with open(path, encoding="utf-8") as f:
+            self.sql = f.read()
+        self.checksum = hashlib.sha256(self.sql.encode("utf-8")).hexdigest()
+        self.transactional = not self.sql.lstrip().startswith(NO_TRANSACTION_MARKER)
+
+    def statements(self):
+        """
+        Операторы файла для выполнения вне транзакции (комментарии
+        отбрасываются): пары (оператор, выполнить ли его результат).
+        """
+        parts = re.split(r"(;[ \t]*$|^[ \t]*\\gexec[ \t]*$)", self.sql, flags=re.MULTILINE)
+        for chunk, end in zip(parts[0::2], parts[1::2] + [""]):
+            lines = [line for line in chunk.splitlines() if line.strip() and not line.strip().startswith("--")]
+            if lines:
+                yield "\n".join(lines), end.strip() == GEXEC
+
+
+def load_migrations():
+    files = sorted(name for name in os.listdir(MIGRATIONS_DIR) if re.match(r"^\d+_.*\.sql$", name))
+    migrations = [Migration(os.path.join(MIGRATIONS_DIR, name)) for name in files]
+
+    versions = [migration.version for migration in migrations]
+    duplicates = {version for version in versions if versions.count(version) > 1}
+    if duplicates:
+        raise SystemExit(f"Повторяющиеся номера миграций: {', '.join(sorted(duplicates))}")
+
+    return migrations
+
+
+def connect(lock_timeout):
+    connection = engine.raw_connection()
+    # Транзакциями управляем сами: BEGIN/COMMIT для обычных миграций,
+    # автофиксация для CONCURRENTLY
+    connection.driver_connection.autocommit = True
+    cursor = connection.cursor()
+    # Построение индекса на большой таблице дольше DB_STATEMENT_TIMEOUT приложения;
+    # ожидание блокировки ограничено, чтобы миграция не останавливала рабочие запросы
+    cursor.execute("SET statement_timeout = 0")
+    cursor.execute(f"SET lock_timeout = '{int(lock_timeout)}s'")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version text PRIMARY KEY,
+            name text NOT NULL,
+            checksum text NOT NULL,
+            applied_at timestamptz NOT NULL DEFAULT now()
+        )
+    """)
+    return connection, cursor
+
+
+def applied_versions(cursor):
+    cursor.execute("SELECT version, checksum FROM schema_migrations")
+    return dict(cursor.fetchall())
+
+
+def record(cursor, migration):
+    cursor.execute(
+        "INSERT INTO schema_migrations (version, name, checksum) VALUES (%s, %s, %s)",
+        (migration.version, migration.name, migration.checksum)
+    )
+
+
+def invalid_indexes(cursor):
+    cursor.execute("""
+        SELECT indexrelid::regclass::text FROM pg_index
+        JOIN pg_class ON pg_class.oid = pg_index.indrelid
+        WHERE NOT indisvalid AND pg_class.relnamespace = 'public'::regnamespace
+    """)
+    return [row[0] for row in cursor.fetchall()]
+
+
+def apply(cursor, migration):
+    if migration.transactional:
+        cursor.execute("BEGIN")
+        try:
+            cursor.execute(migration.sql)
+            record(cursor, migration)
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+        return
+
+    for statement, gexec in migration.statements():
+        cursor.execute(statement)
+        if gexec:
+            for generated in [row[0] for row in cursor.fetchall()]:
+                cursor.execute(generated)
+
+    # Прерванный CREATE INDEX CONCURRENTLY оставляет нерабочий индекс,
+    # а IF NOT EXISTS при повторном запуске его пропустит
+    invalid = invalid_indexes(cursor)
+    if invalid:
+        raise RuntimeError(
+            f"Нерабочие индексы после миграции: {', '.join(invalid)}. "
+            "Удалите их (DROP INDEX CONCURRENTLY) и запустите миграцию снова"
+        )
+    record(cursor, migration)
+
+
+def upgrade(args):
+    connection, cursor = connect(args.lock_timeout)
+    try:
+        cursor.execute("SELECT pg_advisory_lock(%s)", (LOCK_KEY,))
+        applied = applied_versions(cursor)
+        pending = [migration for migration in load_migrations() if migration.version not in applied]
+
+        if args.target:
+            pending = [migration for migration in pending if migration.version <= args.target]
+
+        if not pending:
+            print("Новых миграций нет")
+            return 0
+
+        for migration in pending:
+            print(f"Применяется {migration.filename} ...", flush=True)
+            try:
+                apply(cursor, migration)
+            except Exception as e:
+                print(f"Ошибка в миграции {migration.filename}: {e}")
+                return 1
+
+        print(f"Применено миграций: {len(pending)}")
+        return 0
+    finally:
+        connection.close()
+
+
+def status(args):
+    connection, cursor = connect(args.lock_timeout)
+    try:
+        applied = applied_versions(cursor)
+        for migration in load_migrations():
+            if migration.version not in applied:
+                state = "ожидает"
+            elif applied[migration.version] != migration.checksum:
+                state = "применена, файл изменен"
+            else:
+                state = "применена"
+            mode = "" if migration.transactional else " (вне транзакции)"
+            print(f"{migration.filename:<40} {state}{mode}")
+        return 0
+    finally:
+        connection.close()
+
+
+def baseline(args):
+    connection, cursor = connect(args.lock_timeout)
+    try:
+        applied = applied_versions(cursor)
+        marked = 0
+        for migration in load_migrations():
+            if migration.version <= args.version and migration.version not in applied:
+                record(cursor, migration)
+                print(f"Отмечена как примененная: {migration.filename}")
+                marked += 1
+        print(f"Отмечено миграций: {marked}")
+        return 0
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Миграции схемы базы данных")
+    parser.add_argument("--lock-timeout", type=int, default=5, help="ожидание блокировки таблицы, сек")
+    commands = parser.add_subparsers(dest="command")
+
+    upgrade_parser = commands.add_parser("upgrade", help="применить новые миграции")
+    upgrade_parser.add_argument("--target", help="применить миграции до этой версии включительно")
+    commands.add_parser("status", help="показать состояние миграций")
+    baseline_parser = commands.add_parser("baseline", help="отметить миграции как примененные без выполнения")
+    baseline_parser.add_argument("version")
+
+    args = parser.parse_args()
+    if args.command == "status":
+        sys.exit(status(args))
+    if args.command == "baseline":
+        sys.exit(baseline(args))
+    args.target = getattr(args, "target", None)
+    sys.exit(upgrade(args))
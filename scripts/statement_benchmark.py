@@ -0,0 +1,178 @@
+"""
+Микрозамер подготовки запросов горячих маршрутов: сколько времени Python
+тратит на запрос до обращения к базе.
+
+Для каждого маршрута сравниваются три способа:
+  без кэша     - запрос строится и компилируется при каждом вызове
+                 (так выглядит промах кэша компиляции SQLAlchemy);
+  построение   - запрос строится заново, компиляция берется из кэша
+                 (обработчики до перевода на готовые запросы);
+  готовый      - объект запроса из statement_cache / модуля, значения -
+                 параметрами (текущие обработчики).
+С --execute дополнительно замеряется медиана полного выполнения запроса
+через сессию приложения (с подготовленными операторами asyncpg).
+
+Запуск из корня репозитория:
+    python scripts/statement_benchmark.py
+    python scripts/statement_benchmark.py --iterations 5000 --execute 500
+"""
+import argparse
+import asyncio
+import datetime
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+from sqlalchemy import select, text
+
+from database import AsyncSessionLocal, async_engine
+from models import *
+from catalog import (
+    books_statement, readers_statement, reader_loans_statement, book_filter_values,
+    books_page_statement, readers_page_statement, reader_loans_page_statement,
+    BOOK_SORT_KEY, READER_SORT_KEY, LOAN_SORT_KEY
+)
+from circulation import checkout_statement, checkout_params, CHECKOUT_STATEMENT, READER_BY_FIO, AVAILABLE_COUNTS
+from pagination import apply_keyset, encode_cursor, keyset_params, DEFAULT_PAGE_SIZE
+
+
+DIALECT = async_engine.sync_engine.dialect
+
+
+def compile_cached(stmt, params, cache):
+    """То, что делает Connection.execute до драйвера: ключ кэша, поиск и компиляция при промахе."""
+    return stmt._compile_w_cache(
+        DIALECT, compiled_cache=cache, column_keys=sorted(params),
+        for_executemany=False, schema_translate_map=None
+    )[0]
+
+
+def cases(book_id, reader_id, fio):
+    """Маршрут -> (построение на запрос, готовый запрос); каждый возвращает [(запрос, параметры)]."""
+    today = datetime.date.today()
+    cursor = encode_cursor(["М", 0])
+    filters = {"theme_id": 3, "publisher_id": 5}
+
+    def books_before():
+        return [(apply_keyset(books_statement("", **filters), BOOK_SORT_KEY, after=cursor, limit=DEFAULT_PAGE_SIZE), {})]
+
+    def books_after():
+        stmt, params = books_page_statement(book_filter_values("", **filters), "after")
+        return [(stmt, {**params, **keyset_params(BOOK_SORT_KEY, after=cursor, limit=DEFAULT_PAGE_SIZE)})]
+
+    def readers_before():
+        return [(apply_keyset(readers_statement("Ив"), READER_SORT_KEY, limit=DEFAULT_PAGE_SIZE), {})]
+
+    def readers_after():
+        stmt, params = readers_page_statement("Ив", None)
+        return [(stmt, {**params, **keyset_params(READER_SORT_KEY, limit=DEFAULT_PAGE_SIZE)})]
+
+    def loans_before():
+        return [(apply_keyset(reader_loans_statement(reader_id), LOAN_SORT_KEY, limit=DEFAULT_PAGE_SIZE, descending=True), {})]
+
+    def loans_after():
+        stmt, params = reader_loans_page_statement(reader_id, None, None, None, None)
+        return [(stmt, {**params, **keyset_params(LOAN_SORT_KEY, limit=DEFAULT_PAGE_SIZE)})]
+
+    # Выдача: поиск читателя, проверка счетчика и сам оператор выдачи
+    def checkout_before():
+        return [
+            (select(Reader).filter(Reader.fio == fio), {}),
+            (select(Book.book_id, Book.available_count).filter(Book.book_id.in_({book_id})), {}),
+            (checkout_statement(), checkout_params(book_id, reader_id, today, today)),
+        ]
+
+    def checkout_after():
+        return [
+            (READER_BY_FIO, {"fio": fio}),
+            (AVAILABLE_COUNTS, {"book_ids": [book_id]}),
+            (CHECKOUT_STATEMENT, checkout_params(book_id, reader_id, today, today)),
+        ]
+
+    return {
+        "books_route": (books_before, books_after),
+        "readers_page": (readers_before, readers_after),
+        "reader_loans": (loans_before, loans_after),
+        "loan_book_to_reader": (checkout_before, checkout_after),
+    }
+
+
+def per_call_us(func, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def prepare_benchmark(routes, iterations):
+    print(f"{'маршрут':<22}{'без кэша, мкс':>16}{'построение, мкс':>18}{'готовый, мкс':>15}{'ускорение':>12}")
+    for name, (before, after) in routes.items():
+        cache = {}
+
+        def uncached():
+            for stmt, params in before():
+                compile_cached(stmt, params, None)
+
+        def rebuilt():
+            for stmt, params in before():
+                compile_cached(stmt, params, cache)
+
+        def prepared():
+            for stmt, params in after():
+                compile_cached(stmt, params, cache)
+
+        # Прогрев: кэш компиляции и statement_cache заполнены, как в работающем приложении
+        rebuilt()
+        prepared()
+
+        times = [
+            per_call_us(uncached, max(iterations // 10, 10)),
+            per_call_us(rebuilt, iterations),
+            per_call_us(prepared, iterations),
+        ]
+        print(f"{name:<22}{times[0]:>16.1f}{times[1]:>18.1f}{times[2]:>15.1f}{times[1] / times[2]:>11.1f}x")
+
+
+async def execute_benchmark(routes, iterations):
+    print(f"\n{'маршрут':<22}{'построение, мс':>16}{'готовый, мс':>14}   (медиана выполнения)")
+    async with AsyncSessionLocal() as db:
+        for name, (before, after) in routes.items():
+            if name == "loan_book_to_reader":
+                # Выдача изменяет данные - замеряются только чтения
+                before_reads, after_reads = (lambda: before()[:2]), (lambda: after()[:2])
+            else:
+                before_reads, after_reads = before, after
+
+            medians = []
+            for build in (before_reads, after_reads):
+                samples = []
+                for _ in range(iterations):
+                    started = time.perf_counter()
+                    for stmt, params in build():
+                        (await db.execute(stmt, params)).all()
+                    samples.append(time.perf_counter() - started)
+                medians.append(statistics.median(samples) * 1000)
+            print(f"{name:<22}{medians[0]:>16.3f}{medians[1]:>14.3f}")
+        await db.rollback()
+
+
+async def main(args):
+    async with AsyncSessionLocal() as db:
+        book_id = await db.scalar(text("SELECT max(book_id) FROM books"))
+        reader_id, fio = (await db.execute(text("SELECT reader_id, fio FROM readers ORDER BY reader_id LIMIT 1"))).one()
+
+    routes = cases(book_id or 1, reader_id, fio)
+    prepare_benchmark(routes, args.iterations)
+    if args.execute:
+        await execute_benchmark(routes, args.execute)
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Микрозамер подготовки запросов горячих маршрутов")
+    parser.add_argument("--iterations", type=int, default=2000, help="вызовов на способ подготовки")
+    parser.add_argument("--execute", type=int, default=0, help="выполнений запроса в базе на способ (0 - не выполнять)")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,160 @@
+"""
+Нагрузочная проверка параллельной выдачи книг (FOR UPDATE SKIP LOCKED).
+
+Создает тестовую книгу с заданным числом экземпляров и тестового читателя,
+затем для каждого уровня параллельности запускает пачку одновременных выдач
+и проверяет, что:
+  - ни один экземпляр не выдан дважды;
+  - число выдач равно min(запросов, экземпляров);
+  - каждый выданный экземпляр находится в состоянии 'Займ'.
+Печатает пропускную способность для каждого уровня. Выдачи не должны
+выстраиваться в очередь на общей строке: на наибольшей параллельности
+пропускная способность должна быть хотя бы в --min-speedup раз выше, чем
+у одного клиента (0 - не проверять; на одноядерной машине ускорения не будет).
+Код выхода 1 - нарушена проверка или ускорение ниже порога. Тестовые данные удаляются.
+
+Запуск из корня репозитория (используются настройки БД из .env):
+    python scripts/stress_checkout.py --copies 500 --requests 600 --concurrency 1 8 32 128
+"""
+import argparse
+import asyncio
+import datetime
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from database import ASYNC_DATABASE_URL
+from circulation import checkout_book
+
+
+async def setup(engine, copies):
+    suffix = uuid.uuid4().hex[:8]
+    async with engine.begin() as conn:
+        book_id = (await conn.execute(text(
+            "INSERT INTO books (book_name) VALUES (:name) RETURNING book_id"
+        ), {"name": f"Нагрузочный тест {suffix}"})).scalar()
+        await conn.execute(text(
+            "INSERT INTO book_items (book_id, acquisition_date) "
+            "SELECT :book_id, current_date FROM generate_series(1, :copies)"
+        ), {"book_id": book_id, "copies": copies})
+        reader_id = (await conn.execute(text(
+            "INSERT INTO readers (fio) VALUES (:fio) RETURNING reader_id"
+        ), {"fio": f"Нагрузочный читатель {suffix}"})).scalar()
+    return book_id, reader_id
+
+
+async def reset(engine, book_id, reader_id):
+    async with engine.begin() as conn:
+        await conn.execute(text("DELETE FROM book_loans WHERE reader_id = :reader_id"), {"reader_id": reader_id})
+        await conn.execute(text(
+            "UPDATE book_items SET book_state = 'Доступна' WHERE book_id = :book_id"
+        ), {"book_id": book_id})
+
+
+async def cleanup(engine, book_id, reader_id):
+    async with engine.begin() as conn:
+        await conn.execute(text("DELETE FROM book_loans WHERE reader_id = :reader_id"), {"reader_id": reader_id})
+        await conn.execute(text("DELETE FROM book_items WHERE book_id = :book_id"), {"book_id": book_id})
+        await conn.execute(text("DELETE FROM books WHERE book_id = :book_id"), {"book_id": book_id})
+        await conn.execute(text("DELETE FROM readers WHERE reader_id = :reader_id"), {"reader_id": reader_id})
+
+
+async def run_level(session_factory, book_id, reader_id, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    today = datetime.date.today()
+    due = today + datetime.timedelta(days=14)
+
+    async def one_checkout():
+        async with semaphore:
+            async with session_factory() as db:
+                loan = await checkout_book(db, book_id, reader_id, today, due)
+                await db.commit()
+                return loan
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*[one_checkout() for _ in range(requests)])
+    elapsed = time.perf_counter() - started
+    return [loan for loan in results if loan], elapsed
+
+
+async def verify(engine, book_id, reader_id, loans, expected):
+    problems = []
+
+    item_ids = [loan.book_item_id for loan in loans]
+    if len(item_ids) != len(set(item_ids)):
+        problems.append("один экземпляр выдан несколько раз")
+    if len(loans) != expected:
+        problems.append(f"выдано {len(loans)}, ожидалось {expected}")
+
+    async with engine.connect() as conn:
+        double_issued = (await conn.execute(text("""
+            SELECT bl.book_item_id FROM book_loans AS bl
+            JOIN book_items AS bi ON bi.book_item_id = bl.book_item_id
+            WHERE bi.book_id = :book_id AND bl.loan_return_date IS NULL
+            GROUP BY bl.book_item_id HAVING count(*) > 1
+        """), {"book_id": book_id})).all()
+        on_loan = (await conn.execute(text(
+            "SELECT count(*) FROM book_items WHERE book_id = :book_id AND book_state = 'Займ'"
+        ), {"book_id": book_id})).scalar()
+
+    if double_issued:
+        problems.append(f"экземпляры с несколькими открытыми выдачами: {[row[0] for row in double_issued]}")
+    if on_loan != len(loans):
+        problems.append(f"в состоянии 'Займ' {on_loan} экземпляров, выдач {len(loans)}")
+
+    return problems
+
+
+async def main(args):
+    engine = create_async_engine(
+        ASYNC_DATABASE_URL, pool_size=max(args.concurrency), max_overflow=0, pool_timeout=60
+    )
+    session_factory = async_sessionmaker(bind=engine, expire_on_commit=False)
+
+    book_id, reader_id = await setup(engine, args.copies)
+    failed = False
+    baseline = None
+    throughputs = {}
+
+    try:
+        print(f"{'параллельно':>12} {'выдано':>8} {'сек':>8} {'выдач/с':>10} {'ускорение':>10}  проверка")
+        for concurrency in args.concurrency:
+            await reset(engine, book_id, reader_id)
+            loans, elapsed = await run_level(session_factory, book_id, reader_id, args.requests, concurrency)
+            problems = await verify(engine, book_id, reader_id, loans, min(args.requests, args.copies))
+
+            throughput = len(loans) / elapsed if elapsed else 0.0
+            throughputs[concurrency] = throughput
+            baseline = baseline or throughput
+            print(f"{concurrency:>12} {len(loans):>8} {elapsed:>8.3f} {throughput:>10.1f} "
+                  f"{throughput / baseline:>9.2f}x  {'OK' if not problems else '; '.join(problems)}")
+            failed = failed or bool(problems)
+    finally:
+        await cleanup(engine, book_id, reader_id)
+        await engine.dispose()
+
+    lowest, highest = min(throughputs), max(throughputs)
+    if args.min_speedup > 0 and highest > lowest and throughputs[lowest]:
+        speedup = throughputs[highest] / throughputs[lowest]
+        if speedup < args.min_speedup:
+            print(f"Ускорение при {highest} параллельных выдачах {speedup:.2f}x, "
+                  f"меньше порога {args.min_speedup:.2f}x: выдачи ждут друг друга")
+            failed = True
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Нагрузочная проверка параллельной выдачи книг")
+    parser.add_argument("--copies", type=int, default=500, help="экземпляров тестовой книги")
+    parser.add_argument("--requests", type=int, default=600, help="выдач на каждом уровне параллельности")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--min-speedup", type=float, default=1.5,
+                        help="во сколько раз наибольшая параллельность должна обгонять наименьшую (0 - не проверять)")
+    sys.exit(asyncio.run(main(parser.parse_args())))
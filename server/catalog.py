@@ -0,0 +1,362 @@
+from sqlalchemy import and_, or_, case, exists, func, select, bindparam
+
+from models import *
+from database import AsyncSessionLocal
+from pagination import apply_keyset, build_page, clamp_limit, encode_cursor, keyset_direction, keyset_params, keyset_statement
+from statement_cache import statement_cache
+
+
+# Потоковый вывод страниц: строк за одно чтение с серверного курсора и
+# наибольший размер страницы (строки не накапливаются в памяти)
+STREAM_BATCH_SIZE = 500
+MAX_STREAM_PAGE_SIZE = 10000
+
+# Ключи сортировки для постраничного вывода (последний столбец уникален)
+BOOK_SORT_KEY = (Book.book_name, Book.book_id)
+READER_SORT_KEY = (Reader.fio, Reader.reader_id)
+LOAN_SORT_KEY = (BookLoan.loan_date, BookLoan.loan_id)
+
+# Статусы займа и условия для них (условия не пересекаются)
+LOAN_STATUS_CONDITIONS = {
+    "Возвращена с опозданием": and_(
+        BookLoan.loan_return_date != None,
+        BookLoan.loan_return_date > BookLoan.loan_due_date
+    ),
+    "Возвращена": and_(
+        BookLoan.loan_return_date != None,
+        or_(BookLoan.loan_due_date == None, BookLoan.loan_return_date <= BookLoan.loan_due_date)
+    ),
+    "Просрочена": and_(
+        BookLoan.loan_return_date == None,
+        BookLoan.loan_due_date < func.current_date()
+    ),
+    "На руках": and_(
+        BookLoan.loan_return_date == None,
+        or_(BookLoan.loan_due_date == None, BookLoan.loan_due_date >= func.current_date())
+    ),
+}
+
+loan_status = case(
+    *[(condition, status) for status, condition in LOAN_STATUS_CONDITIONS.items()]
+).label('status')
+
+
+def _with_pending(column, delta_column):
+    pending = select(func.sum(delta_column))\
+        .filter(book_counts_delta.c.book_id == Book.book_id)\
+        .scalar_subquery()
+    return column + func.coalesce(pending, 0)
+
+
+# Количество экземпляров книги: значение в books плюс еще не перенесенные
+# приращения журнала book_counts_delta (миграция 014), по индексу журнала
+BOOK_TOTAL_COUNT = _with_pending(Book.total_count, book_counts_delta.c.total_count)
+BOOK_AVAILABLE_COUNT = _with_pending(Book.available_count, book_counts_delta.c.available_count)
+
+
+# Фильтры, от значения которых зависит текст запроса, а не только параметры
+STRUCTURAL_BOOK_FILTERS = ("available",)
+
+
+def book_filter_values(search="", publisher_id=None, theme_id=None, author_id=None,
+                       year_from=None, year_to=None, available=None):
+    """Заданные фильтры книг: имя -> значение (для search - шаблон ILIKE)."""
+    values = {
+        "search": f"%{search.strip()}%" if search.strip() else None,
+        "publisher_id": publisher_id,
+        "theme_id": theme_id,
+        "author_id": author_id,
+        "year_from": year_from,
+        "year_to": year_to,
+        "available": available,
+    }
+    return {name: value for name, value in values.items() if value is not None}
+
+
+def book_conditions(values):
+    """Условия отбора книг по book_filter_values; значения могут быть параметрами (bindparam)."""
+    conditions = []
+
+    # Подстрочный поиск обслуживается триграммным индексом books_name_trgm_idx
+    if "search" in values:
+        conditions.append(Book.book_name.ilike(values["search"]))
+    if "publisher_id" in values:
+        conditions.append(Book.publisher_id == values["publisher_id"])
+    if "theme_id" in values:
+        conditions.append(Book.theme_id == values["theme_id"])
+    if "author_id" in values:
+        conditions.append(exists().where(AuthorBook.book_id == Book.book_id, AuthorBook.author_id == values["author_id"]))
+    if "year_from" in values:
+        conditions.append(Book.release_date >= values["year_from"])
+    if "year_to" in values:
+        conditions.append(Book.release_date <= values["year_to"])
+    if "available" in values:
+        conditions.append(BOOK_AVAILABLE_COUNT > 0 if values["available"] else BOOK_AVAILABLE_COUNT == 0)
+
+    return conditions
+
+
+def book_filters(search="", publisher_id=None, theme_id=None, author_id=None,
+                 year_from=None, year_to=None, available=None):
+    """Условия отбора книг: общие для каталога, API книг и фасетов."""
+    return book_conditions(book_filter_values(
+        search, publisher_id, theme_id, author_id, year_from, year_to, available
+    ))
+
+
+def books_statement(search="", **filters):
+    """Запрос каталога книг с количеством доступных экземпляров."""
+    return _books_statement(book_filters(search, **filters))
+
+
+def _books_statement(conditions):
+    stmt = select(
+        Book.book_id,
+        Book.book_name,
+        Theme.theme_name,
+        Publisher.publisher_name,
+        Book.release_date,
+        Book.isbn,
+        BOOK_AVAILABLE_COUNT.label('available_book_count')
+    ).outerjoin(Publisher, Book.publisher_id == Publisher.publisher_id)\
+     .outerjoin(Theme, Book.theme_id == Theme.theme_id)
+
+    return stmt.filter(*conditions)
+
+
+def readers_statement(search=""):
+    """Запрос списка читателей с количеством активных займов."""
+    return _readers_statement(f"{search.strip()}%")
+
+
+def _readers_statement(fio_pattern):
+    # Без GROUP BY страница читается по индексу readers_fio_id_idx,
+    # а займы считаются по индексу секции открытых займов book_loans_open
+    active_loans_count = select(func.count(BookLoan.loan_id))\
+        .filter(BookLoan.reader_id == Reader.reader_id, BookLoan.loan_return_date == None)\
+        .scalar_subquery()
+
+    return select(
+        Reader.reader_id,
+        Reader.fio,
+        Reader.dolzhnost,
+        Reader.uchenaya_stepen,
+        active_loans_count.label('active_loans_count')
+    ).filter(Reader.fio.ilike(fio_pattern))
+
+
+def reader_loans_statement(reader_id, status=None, date_from=None, date_to=None):
+    """История займов читателя одним запросом вместе с названием книги и статусом."""
+    stmt = select(
+        BookLoan.loan_id,
+        BookLoan.loan_date,
+        BookLoan.loan_due_date,
+        BookLoan.loan_return_date,
+        BookLoan.book_item_id,
+        Book.book_name,
+        loan_status
+    ).join(BookItem, BookLoan.book_item_id == BookItem.book_item_id)\
+     .join(Book, BookItem.book_id == Book.book_id)\
+     .filter(BookLoan.reader_id == reader_id)
+
+    if status:
+        if status not in LOAN_STATUS_CONDITIONS:
+            raise ValueError(f"Неизвестный статус займа: {status}")
+        stmt = stmt.filter(LOAN_STATUS_CONDITIONS[status])
+
+    if date_from is not None:
+        stmt = stmt.filter(BookLoan.loan_date >= date_from)
+
+    if date_to is not None:
+        stmt = stmt.filter(BookLoan.loan_date <= date_to)
+
+    return stmt
+
+
+def books_page_statement(values, direction):
+    """
+    Готовый запрос страницы каталога для набора фильтров values
+    (book_filter_values) и направления страницы. Возвращает (запрос, параметры).
+    """
+    shape = tuple((name, values[name]) if name in STRUCTURAL_BOOK_FILTERS else name for name in values)
+
+    def build():
+        bound = {
+            name: value if name in STRUCTURAL_BOOK_FILTERS else bindparam(f"filter_{name}")
+            for name, value in values.items()
+        }
+        return keyset_statement(_books_statement(book_conditions(bound)), BOOK_SORT_KEY, direction)
+
+    params = {f"filter_{name}": value for name, value in values.items() if name not in STRUCTURAL_BOOK_FILTERS}
+    return statement_cache.get(("books", shape, direction), build), params
+
+
+def readers_page_statement(search, direction):
+    """Готовый запрос страницы списка читателей. Возвращает (запрос, параметры)."""
+    def build():
+        return keyset_statement(_readers_statement(bindparam("fio_pattern")), READER_SORT_KEY, direction)
+
+    return statement_cache.get(("readers", direction), build), {"fio_pattern": f"{search.strip()}%"}
+
+
+def reader_loans_page_statement(reader_id, status, date_from, date_to, direction):
+    """Готовый запрос страницы истории займов читателя. Возвращает (запрос, параметры)."""
+    params = {"reader_id": reader_id, "date_from": date_from, "date_to": date_to}
+    params = {name: value for name, value in params.items() if value is not None}
+
+    def build():
+        stmt = reader_loans_statement(
+            bindparam("reader_id"), status,
+            bindparam("date_from") if date_from is not None else None,
+            bindparam("date_to") if date_to is not None else None
+        )
+        return keyset_statement(stmt, LOAN_SORT_KEY, direction, descending=True)
+
+    shape = ("reader_loans", status or None, date_from is not None, date_to is not None, direction)
+    return statement_cache.get(shape, build), params
+
+
+def book_to_dict(row):
+    return {
+        "id": row.book_id,
+        "name": row.book_name,
+        "theme": row.theme_name or "Не указана",
+        "publisher": row.publisher_name or "Не указан",
+        "release_date": row.release_date or "Не указана",
+        "isbn": row.isbn or "Не указан",
+        "available_book_count": row.available_book_count
+    }
+
+
+def reader_to_dict(row):
+    return {
+        "id": row.reader_id,
+        "fio": row.fio,
+        "dolzhnost": row.dolzhnost or "Не указано",
+        "uchenaya_stepen": row.uchenaya_stepen or "Не указано",
+        "active_loans": row.active_loans_count
+    }
+
+
+def loan_to_dict(row):
+    return {
+        "loan_id": row.loan_id,
+        "book_name": row.book_name,
+        "loan_date": row.loan_date.isoformat() if row.loan_date else None,
+        "loan_due_date": row.loan_due_date.isoformat() if row.loan_due_date else None,
+        "loan_return_date": row.loan_return_date.isoformat() if row.loan_return_date else None,
+        "status": row.status,
+        "book_item_id": row.book_item_id
+    }
+
+
+async def _fetch_page(db, stmt, params, sort_key, key_names, to_dict, after, before, limit):
+    """Страница по готовому запросу keyset_statement; params - значения его фильтров."""
+    limit = clamp_limit(limit)
+    params = {**params, **keyset_params(sort_key, after=after, before=before, limit=limit)}
+    rows = (await db.execute(stmt, params)).all()
+    rows, next_cursor, prev_cursor = build_page(rows, key_names, after=after, before=before, limit=limit)
+
+    return {
+        "items": [to_dict(row) for row in rows],
+        "next_cursor": next_cursor,
+        "prev_cursor": prev_cursor,
+        "limit": limit
+    }
+
+
+async def fetch_books_page(db, search="", after=None, before=None, limit=None, filters=None):
+    """Страница каталога книг, отсортированного по (book_name, book_id)."""
+    stmt, params = books_page_statement(book_filter_values(search, **(filters or {})), keyset_direction(after, before))
+    return await _fetch_page(
+        db, stmt, params, BOOK_SORT_KEY, ("book_name", "book_id"), book_to_dict, after, before, limit
+    )
+
+
+async def fetch_readers_page(db, search="", after=None, before=None, limit=None):
+    """Страница списка читателей, отсортированного по (fio, reader_id)."""
+    stmt, params = readers_page_statement(search, keyset_direction(after, before))
+    return await _fetch_page(
+        db, stmt, params, READER_SORT_KEY, ("fio", "reader_id"), reader_to_dict, after, before, limit
+    )
+
+
+async def fetch_reader_loans_page(db, reader_id, status=None, date_from=None, date_to=None,
+                                  after=None, before=None, limit=None):
+    """Страница истории займов читателя, новые займы первыми."""
+    stmt, params = reader_loans_page_statement(reader_id, status, date_from, date_to, keyset_direction(after, before))
+    return await _fetch_page(
+        db, stmt, params, LOAN_SORT_KEY, ("loan_date", "loan_id"), loan_to_dict, after, before, limit
+    )
+
+
+class StreamingPage:
+    """
+    Страница для потокового вывода в шаблон: строки читаются с серверного
+    курсора по мере того, как шаблон их перебирает (async for), и сразу
+    превращаются в словари.
+
+    Курсоры соседних страниц становятся известны только после перебора строк,
+    поэтому навигация в шаблоне выводится после таблицы. Предыдущая страница
+    (before) выбирается в обратном порядке и перед выводом разворачивается
+    в памяти. Ошибка в курсоре (ValueError) возникает сразу, до начала ответа.
+    """
+
+    stream = True
+
+    def __init__(self, stmt, sort_key, key_names, to_dict, after=None, before=None, limit=None, bind=None):
+        self.limit = clamp_limit(limit, MAX_STREAM_PAGE_SIZE)
+        self.stmt = apply_keyset(stmt, sort_key, after=after, before=before, limit=self.limit)
+        self.key_names = key_names
+        self.to_dict = to_dict
+        self.after = after
+        self.before = before
+        self.next_cursor = None
+        self.prev_cursor = None
+        # Движок, с которого читать (реплика); по умолчанию - первичный сервер
+        self.bind = bind
+
+    def cursor_of(self, row):
+        return encode_cursor(getattr(row, name) for name in self.key_names)
+
+    async def __aiter__(self):
+        # Своя сессия: строки читаются уже во время отправки ответа
+        async with (AsyncSessionLocal(bind=self.bind) if self.bind else AsyncSessionLocal()) as db:
+            result = await db.stream(self.stmt.execution_options(yield_per=STREAM_BATCH_SIZE))
+
+            if self.before:
+                rows = [row async for row in result]
+                rows, self.next_cursor, self.prev_cursor = build_page(
+                    rows, self.key_names, before=self.before, limit=self.limit
+                )
+                for row in rows:
+                    yield self.to_dict(row)
+                return
+
+            count = 0
+            async for row in result:
+                if count == self.limit:
+                    # Лишняя строка - есть следующая страница
+                    self.next_cursor = self.cursor_of(last_row)
+                    break
+                if count == 0 and self.after:
+                    self.prev_cursor = self.cursor_of(row)
+                count += 1
+                last_row = row
+                yield self.to_dict(row)
+
+
+def stream_books_page(search="", after=None, before=None, limit=None, filters=None, bind=None):
+    """Страница каталога книг для потокового вывода (см. StreamingPage)."""
+    return StreamingPage(
+        books_statement(search, **(filters or {})), BOOK_SORT_KEY, ("book_name", "book_id"),
+        book_to_dict, after, before, limit, bind
+    )
+
+
+def stream_readers_page(search="", after=None, before=None, limit=None, bind=None):
+    """Страница списка читателей для потокового вывода (см. StreamingPage)."""
+    return StreamingPage(
+        readers_statement(search), READER_SORT_KEY, ("fio", "reader_id"),
+        reader_to_dict, after, before, limit, bind
+    )
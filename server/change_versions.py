@@ -0,0 +1,88 @@
+import datetime
+import hashlib
+import uuid
+
+from fastapi import Depends, HTTPException, Request
+from sqlalchemy import text
+
+from database import get_db, get_read_db
+
+
+# Меняется при каждом запуске: после обновления шаблонов или кода старые ETag
+# не совпадут с новыми
+_PROCESS_SALT = uuid.uuid4().hex[:8]
+
+TABLE_VERSIONS_QUERY = text(
+    "SELECT table_name, version FROM current_table_versions WHERE table_name = ANY(:tables)"
+)
+
+
+async def fetch_versions(db, tables):
+    """Текущие версии таблиц (sql/migrations/005_table_versions.sql, 010_table_version_log.sql)."""
+    return dict((await db.execute(TABLE_VERSIONS_QUERY, {"tables": list(tables)})).all())
+
+
+def make_etag(versions):
+    # Дата входит в ETag: статусы займов ("Просрочена") зависят от текущего дня
+    state = ";".join(f"{table}={versions.get(table)}" for table in sorted(versions))
+    digest = hashlib.sha1(f"{datetime.date.today()}|{state}".encode()).hexdigest()[:16]
+    # Слабый ETag: тело сжимается GZipMiddleware, побайтно ответы различаются
+    return f'W/"{_PROCESS_SALT}-{digest}"'
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Сравнение слабое: префикс W/ не учитывается
+    candidates = [value.strip().removeprefix("W/") for value in if_none_match.split(",")]
+    return etag.removeprefix("W/") in candidates
+
+
+def conditional(*tables, replica=False):
+    """
+    Зависимость для GET-маршрутов, читающих перечисленные таблицы.
+
+    Версии читаются первым запросом сессии, до данных страницы: если между
+    ними произойдет запись, ETag окажется старше данных и следующий запрос
+    просто получит страницу заново. При совпадении If-None-Match отвечает 304,
+    не обращаясь к таблицам каталога; иначе ETag добавляется к ответу
+    через ETagMiddleware, а версии сохраняются в request.state.table_versions.
+
+    replica=True - для маршрутов, читающих через get_read_db: версии читаются
+    той же сессией, что и данные страницы, то есть с того же сервера.
+    """
+    async def check_etag(request: Request, db = Depends(get_read_db if replica else get_db)):
+        versions = await fetch_versions(db, tables)
+        etag = make_etag(versions)
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            raise HTTPException(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+        request.state.etag = etag
+        # Для кэшей, ключом которых служат те же версии (facets.FacetCache)
+        request.state.table_versions = versions
+
+    return Depends(check_etag)
+
+
+class ETagMiddleware:
+    """Добавляет к успешному ответу ETag, вычисленный зависимостью conditional."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message):
+            etag = scope.get("state", {}).get("etag")
+            if message["type"] == "http.response.start" and message["status"] == 200 and etag:
+                # no-cache: браузер хранит страницу, но каждый раз сверяет ETag
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"etag", etag.encode()), (b"cache-control", b"no-cache")
+                ]
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
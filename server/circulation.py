@@ -0,0 +1,230 @@
+from sqlalchemy import select, update, insert, literal, bindparam, any_, func, true, Integer
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.exc import DBAPIError
+
+from models import *
+from catalog import BOOK_AVAILABLE_COUNT
+
+
+# Наибольшее число книг или займов в одном пакетном запросе
+MAX_BATCH_SIZE = 100
+
+# Возврат переносит строку займа из book_loans_open в секцию закрытых займов
+# (миграция 009). Параллельный возврат того же займа, ждавший его блокировку,
+# получает serialization_failure ("tuple to be locked was already moved to
+# another partition"), а не пропускает уже закрытый займ, как без секций
+SERIALIZATION_FAILURE = "40001"
+RETURN_ATTEMPTS = 3
+
+
+def checkout_statement():
+    """
+    Выдача одного экземпляра книги одним оператором; значения - параметры
+    checkout_params.
+
+    Свободный экземпляр захватывается через FOR UPDATE SKIP LOCKED: параллельные
+    выдачи той же книги берут разные экземпляры и не ждут друг друга. Смена
+    состояния экземпляра и запись о выдаче выполняются в том же операторе.
+    """
+    claimed = select(BookItem.book_item_id)\
+        .filter(BookItem.book_id == bindparam('checkout_book_id', type_=Integer), BookItem.book_state == 'Доступна')\
+        .limit(1)\
+        .with_for_update(skip_locked=True)\
+        .cte('claimed')
+
+    updated = update(BookItem)\
+        .where(BookItem.book_item_id == claimed.c.book_item_id)\
+        .values(book_state='Займ')\
+        .returning(BookItem.book_item_id)\
+        .cte('updated')
+
+    # Вставка в таблицу, а не в ORM-класс: с отдельными параметрами ORM
+    # считала бы их строками массовой вставки
+    return insert(BookLoan.__table__).from_select(
+        ['loan_date', 'loan_due_date', 'book_item_id', 'reader_id'],
+        select(
+            bindparam('checkout_loan_date', type_=BookLoan.loan_date.type),
+            bindparam('checkout_loan_due_date', type_=BookLoan.loan_due_date.type),
+            updated.c.book_item_id,
+            bindparam('checkout_reader_id', type_=BookLoan.reader_id.type)
+        )
+    ).returning(BookLoan.loan_id, BookLoan.book_item_id)
+
+
+# Операторы горячего пути выдачи строятся один раз, значения передаются параметрами
+CHECKOUT_STATEMENT = checkout_statement()
+READER_BY_FIO = select(Reader).filter(Reader.fio == bindparam('fio'))
+AVAILABLE_COUNTS = select(Book.book_id, BOOK_AVAILABLE_COUNT)\
+    .filter(Book.book_id == any_(bindparam('book_ids', type_=ARRAY(Integer))))
+
+
+def checkout_params(book_id, reader_id, loan_date, loan_due_date):
+    return {
+        'checkout_book_id': book_id,
+        'checkout_reader_id': reader_id,
+        'checkout_loan_date': loan_date,
+        'checkout_loan_due_date': loan_due_date
+    }
+
+
+async def checkout_book(db, book_id, reader_id, loan_date, loan_due_date):
+    """Выдает экземпляр книги; возвращает (loan_id, book_item_id) или None, если свободных нет."""
+    result = await db.execute(CHECKOUT_STATEMENT, checkout_params(book_id, reader_id, loan_date, loan_due_date))
+    return result.first()
+
+
+def checkout_many_statement(book_ids, reader_id, loan_date, loan_due_date):
+    """
+    Выдача нескольких книг одним оператором.
+
+    Для каждой книги захватывается столько свободных экземпляров, сколько раз
+    она встречается в списке (FOR UPDATE SKIP LOCKED в LATERAL-подзапросе).
+    """
+    requested_ids = func.unnest(literal(list(book_ids), ARRAY(Integer)))\
+        .table_valued('book_id')\
+        .render_derived(name='requested_ids')
+
+    requested = select(
+        requested_ids.c.book_id,
+        func.count().label('wanted')
+    ).group_by(requested_ids.c.book_id).subquery('requested')
+
+    free = select(BookItem.book_item_id, BookItem.book_id)\
+        .filter(BookItem.book_id == requested.c.book_id, BookItem.book_state == 'Доступна')\
+        .limit(requested.c.wanted)\
+        .with_for_update(skip_locked=True)\
+        .lateral('free')
+
+    claimed = select(free.c.book_item_id)\
+        .select_from(requested.join(free, true()))\
+        .cte('claimed')
+
+    updated = update(BookItem)\
+        .where(BookItem.book_item_id == claimed.c.book_item_id)\
+        .values(book_state='Займ')\
+        .returning(BookItem.book_item_id, BookItem.book_id)\
+        .cte('updated')
+
+    inserted = insert(BookLoan).from_select(
+        ['loan_date', 'loan_due_date', 'book_item_id', 'reader_id'],
+        select(
+            literal(loan_date, BookLoan.loan_date.type),
+            literal(loan_due_date, BookLoan.loan_due_date.type),
+            updated.c.book_item_id,
+            literal(reader_id, BookLoan.reader_id.type)
+        )
+    ).returning(BookLoan.loan_id, BookLoan.book_item_id).cte('inserted')
+
+    return select(inserted.c.loan_id, inserted.c.book_item_id, updated.c.book_id)\
+        .join_from(inserted, updated, inserted.c.book_item_id == updated.c.book_item_id)\
+        .order_by(inserted.c.loan_id)
+
+
+async def available_counts(db, book_ids):
+    """
+    Количество свободных экземпляров по книгам: books.available_count плюс
+    журнал book_counts_delta (миграция 014).
+
+    Читается без блокировок и служит быстрой проверкой перед выдачей:
+    книги без свободных экземпляров не доходят до захвата в book_items.
+    Отсутствующих книг в результате нет.
+    """
+    rows = await db.execute(AVAILABLE_COUNTS, {'book_ids': list(set(book_ids))})
+    return dict(rows.all())
+
+
+async def checkout_books(db, book_ids, reader_id, loan_date, loan_due_date):
+    """
+    Выдает читателю список книг (повтор id - еще один экземпляр той же книги).
+
+    Возвращает результат по каждой позиции списка в исходном порядке.
+    Фиксацию транзакции выполняет вызывающий код.
+    """
+    if not book_ids:
+        return []
+
+    available = await available_counts(db, book_ids)
+    candidates = [book_id for book_id in book_ids if available.get(book_id)]
+
+    issued = {}
+    if candidates:
+        stmt = checkout_many_statement(candidates, reader_id, loan_date, loan_due_date)
+        for row in (await db.execute(stmt)).all():
+            issued.setdefault(row.book_id, []).append(row)
+
+    results = []
+    for book_id in book_ids:
+        loans = issued.get(book_id)
+        if loans:
+            loan = loans.pop(0)
+            results.append({"book_id": book_id, "ok": True, "loan_id": loan.loan_id, "book_item_id": loan.book_item_id})
+        elif book_id in available:
+            results.append({"book_id": book_id, "ok": False, "error": "Нет доступных экземпляров этой книги"})
+        else:
+            results.append({"book_id": book_id, "ok": False, "error": "Книга не найдена"})
+
+    return results
+
+
+def return_many_statement(loan_ids, return_date):
+    """Возврат нескольких займов одним оператором: дата возврата и освобождение экземпляров."""
+    returned = update(BookLoan)\
+        .where(BookLoan.loan_id.in_(loan_ids), BookLoan.loan_return_date == None)\
+        .values(loan_return_date=return_date)\
+        .returning(BookLoan.loan_id, BookLoan.book_item_id)\
+        .cte('returned')
+
+    released = update(BookItem)\
+        .where(BookItem.book_item_id == returned.c.book_item_id)\
+        .values(book_state='Доступна')\
+        .returning(BookItem.book_item_id)\
+        .cte('released')
+
+    # released не используется в выборке, но PostgreSQL выполняет изменяющие CTE всегда
+    return select(returned.c.loan_id, returned.c.book_item_id)\
+        .add_cte(released)\
+        .order_by(returned.c.loan_id)
+
+
+async def execute_return(db, loan_ids, return_date):
+    """
+    Выполняет возврат в точке сохранения. Если параллельный возврат успел
+    перенести займ в другую секцию, откатывается только точка сохранения, и
+    оператор повторяется: новый снимок уже видит займ закрытым и пропускает
+    его, а return_loans сообщает, что книга уже возвращена.
+    """
+    for attempt in range(1, RETURN_ATTEMPTS + 1):
+        try:
+            async with db.begin_nested():
+                return (await db.execute(return_many_statement(loan_ids, return_date))).all()
+        except DBAPIError as e:
+            if getattr(e.orig, "sqlstate", None) != SERIALIZATION_FAILURE or attempt == RETURN_ATTEMPTS:
+                raise
+
+
+async def return_loans(db, loan_ids, return_date):
+    """
+    Закрывает список займов; возвращает результат по каждому займу в исходном порядке.
+    Фиксацию транзакции выполняет вызывающий код.
+    """
+    loan_ids = list(dict.fromkeys(loan_ids))
+    if not loan_ids:
+        return []
+
+    returned = {row.loan_id: row for row in await execute_return(db, loan_ids, return_date)}
+
+    not_returned = [loan_id for loan_id in loan_ids if loan_id not in returned]
+    existing = set()
+    if not_returned:
+        existing = set((await db.scalars(select(BookLoan.loan_id).filter(BookLoan.loan_id.in_(not_returned)))).all())
+
+    results = []
+    for loan_id in loan_ids:
+        if loan_id in returned:
+            results.append({"loan_id": loan_id, "ok": True, "book_item_id": returned[loan_id].book_item_id})
+        elif loan_id in existing:
+            results.append({"loan_id": loan_id, "ok": False, "error": "Книга уже возвращена"})
+        else:
+            results.append({"loan_id": loan_id, "ok": False, "error": "Займ не найден"})
+
+    return results
@@ -0,0 +1,47 @@
+import asyncio
+
+from sqlalchemy import text
+
+from database import AsyncSessionLocal, Settings
+
+
+# Журналы приращений: триггеры записи только добавляют в них строки, не
+# блокируя общих строк, а перенос в итоговые строки выполняется здесь
+FOLD_FUNCTIONS = [
+    # Сначала счетчики: их перенос сам пишет в журнал версий
+    "fold_library_stats",     # sql/migrations/011_library_stats_delta.sql
+    "fold_book_counts",       # sql/migrations/014_book_counts_delta.sql
+    "fold_table_versions",    # sql/migrations/010_table_version_log.sql
+]
+
+# Ключ блокировки: журналы переносит только один процесс из нескольких
+FOLD_LOCK_KEY = 7300128
+
+
+async def fold_delta_logs():
+    """
+    Переносит журналы в итоговые строки. Возвращает {функция: число
+    перенесенных строк} или None, если перенос уже выполняет другой процесс.
+    """
+    async with AsyncSessionLocal() as db:
+        if not await db.scalar(text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": FOLD_LOCK_KEY}):
+            return None
+        folded = {}
+        for function in FOLD_FUNCTIONS:
+            folded[function] = await db.scalar(text(f"SELECT {function}()"))
+        await db.commit()
+    return folded
+
+
+async def fold_loop(interval=None):
+    """Фоновый перенос журналов, запускается при старте приложения."""
+    interval = interval or Settings.DELTA_FOLD_SECONDS
+    while True:
+        try:
+            await fold_delta_logs()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error folding delta logs: {e}")
+
+        await asyncio.sleep(interval)
@@ -0,0 +1,109 @@
+import csv
+import io
+import json
+
+from sqlalchemy import func, select, literal_column
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+
+from database import AsyncSessionLocal
+from models import *
+from catalog import loan_status, BOOK_TOTAL_COUNT, BOOK_AVAILABLE_COUNT
+
+
+# Строк, которые читаются с серверного курсора и отдаются клиенту за раз
+EXPORT_BATCH_SIZE = 1000
+
+EXPORT_FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "jsonl": "application/x-ndjson; charset=utf-8",
+}
+
+
+def books_export_statement():
+    """Каталог для выгрузки: книга, справочники, авторы и количество экземпляров."""
+    authors = select(func.string_agg(
+        Author.author_name, aggregate_order_by(literal_column("', '"), Author.author_name)
+    )).join(AuthorBook, AuthorBook.author_id == Author.author_id)\
+        .filter(AuthorBook.book_id == Book.book_id)\
+        .scalar_subquery()
+
+    return select(
+        Book.book_id,
+        Book.book_name,
+        authors.label('authors'),
+        Publisher.publisher_name.label('publisher'),
+        Theme.theme_name.label('theme'),
+        Book.release_date,
+        Book.isbn,
+        BOOK_TOTAL_COUNT.label('total_count'),
+        BOOK_AVAILABLE_COUNT.label('available_count')
+    ).outerjoin(Publisher, Book.publisher_id == Publisher.publisher_id)\
+     .outerjoin(Theme, Book.theme_id == Theme.theme_id)\
+     .order_by(Book.book_id)
+
+
+def loans_export_statement(date_from=None, date_to=None):
+    """История займов для выгрузки вместе с читателем, книгой и статусом."""
+    stmt = select(
+        BookLoan.loan_id,
+        BookLoan.loan_date,
+        BookLoan.loan_due_date,
+        BookLoan.loan_return_date,
+        loan_status,
+        BookLoan.reader_id,
+        Reader.fio.label('reader_fio'),
+        BookLoan.book_item_id,
+        Book.book_id,
+        Book.book_name
+    ).join(Reader, BookLoan.reader_id == Reader.reader_id)\
+     .join(BookItem, BookLoan.book_item_id == BookItem.book_item_id)\
+     .join(Book, BookItem.book_id == Book.book_id)\
+     .order_by(BookLoan.loan_id)
+
+    if date_from:
+        stmt = stmt.filter(BookLoan.loan_date >= date_from)
+
+    if date_to:
+        stmt = stmt.filter(BookLoan.loan_date <= date_to)
+
+    return stmt
+
+
+def _json_value(value):
+    return value.isoformat() if hasattr(value, "isoformat") else value
+
+
+def _csv_chunk(rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue().encode("utf-8")
+
+
+def _jsonl_chunk(columns, rows):
+    return "".join(
+        json.dumps({column: _json_value(value) for column, value in zip(columns, row)}, ensure_ascii=False) + "\n"
+        for row in rows
+    ).encode("utf-8")
+
+
+async def stream_export(stmt, file_format="csv"):
+    """
+    Построчная выгрузка результата запроса в CSV или JSONL.
+
+    Строки читаются с серверного курсора пачками по EXPORT_BATCH_SIZE, поэтому
+    память не зависит от размера таблицы. Сессия открывается внутри генератора
+    и живет, пока клиент читает ответ.
+    """
+    columns = [column.name for column in stmt.selected_columns]
+
+    if file_format == "csv":
+        # BOM нужен, чтобы Excel открыл кириллицу без перекодировки
+        yield "\ufeff".encode("utf-8") + _csv_chunk([columns])
+
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(stmt.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        async for rows in result.partitions():
+            if file_format == "csv":
+                yield _csv_chunk(rows)
+            else:
+                yield _jsonl_chunk(columns, rows)
@@ -0,0 +1,180 @@
+import asyncio
+import time
+
+from sqlalchemy import case, func, literal_column, null, select, union_all
+
+from database import Settings
+from models import *
+from catalog import book_filters
+
+
+# Значений фасета в ответе: самые частые (авторы отбираются в запросе)
+FACET_LIMIT = 20
+# Ширина интервала годов выпуска
+YEAR_BUCKET = 10
+
+# grouping(theme_id, publisher_id, decade): бит выставлен для столбца,
+# по которому строка не группируется
+FACET_BY_GROUPING = {3: "theme", 5: "publisher", 6: "year", 7: "total"}
+
+# Таблицы, из которых считаются фасеты без фильтров: ключ кэша. Версия books
+# меняется только при изменении описания книги (миграция 014), количество
+# экземпляров (book_counts_delta) фасеты без фильтра не читают
+FACET_TABLES = ("books", "publishers", "themes", "authors", "author_book")
+
+
+def facets_statement(**filters):
+    """
+    Количество книг по темам, издателям, десятилетиям выпуска и авторам
+    для текущего фильтра одним запросом: отобранные книги группируются через
+    GROUPING SETS, авторы (книга может иметь нескольких) считаются отдельной
+    ветвью UNION ALL по тому же CTE.
+    """
+    filtered = select(
+        Book.book_id,
+        Book.theme_id,
+        Book.publisher_id,
+        ((Book.release_date // YEAR_BUCKET) * YEAR_BUCKET).label("decade")
+    ).filter(*book_filters(**filters)).cte("filtered")
+
+    grouped = select(
+        filtered.c.theme_id,
+        filtered.c.publisher_id,
+        filtered.c.decade,
+        func.grouping(filtered.c.theme_id, filtered.c.publisher_id, filtered.c.decade).label("grouping_id"),
+        func.count().label("count")
+    ).group_by(
+        func.grouping_sets(filtered.c.theme_id, filtered.c.publisher_id, filtered.c.decade, literal_column("()"))
+    ).subquery()
+
+    groups = select(
+        grouped.c.grouping_id,
+        case(
+            (grouped.c.grouping_id == 3, grouped.c.theme_id),
+            (grouped.c.grouping_id == 5, grouped.c.publisher_id),
+            else_=grouped.c.decade
+        ).label("value"),
+        func.coalesce(Theme.theme_name, Publisher.publisher_name).label("name"),
+        grouped.c.count
+    ).select_from(grouped)\
+     .outerjoin(Theme, Theme.theme_id == grouped.c.theme_id)\
+     .outerjoin(Publisher, Publisher.publisher_id == grouped.c.publisher_id)
+
+    # Имена присоединяются только к самым частым авторам
+    top_authors = select(
+        AuthorBook.author_id,
+        func.count().label("count")
+    ).select_from(filtered)\
+     .join(AuthorBook, AuthorBook.book_id == filtered.c.book_id)\
+     .group_by(AuthorBook.author_id)\
+     .order_by(func.count().desc(), AuthorBook.author_id)\
+     .limit(FACET_LIMIT)\
+     .subquery()
+
+    authors = select(
+        null().label("grouping_id"),
+        top_authors.c.author_id,
+        Author.author_name,
+        top_authors.c.count
+    ).join(Author, Author.author_id == top_authors.c.author_id)
+
+    return union_all(groups, authors)
+
+
+async def compute_facets(db, **filters):
+    rows = (await db.execute(facets_statement(**filters))).all()
+
+    facets = {"theme": [], "publisher": [], "author": [], "year": []}
+    total = 0
+    for grouping_id, value, name, count in rows:
+        facet = "author" if grouping_id is None else FACET_BY_GROUPING[grouping_id]
+        if facet == "total":
+            total = count
+        elif value is None:
+            # Книги без темы/издателя/года: по отсутствующему значению не фильтруют
+            continue
+        elif facet == "year":
+            facets["year"].append({"from": value, "to": value + YEAR_BUCKET - 1, "count": count})
+        else:
+            facets[facet].append({"id": value, "name": name, "count": count})
+
+    for facet in ("theme", "publisher", "author"):
+        facets[facet] = sorted(facets[facet], key=lambda item: (-item["count"], item["name"] or ""))[:FACET_LIMIT]
+    facets["year"].sort(key=lambda item: item["from"], reverse=True)
+
+    return {"total": total, "facets": facets}
+
+
+class FacetCache:
+    """
+    Фасеты каталога без фильтров. Их подсчет - полный просмотр books и
+    author_book, поэтому одновременные промахи ждут одного подсчета.
+
+    Значение хранится вместе с версиями таблиц FACET_TABLES, прочитанными
+    conditional() до подсчета, и отдается только запросу с теми же версиями:
+    после записи в каталог версии и ETag меняются, и фасеты считаются заново -
+    ответ с новым ETag не может содержать старые количества. Выдачи и
+    возвраты эти версии не меняют. ttl - предельный возраст значения в секундах.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._value = None
+        self._versions = None
+        self._expires = 0.0
+        self._lock = asyncio.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _fresh(self, versions):
+        return self._value is not None and self._versions == versions and time.monotonic() < self._expires
+
+    async def get(self, versions, compute):
+        versions = tuple(sorted(versions.items()))
+        if self._fresh(versions):
+            self.hits += 1
+            return self._value
+
+        async with self._lock:
+            if self._fresh(versions):
+                self.hits += 1
+                return self._value
+            self.misses += 1
+            value = await compute()
+            self._value, self._versions = value, versions
+            self._expires = time.monotonic() + self.ttl
+            return value
+
+    def clear(self):
+        self._value = None
+        self._versions = None
+
+    def stats(self):
+        cached = self._value is not None and time.monotonic() < self._expires
+        return {
+            "ttl": self.ttl,
+            "cached": cached,
+            "versions": dict(self._versions) if cached else None,
+            "expires_in": round(self._expires - time.monotonic(), 1) if cached else None,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+facet_cache = FacetCache(Settings.FACET_CACHE_SECONDS)
+
+
+async def fetch_facets(db, versions=None, **filters):
+    """
+    Фасеты для фильтра. Без фильтров (и при FACET_CACHE_SECONDS > 0) - из
+    кэша; versions - версии таблиц каталога, прочитанные той же сессией
+    (request.state.table_versions, должны включать FACET_TABLES), без них
+    кэш не используется.
+    """
+    unfiltered = not filters.get("search", "").strip() and \
+        all(value is None for key, value in filters.items() if key != "search")
+
+    if unfiltered and versions is not None and facet_cache.ttl > 0:
+        versions = {table: versions.get(table) for table in FACET_TABLES}
+        return await facet_cache.get(versions, lambda: compute_facets(db))
+    return await compute_facets(db, **filters)
@@ -0,0 +1,310 @@
+import csv
+import datetime
+import json
+import time
+
+from sqlalchemy import text
+
+
+COPY_BATCH_SIZE = 5000
+MAX_REPORTED_ERRORS = 1000
+MAX_COPIES_PER_ROW = 10000
+
+STAGING_COLUMNS = [
+    "row_no", "book_name", "authors_list", "publisher_name", "isbn",
+    "release_date", "theme_name", "number_of_books", "acquisition_date"
+]
+
+
+class RowError(ValueError):
+    pass
+
+
+class ImportReport:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.rows_received = 0
+        self.rows_staged = 0
+        self.errors = []
+        self.errors_total = 0
+        self.counts = {}
+
+    def add_error(self, row_no, message):
+        self.errors_total += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"row": row_no, "error": message})
+
+    def as_dict(self):
+        elapsed = time.perf_counter() - self.started
+        rows_imported = self.rows_staged - self.counts.get("rows_rejected", 0)
+        return {
+            "rows_received": self.rows_received,
+            "rows_imported": rows_imported,
+            "rows_failed": self.errors_total,
+            "publishers_created": self.counts.get("publishers_created", 0),
+            "themes_created": self.counts.get("themes_created", 0),
+            "authors_created": self.counts.get("authors_created", 0),
+            "books_created": self.counts.get("books_created", 0),
+            "items_created": self.counts.get("items_created", 0),
+            "elapsed_seconds": round(elapsed, 3),
+            "rows_per_second": round(self.rows_received / elapsed, 1) if elapsed > 0 else None,
+            "errors": self.errors,
+            "errors_truncated": self.errors_total > len(self.errors)
+        }
+
+
+def _clean(value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def parse_row(row_no, data, today):
+    """Проверяет строку импорта и возвращает запись для COPY во временную таблицу."""
+    if not isinstance(data, dict):
+        raise RowError("Ожидался объект с полями книги")
+
+    book_name = _clean(data.get("book_name"))
+    if not book_name:
+        raise RowError("Название книги обязательно")
+
+    release_date = _clean(data.get("release_date"))
+    if release_date is not None:
+        try:
+            release_date = int(release_date)
+        except ValueError:
+            raise RowError(f"Некорректный год выпуска: {release_date}")
+        if not -32768 <= release_date <= 32767:
+            raise RowError(f"Некорректный год выпуска: {release_date}")
+
+    number_of_books = _clean(data.get("number_of_books"))
+    if number_of_books is None:
+        number_of_books = 1
+    else:
+        try:
+            number_of_books = int(number_of_books)
+        except ValueError:
+            raise RowError(f"Некорректное количество экземпляров: {number_of_books}")
+        if not 1 <= number_of_books <= MAX_COPIES_PER_ROW:
+            raise RowError(f"Количество экземпляров должно быть от 1 до {MAX_COPIES_PER_ROW}")
+
+    acquisition_date = _clean(data.get("acquisition_date"))
+    if acquisition_date is None:
+        acquisition_date = today
+    else:
+        try:
+            acquisition_date = datetime.date.fromisoformat(acquisition_date)
+        except ValueError:
+            raise RowError(f"Неверный формат даты поступления: {acquisition_date}. Используйте YYYY-MM-DD")
+
+    return (
+        row_no,
+        book_name,
+        _clean(data.get("authors")),
+        _clean(data.get("publisher")),
+        _clean(data.get("isbn")),
+        release_date,
+        _clean(data.get("theme")),
+        number_of_books,
+        acquisition_date
+    )
+
+
+async def iter_lines(chunks):
+    """Разбивает поток байтов на строки, не держа весь файл в памяти."""
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8-sig").rstrip("\r")
+    if buffer:
+        yield buffer.decode("utf-8-sig").rstrip("\r")
+
+
+async def iter_csv_records(chunks):
+    """
+    Разбирает CSV с заголовком построчно.
+
+    Поле в кавычках может содержать перевод строки, поэтому физические строки
+    склеиваются, пока количество кавычек в записи не станет четным.
+    """
+    header = None
+    pending = None
+    row_no = 0
+
+    async for line in iter_lines(chunks):
+        pending = line if pending is None else pending + "\n" + line
+        if pending.count('"') % 2:
+            continue
+
+        record, pending = pending, None
+        if header is None:
+            header = [name.strip() for name in next(csv.reader([record]))]
+            continue
+
+        row_no += 1
+        if not record.strip():
+            continue
+        values = next(csv.reader([record]))
+        yield row_no, dict(zip(header, values))
+
+    if pending is not None:
+        yield row_no + 1, RowError("Незакрытая кавычка в конце файла")
+
+
+async def iter_jsonl_records(chunks):
+    row_no = 0
+    async for line in iter_lines(chunks):
+        row_no += 1
+        if not line.strip():
+            continue
+        try:
+            yield row_no, json.loads(line)
+        except json.JSONDecodeError as e:
+            yield row_no, RowError(f"Некорректный JSON: {e.msg}")
+
+
+# Множественная обработка загруженных строк - та же семантика, что у register_book/add_authors
+RESOLVE_STATEMENTS = [
+    ("publishers_created", """
+        INSERT INTO publishers (publisher_name)
+        SELECT DISTINCT publisher_name FROM import_books
+        WHERE publisher_name IS NOT NULL
+        ON CONFLICT (publisher_name) DO NOTHING
+    """),
+    ("themes_created", """
+        INSERT INTO themes (theme_name)
+        SELECT DISTINCT theme_name FROM import_books
+        WHERE theme_name IS NOT NULL
+        ON CONFLICT (theme_name) DO NOTHING
+    """),
+    ("authors_created", """
+        INSERT INTO authors (author_name)
+        SELECT DISTINCT trim(name)
+        FROM import_books, unnest(string_to_array(authors_list, ',')) AS author_name(name)
+        WHERE trim(name) <> ''
+        ON CONFLICT (author_name) DO NOTHING
+    """),
+    # Существующие книги ищутся по паре (название, ISBN), как в register_book
+    (None, """
+        UPDATE import_books AS s SET book_id = (
+            SELECT min(b.book_id) FROM books AS b
+            WHERE b.book_name = s.book_name AND b.isbn IS NOT DISTINCT FROM s.isbn
+        )
+    """),
+    # Новые книги: одна на пару (название, ISBN); ISBN, занятый другой книгой, - ошибка строки
+    ("books_created", """
+        WITH new_books AS (
+            INSERT INTO books (book_name, publisher_id, isbn, release_date, theme_id)
+            SELECT DISTINCT ON (s.book_name, s.isbn)
+                s.book_name, p.publisher_id, s.isbn, s.release_date, t.theme_id
+            FROM import_books AS s
+            LEFT JOIN publishers AS p ON p.publisher_name = s.publisher_name
+            LEFT JOIN themes AS t ON t.theme_name = s.theme_name
+            WHERE s.book_id IS NULL
+            AND NOT EXISTS (SELECT 1 FROM books WHERE books.isbn = s.isbn)
+            AND NOT EXISTS (
+                SELECT 1 FROM import_books AS o
+                WHERE o.isbn = s.isbn AND o.book_name <> s.book_name
+                AND o.book_id IS NULL AND o.row_no < s.row_no
+            )
+            ORDER BY s.book_name, s.isbn, s.row_no
+            RETURNING book_id, book_name, isbn
+        )
+        , matched AS (
+            UPDATE import_books AS s SET book_id = nb.book_id
+            FROM new_books AS nb
+            WHERE s.book_id IS NULL
+            AND nb.book_name = s.book_name AND nb.isbn IS NOT DISTINCT FROM s.isbn
+            RETURNING s.row_no
+        )
+        SELECT count(*) FROM new_books
+    """),
+    ("items_created", """
+        INSERT INTO book_items (book_id, acquisition_date)
+        SELECT s.book_id, s.acquisition_date
+        FROM import_books AS s, generate_series(1, s.number_of_books)
+        WHERE s.book_id IS NOT NULL
+    """),
+    (None, """
+        INSERT INTO author_book (book_id, author_id)
+        SELECT DISTINCT s.book_id, a.author_id
+        FROM import_books AS s,
+            unnest(string_to_array(s.authors_list, ',')) AS parsed_author_name
+        JOIN authors AS a ON a.author_name = trim(parsed_author_name)
+        WHERE s.book_id IS NOT NULL
+        ON CONFLICT (author_id, book_id) DO NOTHING
+    """),
+]
+
+
+async def import_books(db, chunks, file_format="csv"):
+    """
+    Потоковый импорт каталога: строки проверяются и пачками копируются (COPY)
+    во временную таблицу, после чего издатели, темы, авторы, книги и экземпляры
+    создаются несколькими операторами над всем набором. Все - в одной транзакции.
+    """
+    report = ImportReport()
+    today = datetime.date.today()
+
+    await db.execute(text("""
+        CREATE TEMP TABLE import_books (
+            row_no int PRIMARY KEY,
+            book_name text NOT NULL,
+            authors_list text,
+            publisher_name text,
+            isbn text,
+            release_date smallint,
+            theme_name text,
+            number_of_books int NOT NULL,
+            acquisition_date date NOT NULL,
+            book_id int
+        ) ON COMMIT DROP
+    """))
+
+    connection = await db.connection()
+    raw_connection = await connection.get_raw_connection()
+    driver_connection = raw_connection.driver_connection
+
+    records = iter_jsonl_records(chunks) if file_format == "jsonl" else iter_csv_records(chunks)
+    batch = []
+
+    async for row_no, data in records:
+        report.rows_received += 1
+        try:
+            if isinstance(data, RowError):
+                raise data
+            batch.append(parse_row(row_no, data, today))
+        except RowError as e:
+            report.add_error(row_no, str(e))
+            continue
+
+        if len(batch) >= COPY_BATCH_SIZE:
+            await driver_connection.copy_records_to_table("import_books", records=batch, columns=STAGING_COLUMNS)
+            report.rows_staged += len(batch)
+            batch = []
+
+    if batch:
+        await driver_connection.copy_records_to_table("import_books", records=batch, columns=STAGING_COLUMNS)
+        report.rows_staged += len(batch)
+
+    if report.rows_staged:
+        await db.execute(text("ANALYZE import_books"))
+
+        for name, statement in RESOLVE_STATEMENTS:
+            result = await db.execute(text(statement))
+            if name:
+                # Оператор с CTE возвращает счетчик строкой, остальные - через rowcount
+                report.counts[name] = result.scalar() if result.returns_rows else result.rowcount
+
+        rejected = (await db.execute(text(
+            "SELECT row_no, isbn FROM import_books WHERE book_id IS NULL ORDER BY row_no"
+        ))).all()
+        for row in rejected:
+            report.add_error(row.row_no, f"ISBN {row.isbn} уже принадлежит другой книге")
+        report.counts["rows_rejected"] = len(rejected)
+
+    await db.commit()
+    return report.as_dict()
@@ -0,0 +1,173 @@
+from sqlalchemy import select, update, exists, literal, any_, Integer
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from models import *
+
+
+# Наибольшее число экземпляров (или длина диапазона id) в одном запросе
+MAX_ITEMS_PER_REQUEST = 20000
+# Сколько id каждой причины отказа показывать в ответе
+SUMMARY_SAMPLE_SIZE = 20
+# Наибольшее значение столбца integer: большие id не проходят в запрос
+MAX_ID = 2**31 - 1
+
+# Действия: новое состояние и состояния, из которых переход допустим.
+# Экземпляры с открытым займом не изменяются ни одним действием.
+ITEM_TRANSITIONS = {
+    "write_off": ("Списана", ("Доступна", "Утеряна")),
+    "lost": ("Утеряна", ("Доступна",)),
+    "restore": ("Доступна", ("Списана", "Утеряна")),
+}
+
+
+def _parse_id(value):
+    # bool - подкласс int, а int() отбрасывает дробную часть: true и 1.5
+    # изменили бы экземпляр 1
+    if isinstance(value, (bool, float)):
+        raise ValueError
+    value = int(value)
+    if not 0 < value <= MAX_ID:
+        raise ValueError
+    return value
+
+
+def parse_item_selection(data):
+    """
+    Экземпляры из тела запроса: список book_item_ids или диапазон from_id..to_id
+    (включительно). Возвращает (список id или None, диапазон или None).
+    """
+    ids = data.get("book_item_ids")
+    from_id, to_id = data.get("from_id"), data.get("to_id")
+
+    if ids is not None and (from_id is not None or to_id is not None):
+        raise ValueError("Укажите либо book_item_ids, либо диапазон from_id и to_id")
+
+    if ids is not None:
+        if not isinstance(ids, list) or not ids:
+            raise ValueError("Поле book_item_ids должно быть непустым списком")
+        try:
+            ids = list(dict.fromkeys(_parse_id(item_id) for item_id in ids))
+        except (TypeError, ValueError):
+            raise ValueError("Поле book_item_ids должно содержать целые положительные числа")
+        if len(ids) > MAX_ITEMS_PER_REQUEST:
+            raise ValueError(f"Не более {MAX_ITEMS_PER_REQUEST} экземпляров за один запрос")
+        return ids, None
+
+    if from_id is None or to_id is None:
+        raise ValueError("Укажите book_item_ids или диапазон from_id и to_id")
+    try:
+        from_id, to_id = _parse_id(from_id), _parse_id(to_id)
+    except (TypeError, ValueError):
+        raise ValueError("from_id и to_id должны быть целыми положительными числами")
+    if from_id > to_id:
+        raise ValueError("from_id не может быть больше to_id")
+    if to_id - from_id + 1 > MAX_ITEMS_PER_REQUEST:
+        raise ValueError(f"Диапазон не может быть длиннее {MAX_ITEMS_PER_REQUEST} id")
+    return None, (from_id, to_id)
+
+
+def item_state_statement(action, ids=None, id_range=None, reason=None):
+    """
+    Смена состояния экземпляров одним оператором.
+
+    Выбранные экземпляры блокируются (FOR UPDATE, по возрастанию id - без
+    взаимных блокировок с другими пакетами) вместе с признаком открытого
+    займа: параллельная выдача пропускает их (SKIP LOCKED), а займ не может
+    появиться между проверкой и изменением. UPDATE ... RETURNING меняет только
+    экземпляры в допустимом исходном состоянии и без займа; выборка
+    возвращает каждый найденный экземпляр с отметкой, изменен ли он.
+    """
+    state, sources = ITEM_TRANSITIONS[action]
+
+    if ids is not None:
+        selection = BookItem.book_item_id == any_(literal(ids, ARRAY(Integer)))
+    else:
+        selection = BookItem.book_item_id.between(*id_range)
+
+    on_loan = exists().where(BookLoan.book_item_id == BookItem.book_item_id, BookLoan.loan_return_date == None)
+
+    candidates = select(BookItem.book_item_id, BookItem.book_state, on_loan.label("on_loan"))\
+        .filter(selection)\
+        .order_by(BookItem.book_item_id)\
+        .with_for_update(of=BookItem)\
+        .cte("candidates")
+
+    # Причина хранится у списанных и утерянных экземпляров, восстановление ее очищает
+    updated = update(BookItem)\
+        .where(
+            BookItem.book_item_id == candidates.c.book_item_id,
+            candidates.c.book_state.in_(sources),
+            ~candidates.c.on_loan
+        )\
+        .values(book_state=state, write_of_reasons=None if action == "restore" else reason)\
+        .returning(BookItem.book_item_id)\
+        .cte("updated")
+
+    return select(
+        candidates.c.book_item_id,
+        candidates.c.book_state,
+        candidates.c.on_loan,
+        (updated.c.book_item_id != None).label("changed")
+    ).outerjoin(updated, updated.c.book_item_id == candidates.c.book_item_id)\
+     .order_by(candidates.c.book_item_id)
+
+
+def id_ranges(ids):
+    """Сжимает отсортированный список id в диапазоны [[1, 5], [8, 8], ...]."""
+    ranges = []
+    for item_id in ids:
+        if ranges and item_id == ranges[-1][1] + 1:
+            ranges[-1][1] = item_id
+        else:
+            ranges.append([item_id, item_id])
+    return ranges
+
+
+def _sample(ids):
+    return {"count": len(ids), "ids": ids[:SUMMARY_SAMPLE_SIZE]}
+
+
+async def change_item_states(db, action, ids=None, id_range=None, reason=None):
+    """
+    Применяет действие к экземплярам и возвращает сводку: сколько изменено
+    (и какие - диапазонами id) и сколько пропущено по каждой причине.
+    Фиксацию транзакции выполняет вызывающий код.
+    """
+    if action not in ITEM_TRANSITIONS:
+        raise ValueError(f"Неизвестное действие: {action}. Доступны: {', '.join(ITEM_TRANSITIONS)}")
+    state = ITEM_TRANSITIONS[action][0]
+    if action == "write_off" and not (reason or "").strip():
+        raise ValueError("Для списания укажите причину (reason)")
+
+    rows = (await db.execute(item_state_statement(action, ids, id_range, (reason or "").strip() or None))).all()
+
+    changed, active_loan, already, invalid = [], [], [], {}
+    for row in rows:
+        if row.changed:
+            changed.append(row.book_item_id)
+        elif row.on_loan:
+            active_loan.append(row.book_item_id)
+        elif row.book_state == state:
+            already.append(row.book_item_id)
+        else:
+            invalid.setdefault(row.book_state or "Не указано", []).append(row.book_item_id)
+
+    skipped = {
+        "active_loan": _sample(active_loan),
+        "already_in_state": _sample(already),
+        "invalid_state": {state_name: _sample(item_ids) for state_name, item_ids in invalid.items()},
+    }
+    if ids is not None:
+        # В диапазоне отсутствующие id - обычные пропуски нумерации, о них не сообщается
+        found = {row.book_item_id for row in rows}
+        skipped["not_found"] = _sample([item_id for item_id in ids if item_id not in found])
+
+    return {
+        "action": action,
+        "state": state,
+        "requested": len(ids) if ids is not None else id_range[1] - id_range[0] + 1,
+        "found": len(rows),
+        "changed": len(changed),
+        "changed_ranges": id_ranges(changed),
+        "skipped": skipped
+    }
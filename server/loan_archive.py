@@ -0,0 +1,272 @@
+import asyncio
+import datetime
+import gzip
+import os
+import time
+
+from sqlalchemy import text
+
+from database import AsyncSessionLocal, async_engine, Settings
+
+
+# Обслуживание секций book_loans (миграция 009): раз в сутки
+MAINTENANCE_INTERVAL = 24 * 60 * 60
+# Ключ блокировки: архивирует только один процесс из нескольких
+ARCHIVE_LOCK_KEY = 7300127
+# Сколько ждать блокировку секции при отсоединении, прежде чем отложить архив
+DETACH_LOCK_TIMEOUT = "5s"
+
+PARTITION_PREFIX = "book_loans_closed_"
+# Закрытые займы годов без своей секции: в том числе возвращенные после
+# архивирования их года
+DEFAULT_PARTITION = "book_loans_closed_default"
+
+# Секции без действительного уникального индекса по одному столбцу loan_id
+# (у book_loans нет первичного ключа, см. миграцию 012)
+MISSING_LOAN_ID_KEYS = text("""
+    SELECT c.relname
+    FROM pg_partition_tree('book_loans') AS t
+    JOIN pg_class AS c ON c.oid = t.relid
+    WHERE t.isleaf AND NOT EXISTS (
+        SELECT 1
+        FROM pg_index AS i
+        JOIN pg_attribute AS a ON a.attrelid = c.oid AND a.attnum = i.indkey[0]
+        WHERE i.indrelid = c.oid AND i.indisunique AND i.indisvalid
+          AND i.indnatts = 1 AND i.indpred IS NULL AND a.attname = 'loan_id'
+    )
+    ORDER BY c.relname
+""")
+
+
+async def list_loan_partitions(db):
+    """Секции book_loans с оценкой числа строк (по статистике, без подсчета)."""
+    rows = await db.execute(text("""
+        SELECT c.relname, p.relname AS parent, c.reltuples::bigint AS rows,
+               pg_get_expr(c.relpartbound, c.oid) AS bound
+        FROM pg_inherits AS i
+        JOIN pg_class AS c ON c.oid = i.inhrelid
+        JOIN pg_class AS p ON p.oid = i.inhparent
+        WHERE p.relname IN ('book_loans', 'book_loans_closed')
+        ORDER BY c.relname
+    """))
+    return [
+        {"name": row.relname, "parent": row.parent, "rows": max(row.rows, 0), "bound": row.bound}
+        for row in rows
+    ]
+
+
+async def ensure_loan_partitions(db, years_ahead=1):
+    """
+    Создает секции закрытых займов до следующего года включительно.
+    Возвращает имена созданных секций или None, если секции обслуживает
+    (создает или архивирует) другой процесс.
+    """
+    # Та же блокировка, что у архивирования: два процесса не создают одну секцию
+    # одновременно и не создают секцию, пока другой отсоединяет соседнюю
+    if not await db.scalar(text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": ARCHIVE_LOCK_KEY}):
+        await db.rollback()
+        return None
+
+    current_year = datetime.date.today().year
+    created = []
+    for year in range(current_year, current_year + years_ahead + 1):
+        name = await db.scalar(text("SELECT create_book_loans_partition(:year)"), {"year": year})
+        if name:
+            created.append(name)
+    await db.commit()
+    return created
+
+
+async def ensure_loan_id_keys():
+    """
+    Строит уникальный индекс по loan_id в секциях, где его нет. Индексы
+    строит миграция 013; здесь - запасной вариант для секций, прикрепленных
+    вручную, или если построение в миграции было прервано. CONCURRENTLY -
+    вне транзакции, запись в секцию не блокируется. Возвращает имена секций,
+    получивших индекс.
+    """
+    async with async_engine.connect() as connection:
+        connection = await connection.execution_options(isolation_level="AUTOCOMMIT")
+        if not await connection.scalar(text("SELECT pg_try_advisory_lock(:key)"), {"key": ARCHIVE_LOCK_KEY}):
+            return []
+
+        await connection.execute(text("SET statement_timeout = 0"))
+        try:
+            names = (await connection.scalars(MISSING_LOAN_ID_KEYS)).all()
+            for name in names:
+                # Индекс с этим именем, оставшийся от прерванного построения, нерабочий
+                await connection.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}_loan_id_key"'))
+                await connection.execute(text(f'CREATE UNIQUE INDEX CONCURRENTLY "{name}_loan_id_key" ON "{name}" (loan_id)'))
+        finally:
+            await connection.execute(text("RESET statement_timeout"))
+            await connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": ARCHIVE_LOCK_KEY})
+    return names
+
+
+def archive_path(year):
+    return os.path.join(Settings.LOAN_ARCHIVE_DIR, f"book_loans_{year}.csv.gz")
+
+
+async def _export_query(db, query, path, *args):
+    """Выгружает результат запроса в gzip CSV через COPY в той же транзакции."""
+    connection = await db.connection()
+    raw = (await connection.get_raw_connection()).driver_connection
+
+    with gzip.open(path, "wb") as archive:
+        async def write(chunk):
+            # Сжатие - в потоке, чтобы не останавливать обработку запросов
+            await asyncio.to_thread(archive.write, chunk)
+
+        await raw.copy_from_query(query, *args, output=write, format="csv", header=True)
+
+
+async def archive_partition(year):
+    """
+    Выгружает закрытые займы года в файл и удаляет их секцию.
+
+    Секция блокируется от записи на время выгрузки, затем отсоединяется и
+    удаляется в той же транзакции; счетчики library_stats учитывают только
+    открытые займы и не меняются. Файл пишется под временным именем и
+    получает окончательное имя только после фиксации - при ошибке данные
+    остаются в базе. Возвращает число выгруженных займов.
+    """
+    name = f"{PARTITION_PREFIX}{year}"
+    path = archive_path(year)
+    partial = path + ".partial"
+    os.makedirs(Settings.LOAN_ARCHIVE_DIR, exist_ok=True)
+
+    try:
+        async with AsyncSessionLocal() as db:
+            await db.execute(text("SET LOCAL statement_timeout = 0"))
+            await db.execute(text(f"SET LOCAL lock_timeout = '{DETACH_LOCK_TIMEOUT}'"))
+            await db.execute(text(f'LOCK TABLE "{name}" IN SHARE MODE'))
+
+            count = await db.scalar(text(f'SELECT count(*) FROM "{name}"'))
+            await _export_query(db, f'SELECT * FROM "{name}" ORDER BY loan_id', partial)
+
+            await db.execute(text(f'ALTER TABLE book_loans_closed DETACH PARTITION "{name}"'))
+            await db.execute(text(f'DROP TABLE "{name}"'))
+            # Удаление секции не вызывает триггер версии - ETag истории займов сбрасывается явно
+            await db.execute(text("UPDATE table_versions SET version = version + 1 WHERE table_name = 'book_loans'"))
+            await db.commit()
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+
+    os.replace(partial, path)
+    return count
+
+
+def late_archive_path(cutoff_year):
+    stamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+    return os.path.join(Settings.LOAN_ARCHIVE_DIR, f"book_loans_before_{cutoff_year}_{stamp}.csv.gz")
+
+
+async def archive_default_partition(cutoff_year):
+    """
+    Выгружает из секции по умолчанию закрытые займы, выданные раньше
+    cutoff_year, и удаляет их. Туда попадают займы уже архивированных лет,
+    возвращенные после архивирования: своей секции у их года больше нет.
+    Каждый запуск пишет отдельный файл. Возвращает (число займов, файл или None).
+    """
+    cutoff = datetime.date(cutoff_year, 1, 1)
+    path = late_archive_path(cutoff_year)
+    partial = path + ".partial"
+    os.makedirs(Settings.LOAN_ARCHIVE_DIR, exist_ok=True)
+
+    try:
+        async with AsyncSessionLocal() as db:
+            await db.execute(text("SET LOCAL statement_timeout = 0"))
+            await db.execute(text(f"SET LOCAL lock_timeout = '{DETACH_LOCK_TIMEOUT}'"))
+            # Возвраты в секцию по умолчанию ждут до конца выгрузки, остальные не затрагиваются
+            await db.execute(text(f"LOCK TABLE {DEFAULT_PARTITION} IN SHARE MODE"))
+
+            count = await db.scalar(
+                text(f"SELECT count(*) FROM {DEFAULT_PARTITION} WHERE loan_date < :cutoff"), {"cutoff": cutoff}
+            )
+            if not count:
+                await db.rollback()
+                return 0, None
+
+            await _export_query(
+                db, f"SELECT * FROM {DEFAULT_PARTITION} WHERE loan_date < $1 ORDER BY loan_id", partial, cutoff
+            )
+            await db.execute(text(f"DELETE FROM {DEFAULT_PARTITION} WHERE loan_date < :cutoff"), {"cutoff": cutoff})
+            # Удаление из секции напрямую не вызывает триггер версии book_loans
+            await db.execute(text("UPDATE table_versions SET version = version + 1 WHERE table_name = 'book_loans'"))
+            await db.commit()
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+
+    os.replace(partial, path)
+    return count, path
+
+
+async def archive_old_loans(years=None):
+    """
+    Архивирует годовые секции закрытых займов, которые целиком старше years лет,
+    и такие же займы из секции по умолчанию (year у этой записи - None).
+    Возвращает список {"year", "loans", "file"} или None, если архивирует другой процесс.
+    """
+    years = years or Settings.LOAN_ARCHIVE_YEARS
+    cutoff_year = datetime.date.today().year - years
+
+    async with AsyncSessionLocal() as db:
+        if not await db.scalar(text("SELECT pg_try_advisory_lock(:key)"), {"key": ARCHIVE_LOCK_KEY}):
+            return None
+        try:
+            suffixes = [
+                partition["name"].removeprefix(PARTITION_PREFIX)
+                for partition in await list_loan_partitions(db)
+            ]
+            await db.commit()
+
+            archived = []
+            for year in sorted(int(suffix) for suffix in suffixes if suffix.isdigit()):
+                if year >= cutoff_year:
+                    break
+                started = time.perf_counter()
+                loans = await archive_partition(year)
+                archived.append({
+                    "year": year,
+                    "loans": loans,
+                    "file": archive_path(year),
+                    "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)
+                })
+
+            started = time.perf_counter()
+            loans, path = await archive_default_partition(cutoff_year)
+            if loans:
+                archived.append({
+                    "year": None,
+                    "loans": loans,
+                    "file": path,
+                    "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)
+                })
+            return archived
+        finally:
+            await db.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": ARCHIVE_LOCK_KEY})
+            await db.commit()
+
+
+async def maintenance_loop():
+    """Фоновое обслуживание истории займов, запускается при старте приложения."""
+    while True:
+        try:
+            async with AsyncSessionLocal() as db:
+                await ensure_loan_partitions(db)
+            for name in await ensure_loan_id_keys():
+                print(f"Created unique loan_id index on {name}")
+            if Settings.LOAN_ARCHIVE_YEARS > 0:
+                for item in await archive_old_loans() or []:
+                    year = item['year'] or f"{DEFAULT_PARTITION} (late returns)"
+                    print(f"Archived {item['loans']} loans of {year} to {item['file']}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error in loan partition maintenance: {e}")
+
+        await asyncio.sleep(MAINTENANCE_INTERVAL)
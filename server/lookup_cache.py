@@ -0,0 +1,171 @@
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import event, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from database import Settings
+from models import *
+
+
+# Справочники, для которых кэшируется соответствие имя -> id
+LOOKUP_TABLES = {
+    Publisher: (Publisher.publisher_name, Publisher.publisher_id),
+    Theme: (Theme.theme_name, Theme.theme_id),
+    Author: (Author.author_name, Author.author_id),
+}
+
+
+class NameIdCache:
+    """Ограниченный кэш имя -> id с вытеснением давно не использованных записей (LRU)."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, name):
+        with self._lock:
+            item_id = self._items.get(name)
+            if item_id is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(name)
+            self.hits += 1
+            return item_id
+
+    def put(self, name, item_id):
+        with self._lock:
+            self._items[name] = item_id
+            self._items.move_to_end(name)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def invalidate(self, name=None, item_id=None):
+        with self._lock:
+            if name is not None:
+                self._items.pop(name, None)
+            if item_id is not None:
+                for key in [key for key, value in self._items.items() if value == item_id]:
+                    del self._items[key]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._items), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+caches = {model: NameIdCache(Settings.LOOKUP_CACHE_SIZE) for model in LOOKUP_TABLES}
+
+
+def clean_names(names):
+    """Обрезает пробелы, убирает пустые имена и дубли, сохраняя порядок."""
+    return list(dict.fromkeys(name.strip() for name in names if name and name.strip()))
+
+
+async def resolve_ids(db, model, names):
+    """
+    Возвращает словарь имя -> id, создавая недостающие записи справочника.
+
+    Имена из кэша не требуют запроса. Промахи сначала ищутся SELECT, и
+    только действительно новые имена вставляются INSERT ... ON CONFLICT DO
+    NOTHING RETURNING: существующие строки не перезаписываются (без мертвых
+    версий строк и без изменения версии справочника). Имена, которые успела
+    вставить параллельная транзакция, INSERT не возвращает - они читаются
+    повторным SELECT. Новые соответствия попадают в кэш только после
+    фиксации транзакции.
+    """
+    name_column, id_column = LOOKUP_TABLES[model]
+    cache = caches[model]
+
+    result = {}
+    missing = []
+    for name in clean_names(names):
+        item_id = cache.get(name)
+        if item_id is None:
+            missing.append(name)
+        else:
+            result[name] = item_id
+
+    if result:
+        db.sync_session.info["lookup_cache_used"] = True
+
+    if missing:
+        found = await _select_ids(db, name_column, id_column, missing)
+
+        new_names = [name for name in missing if name not in found]
+        if new_names:
+            stmt = insert(model).values([{name_column.key: name} for name in new_names])
+            stmt = stmt.on_conflict_do_nothing(index_elements=[name_column]).returning(name_column, id_column)
+            found.update((await db.execute(stmt)).all())
+
+            raced = [name for name in new_names if name not in found]
+            if raced:
+                found.update(await _select_ids(db, name_column, id_column, raced))
+
+        pending = db.sync_session.info.setdefault("lookup_cache_pending", [])
+        for name in missing:
+            result[name] = found[name]
+            pending.append((model, name, found[name]))
+
+    return result
+
+
+async def _select_ids(db, name_column, id_column, names):
+    rows = await db.execute(select(name_column, id_column).filter(name_column.in_(names)))
+    return dict(rows.all())
+
+
+async def resolve_id(db, model, name):
+    """Id одной записи справочника по имени или None для пустого имени."""
+    names = clean_names([name])
+    if not names:
+        return None
+    return (await resolve_ids(db, model, names))[names[0]]
+
+
+def invalidate(model, name=None, item_id=None):
+    caches[model].invalidate(name=name, item_id=item_id)
+
+
+def clear_all():
+    for cache in caches.values():
+        cache.clear()
+
+
+def stats():
+    return {model.__tablename__: cache.stats() for model, cache in caches.items()}
+
+
+# Транзакция зафиксирована - новые соответствия можно кэшировать
+@event.listens_for(Session, "after_commit")
+def _publish_pending(session):
+    for model, name, item_id in session.info.pop("lookup_cache_pending", []):
+        caches[model].put(name, item_id)
+    session.info.pop("lookup_cache_used", None)
+
+
+# При откате созданные записи исчезают; если использовались id из кэша,
+# ошибка могла быть вызвана устаревшим id - кэш сбрасывается целиком
+@event.listens_for(Session, "after_rollback")
+def _discard_pending(session):
+    session.info.pop("lookup_cache_pending", None)
+    if session.info.pop("lookup_cache_used", False):
+        clear_all()
+
+
+# Переименование или удаление записи справочника через ORM
+def _invalidate_instance(mapper, connection, target):
+    name_column, id_column = LOOKUP_TABLES[type(target)]
+    invalidate(type(target), item_id=getattr(target, id_column.key))
+
+
+for _model in LOOKUP_TABLES:
+    event.listen(_model, "after_update", _invalidate_instance)
+    event.listen(_model, "after_delete", _invalidate_instance)
@@ -1,46 +1,111 @@
+import asyncio
+import contextlib
 import datetime
 
 from fastapi import FastAPI, Request, Depends, HTTPException
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
 from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.templating import Jinja2Templates
 from fastapi.responses import RedirectResponse
 
-from sqlalchemy import and_, func, text
+from sqlalchemy import and_, func, select, text
 
-from database import get_db, SessionLocal
+from database import get_db, get_read_db, AsyncSessionLocal, async_engine, pool_metrics, request_metrics, replica_router, Settings
 from models import *
+from catalog import fetch_books_page, fetch_readers_page, stream_books_page, stream_readers_page
+from pagination import DEFAULT_PAGE_SIZE
+from request_metrics import RequestMetricsMiddleware, render_pool
+from change_versions import ETagMiddleware, conditional
+from streaming import streaming_environment, stream_template
+from overdue import refresh_loop
+from reader_index import reader_index
+from replicas import ReadYourWritesMiddleware
+from facets import fetch_facets
+from delta_log import fold_loop
+import loan_archive
 
 # Импортируем роутеры
-from routers import books, readers, loans
-
-app = FastAPI()
+from routers import books, readers, loans, items, internal
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # Фоновое обновление отчета о просрочках
+    tasks = []
+    if Settings.OVERDUE_REFRESH_SECONDS > 0:
+        tasks.append(asyncio.create_task(refresh_loop()))
+    # Перенос журнала версий таблиц
+    tasks.append(asyncio.create_task(fold_loop()))
+    # Секции займов на следующий год и архивирование старой истории
+    tasks.append(asyncio.create_task(loan_archive.maintenance_loop()))
+    # Проверка отставания реплик для чтения
+    if replica_router.enabled:
+        tasks.append(asyncio.create_task(replica_router.monitor_loop()))
+    # Индекс подсказок ФИО загружается в фоне, не задерживая старт
+    reader_index.schedule_refresh()
+    yield
+    for task in tasks:
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+    await replica_router.dispose()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(ETagMiddleware)
+if replica_router.enabled:
+    app.add_middleware(ReadYourWritesMiddleware, router=replica_router)
 app.add_middleware(GZipMiddleware, minimum_size=500)
+# Добавлен последним - внешний слой, время ответа включает сжатие
+app.add_middleware(RequestMetricsMiddleware, metrics=request_metrics)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 # Подключаем роутеры
 app.include_router(books.router)
 app.include_router(readers.router)
 app.include_router(loans.router)
+app.include_router(items.router)
+app.include_router(internal.router)
 
 templates = Jinja2Templates(directory="templates")
+# Для потокового вывода страниц (?stream=1)
+streaming_templates = streaming_environment(templates)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(
+        request_metrics.render() + render_pool(pool_metrics.snapshot(async_engine.pool)),
+        media_type="text/plain; version=0.0.4"
+    )
+
+
+# Строка library_stats плюс еще не перенесенные приращения (миграция 011)
+LIBRARY_STATS_QUERY = text(
+    "SELECT total_books, total_available, total_readers, active_loans FROM current_library_stats"
+)
 
 
-@app.get("/", response_class=HTMLResponse)
-async def home_page(request: Request, db = Depends(get_db)):
+@app.get("/", response_class=HTMLResponse,
+         dependencies=[conditional("library_stats", "library_stats_delta", replica=True)])
+async def home_page(request: Request, db = Depends(get_read_db)):
     try:
-        # Получаем статистику
-        total_books = db.query(func.count(Book.book_id)).scalar()
-        total_available = db.query(func.count(BookItem.book_item_id)).filter(BookItem.book_state == 'Доступна').scalar()
-        total_readers = db.query(func.count(Reader.reader_id)).scalar()
-        active_loans = db.query(func.count(BookLoan.loan_id)).filter(BookLoan.loan_return_date == None).scalar()
+        # Статистика поддерживается триггерами через журнал приращений
+        row = (await db.execute(LIBRARY_STATS_QUERY)).first()
+        if row is None:
+            # Строки нет (таблица очищена вручную) - пересчитываем счетчики
+            # на первичном сервере (db может быть репликой)
+            async with AsyncSessionLocal() as primary:
+                await primary.execute(text("SELECT reconcile_library_stats()"))
+                await primary.commit()
+                row = (await primary.execute(LIBRARY_STATS_QUERY)).first()
 
         stats = {
-            "total_books": total_books,
-            "total_available": total_available,
-            "total_readers": total_readers,
-            "active_loans": active_loans
+            "total_books": row.total_books,
+            "total_available": row.total_available,
+            "total_readers": row.total_readers,
+            "active_loans": row.active_loans
         }
 
         return templates.TemplateResponse(
@@ -53,95 +118,69 @@ async def home_page(request: Request, db = Depends(get_db)):
 
 
 
-@app.get("/books", response_class=HTMLResponse)
-async def books_route(request: Request, search: str = "", db = Depends(get_db)):
+@app.get("/books", response_class=HTMLResponse,
+         dependencies=[conditional("books", "book_counts_delta", "publishers", "themes", "authors", "author_book", replica=True)])
+async def books_route(request: Request, search: str = "", theme_id: int = None, publisher_id: int = None,
+                      author_id: int = None, year_from: int = None, year_to: int = None,
+                      after: str = None, before: str = None,
+                      limit: int = DEFAULT_PAGE_SIZE, stream: bool = False, db = Depends(get_read_db)):
     try:
-        search_param = f"%{search.strip()}%" if search.strip() else "%"
-        
-        # Создаем подзапрос для подсчета доступных экземпляров
-        from sqlalchemy import func
-        
-        available_count_subquery = db.query(
-            BookItem.book_id,
-            func.count(BookItem.book_item_id).label('available_count')
-        ).filter(BookItem.book_state == 'Доступна')\
-         .group_by(BookItem.book_id)\
-         .subquery()
-        
-        # Основной запрос для получения книг с OUTER JOIN
-        query = db.query(
-            Book.book_id,
-            Book.book_name,
-            Theme.theme_name,
-            Publisher.publisher_name,
-            Book.release_date,
-            Book.isbn,
-            func.coalesce(available_count_subquery.c.available_count, 0).label('available_book_count')
-        ).outerjoin(Publisher, Book.publisher_id == Publisher.publisher_id)\
-         .outerjoin(Theme, Book.theme_id == Theme.theme_id)\
-         .outerjoin(available_count_subquery, Book.book_id == available_count_subquery.c.book_id)\
-         .filter(Book.book_name.ilike(search_param))
-        
-        values = query.all()
-        
-        books = []
-        for row in values:
-            books.append({
-                "id": row.book_id,
-                "name": row.book_name,
-                "theme": row.theme_name or "Не указана",
-                "publisher": row.publisher_name or "Не указан",
-                "release_date": row.release_date or "Не указана",
-                "isbn": row.isbn or "Не указан",
-                "available_book_count": row.available_book_count
-            })
-        
-        return templates.TemplateResponse(request=request, name="books.html", context={"books": books, "search": search})
+        filters = {
+            "theme_id": theme_id, "publisher_id": publisher_id, "author_id": author_id,
+            "year_from": year_from, "year_to": year_to
+        }
+        facets = await fetch_facets(db, versions=request.state.table_versions, search=search, **filters)
+        # Параметры фильтра для ссылок фасетов и навигации
+        page_params = {"search": search, **{key: value for key, value in filters.items() if value is not None}}
+        context = {"search": search, "facets": facets, "page_params": page_params}
+
+        if stream:
+            # Строки читаются с серверного курсора во время отправки страницы
+            page = stream_books_page(search, after=after, before=before, limit=limit, filters=filters, bind=db.bind)
+            return stream_template(
+                streaming_templates, "books.html",
+                {"request": request, "books": page, "page": page, **context},
+                error_html="<h1>Server Error: Could not load books data.</h1>"
+            )
+
+        page = await fetch_books_page(db, search, after=after, before=before, limit=limit, filters=filters)
+
+        return templates.TemplateResponse(
+            request=request, name="books.html",
+            context={"books": page["items"], "page": page, **context}
+        )
         
+    except ValueError as e:
+        # Поврежденный курсор страницы
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         print(e)
         return "<h1>Server Error: Could not load books data.</h1>"
 
 
 
-@app.get("/readers", response_class=HTMLResponse)
-async def readers_page(request: Request, search: str = "", db = Depends(get_db)):
+@app.get("/readers", response_class=HTMLResponse, dependencies=[conditional("readers", "book_loans", replica=True)])
+async def readers_page(request: Request, search: str = "", after: str = None, before: str = None,
+                       limit: int = DEFAULT_PAGE_SIZE, stream: bool = False, db = Depends(get_read_db)):
     try:
-        search_param = f"{search.strip()}%"
-
-        query = db.query(
-            Reader.reader_id,
-            Reader.fio,
-            Reader.dolzhnost,
-            Reader.uchenaya_stepen,
-            func.count(BookLoan.loan_id).label('active_loans_count')
-        ).outerjoin(BookLoan, and_(
-            BookLoan.reader_id == Reader.reader_id,
-            BookLoan.loan_return_date == None
-        )).filter(Reader.fio.ilike(search_param))\
-         .group_by(
-             Reader.reader_id,
-             Reader.fio,
-             Reader.dolzhnost,
-             Reader.uchenaya_stepen
-         )
-
-        readers_data = query.all()
-        
-        readers = []
-        for row in readers_data:
-            readers.append({
-                "id": row.reader_id,
-                "fio": row.fio,
-                "dolzhnost": row.dolzhnost or "Не указано",
-                "uchenaya_stepen": row.uchenaya_stepen or "Не указано",
-                "active_loans": row.active_loans_count
-            })
-        
+        if stream:
+            page = stream_readers_page(search, after=after, before=before, limit=limit, bind=db.bind)
+            return stream_template(
+                streaming_templates, "readers.html",
+                {"request": request, "readers": page, "page": page, "search": search},
+                error_html="<h1>Server Error: Could not load readers data.</h1>"
+            )
+
+        page = await fetch_readers_page(db, search, after=after, before=before, limit=limit)
+
         return templates.TemplateResponse(
-            request=request, name="readers.html", context={"readers": readers, "search": search}
+            request=request, name="readers.html",
+            context={"readers": page["items"], "page": page, "search": search}
         )
         
+    except ValueError as e:
+        # Поврежденный курсор страницы
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         print(e)
         return "<h1>Server Error: Could not load readers data.</h1>"
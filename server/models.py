@@ -1,6 +1,6 @@
 import enum
 
-from sqlalchemy import Column, Integer, String, Text, Date, SmallInteger, ForeignKey, CheckConstraint, Enum
+from sqlalchemy import Column, Integer, BigInteger, String, Text, Date, SmallInteger, ForeignKey, CheckConstraint, Enum, Table
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from sqlalchemy.dialects.postgresql import ENUM
@@ -45,6 +45,11 @@ class Book(Base):
     isbn = Column(Text)
     release_date = Column(SmallInteger)
     theme_id = Column(Integer, ForeignKey('themes.theme_id'))
+    # Поддерживаются триггерами на book_items через журнал book_counts_delta
+    # (миграции 004, 014), приложение их не изменяет. Текущие значения -
+    # BOOK_TOTAL_COUNT и BOOK_AVAILABLE_COUNT в catalog.py
+    total_count = Column(Integer, nullable=False, server_default='0')
+    available_count = Column(Integer, nullable=False, server_default='0')
     
     # Связи
     publisher = relationship("Publisher", back_populates="books")
@@ -52,6 +57,15 @@ class Book(Base):
     book_items = relationship("BookItem", back_populates="book")
     authors = relationship("Author", secondary="author_book", back_populates="books")
 
+# Журнал приращений количества экземпляров книги (миграция 014): строки
+# только добавляются триггерами и переносятся в books, первичного ключа нет
+book_counts_delta = Table(
+    'book_counts_delta', Base.metadata,
+    Column('book_id', Integer, nullable=False),
+    Column('total_count', Integer, nullable=False, server_default='0'),
+    Column('available_count', Integer, nullable=False, server_default='0')
+)
+
 # Таблица экземпляров книг
 class BookItem(Base):
     __tablename__ = 'book_items'
@@ -107,6 +121,8 @@ class Reader(Base):
 class BookLoan(Base):
     __tablename__ = 'book_loans'
     
+    # Ключ для ORM: в секционированной таблице (миграция 009) первичного ключа
+    # нет, loan_id уникален в каждой секции (миграции 012, 013)
     loan_id = Column(Integer, primary_key=True, autoincrement=True)
     loan_date = Column(Date, nullable=False)
     loan_due_date = Column(Date)
@@ -117,3 +133,14 @@ class BookLoan(Base):
     # Связи
     book_item = relationship("BookItem", back_populates="loans")
     reader = relationship("Reader", back_populates="loans")
+
+# Счетчики главной страницы (одна строка; триггеры пишут приращения в
+# library_stats_delta, текущие значения - представление current_library_stats)
+class LibraryStats(Base):
+    __tablename__ = 'library_stats'
+
+    stats_id = Column(SmallInteger, primary_key=True, default=1)
+    total_books = Column(BigInteger, nullable=False, default=0)
+    total_available = Column(BigInteger, nullable=False, default=0)
+    total_readers = Column(BigInteger, nullable=False, default=0)
+    active_loans = Column(BigInteger, nullable=False, default=0)
@@ -0,0 +1,128 @@
+import asyncio
+import datetime
+import time
+
+from sqlalchemy import Column, Integer, Text, Date, DateTime, MetaData, Table, exists, func, select, text
+
+from database import AsyncSessionLocal, Settings
+from models import BookLoan
+from pagination import apply_keyset, build_page, clamp_limit
+
+
+# Материализованное представление из sql/migrations/006_overdue_report.sql;
+# отдельные метаданные - create_tables() не должна создавать его как таблицу
+overdue_loans = Table(
+    "overdue_loans", MetaData(),
+    Column("loan_id", Integer, primary_key=True),
+    Column("loan_date", Date),
+    Column("loan_due_date", Date),
+    Column("book_item_id", Integer),
+    Column("book_id", Integer),
+    Column("book_name", Text),
+    Column("reader_id", Integer),
+    Column("fio", Text),
+    Column("refreshed_at", DateTime(timezone=True)),
+)
+
+# Сортировки отчета: ключ (последний столбец уникален) и его имена в строке
+OVERDUE_SORTS = {
+    "days": (overdue_loans.c.loan_due_date, overdue_loans.c.loan_id),
+    "reader": (overdue_loans.c.fio, overdue_loans.c.reader_id, overdue_loans.c.loan_due_date, overdue_loans.c.loan_id),
+}
+
+# Ключ блокировки: обновляет отчет только один процесс из нескольких
+REFRESH_LOCK_KEY = 7300126
+
+days_overdue = (func.current_date() - overdue_loans.c.loan_due_date).label("days_overdue")
+
+
+def overdue_statement(reader_id=None, min_days=None):
+    """Просроченные займы из представления; займы, возвращенные после
+    последнего обновления, отсеиваются проверкой по первичному ключу book_loans."""
+    still_open = exists().where(
+        BookLoan.loan_id == overdue_loans.c.loan_id,
+        BookLoan.loan_return_date == None
+    )
+    stmt = select(overdue_loans, days_overdue).filter(still_open)
+
+    if reader_id is not None:
+        stmt = stmt.filter(overdue_loans.c.reader_id == reader_id)
+    if min_days:
+        stmt = stmt.filter(overdue_loans.c.loan_due_date <= func.current_date() - min_days)
+
+    return stmt
+
+
+def overdue_to_dict(row):
+    return {
+        "loan_id": row.loan_id,
+        "reader_id": row.reader_id,
+        "reader_fio": row.fio,
+        "book_id": row.book_id,
+        "book_name": row.book_name,
+        "book_item_id": row.book_item_id,
+        "loan_date": row.loan_date.isoformat(),
+        "loan_due_date": row.loan_due_date.isoformat(),
+        "days_overdue": row.days_overdue
+    }
+
+
+async def fetch_overdue_page(db, sort="days", reader_id=None, min_days=None, after=None, before=None, limit=None):
+    """Страница отчета: по дням просрочки (сначала самые давние) или по читателю."""
+    if sort not in OVERDUE_SORTS:
+        raise ValueError(f"Неизвестная сортировка: {sort}. Доступны: {', '.join(OVERDUE_SORTS)}")
+
+    sort_key = OVERDUE_SORTS[sort]
+    limit = clamp_limit(limit)
+    stmt = apply_keyset(overdue_statement(reader_id, min_days), sort_key, after=after, before=before, limit=limit)
+    rows = (await db.execute(stmt)).all()
+    rows, next_cursor, prev_cursor = build_page(
+        rows, [column.key for column in sort_key], after=after, before=before, limit=limit
+    )
+
+    refreshed_at = await db.scalar(select(overdue_loans.c.refreshed_at).limit(1))
+
+    return {
+        "items": [overdue_to_dict(row) for row in rows],
+        "next_cursor": next_cursor,
+        "prev_cursor": prev_cursor,
+        "limit": limit,
+        "refreshed_at": refreshed_at.isoformat() if refreshed_at else None
+    }
+
+
+async def refresh_overdue_report():
+    """
+    Обновляет представление без блокировки чтения (CONCURRENTLY).
+    Возвращает время обновления в секундах или None, если отчет уже
+    обновляет другой процесс.
+    """
+    started = time.perf_counter()
+    async with AsyncSessionLocal() as db:
+        if not await db.scalar(text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": REFRESH_LOCK_KEY}):
+            return None
+        await db.execute(text("SET LOCAL statement_timeout = 0"))
+        await db.execute(text("REFRESH MATERIALIZED VIEW CONCURRENTLY overdue_loans"))
+        await db.commit()
+    return time.perf_counter() - started
+
+
+def seconds_until_next_refresh(interval):
+    # Обновление сразу после полуночи: займы со сроком "вчера" становятся просроченными
+    now = datetime.datetime.now()
+    midnight = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time(0, 0, 5))
+    return min(interval, (midnight - now).total_seconds())
+
+
+async def refresh_loop(interval=None):
+    """Фоновое обновление отчета, запускается при старте приложения."""
+    interval = interval or Settings.OVERDUE_REFRESH_SECONDS
+    while True:
+        try:
+            await refresh_overdue_report()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error refreshing overdue report: {e}")
+
+        await asyncio.sleep(seconds_until_next_refresh(interval))
@@ -0,0 +1,166 @@
+import base64
+import datetime
+import json
+
+from sqlalchemy import bindparam, tuple_, BigInteger, Integer, SmallInteger
+
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Границы целочисленных типов столбцов: значение вне них база не примет
+INTEGER_BITS = ((SmallInteger, 16), (BigInteger, 64), (Integer, 32))
+
+
+def clamp_limit(limit, maximum=MAX_PAGE_SIZE):
+    """Приводит размер страницы к допустимому диапазону."""
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(limit, maximum))
+
+
+def encode_cursor(values):
+    """Кодирует значения ключа сортировки в непрозрачный курсор для URL."""
+    raw = json.dumps(list(values), ensure_ascii=False, separators=(",", ":"), default=_json_default)
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _json_default(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    raise TypeError(f"Тип {type(value).__name__} не поддерживается в курсоре")
+
+
+def decode_cursor(cursor, size):
+    """Декодирует курсор; при повреждении бросает ValueError."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8"))
+    except Exception:
+        raise ValueError("Некорректный курсор страницы")
+
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("Некорректный курсор страницы")
+    return values
+
+
+def _cursor_value(value, column):
+    """Значение курсора с типом столбца ключа; неподходящее значение - ValueError."""
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return value
+
+    if python_type is int:
+        # bool - подкласс int, дробные числа не округляются
+        if not isinstance(value, int) or isinstance(value, bool):
+            raise ValueError
+        bits = next((bits for column_type, bits in INTEGER_BITS if isinstance(column.type, column_type)), 64)
+        if not -2 ** (bits - 1) <= value < 2 ** (bits - 1):
+            raise ValueError
+        return value
+    if python_type is str:
+        if not isinstance(value, str):
+            raise ValueError
+        return value
+    if python_type in (datetime.date, datetime.datetime):
+        if not isinstance(value, str):
+            raise ValueError
+        return python_type.fromisoformat(value)
+    return value
+
+
+def cursor_params(cursor, columns):
+    """
+    Декодирует курсор в значения с типами столбцов ключа: {"keyset_0": ..., ...}.
+    Значение не того типа (курсор подделан или от другого списка) - ValueError.
+    """
+    params = {}
+    for number, (value, column) in enumerate(zip(decode_cursor(cursor, len(columns)), columns)):
+        try:
+            params[f"keyset_{number}"] = _cursor_value(value, column)
+        except (TypeError, ValueError):
+            raise ValueError("Некорректный курсор страницы")
+    return params
+
+
+def keyset_direction(after=None, before=None):
+    """Направление страницы: None - первая, "after" - следующая, "before" - предыдущая."""
+    if before:
+        return "before"
+    return "after" if after else None
+
+
+def keyset_statement(stmt, columns, direction=None, descending=False):
+    """
+    Добавляет к запросу условие поиска по ключу (seek) вместо OFFSET.
+
+    Значения курсора и размер страницы - именованные параметры (keyset_params),
+    поэтому один объект запроса подходит для всех страниц одного направления.
+    columns - столбцы ключа сортировки, последний должен быть уникальным (id).
+    descending - листать от больших значений ключа к меньшим.
+    """
+    key = tuple_(*columns)
+    values = tuple_(*(bindparam(f"keyset_{number}", type_=column.type) for number, column in enumerate(columns)))
+    ascending_order = [column.asc() for column in columns]
+    descending_order = [column.desc() for column in columns]
+
+    if direction == "before":
+        # Предыдущая страница читается в обратном порядке от курсора
+        if descending:
+            stmt = stmt.filter(key > values).order_by(*ascending_order)
+        else:
+            stmt = stmt.filter(key < values).order_by(*descending_order)
+    else:
+        if direction == "after":
+            stmt = stmt.filter(key < values if descending else key > values)
+        stmt = stmt.order_by(*(descending_order if descending else ascending_order))
+
+    return stmt.limit(bindparam("keyset_limit", type_=Integer))
+
+
+def keyset_params(columns, after=None, before=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    Параметры для keyset_statement. Запрашивается на одну строку больше limit,
+    чтобы понять, есть ли следующая страница. Поврежденный курсор - ValueError.
+    """
+    cursor = before or after
+    params = cursor_params(cursor, columns) if cursor else {}
+    params["keyset_limit"] = limit + 1
+    return params
+
+
+def apply_keyset(stmt, columns, after=None, before=None, limit=DEFAULT_PAGE_SIZE, descending=False):
+    """
+    keyset_statement со значениями курсора, подставленными в сам запрос:
+    для запросов, которые строятся заново при каждом вызове.
+    """
+    stmt = keyset_statement(stmt, columns, keyset_direction(after, before), descending)
+    return stmt.params(keyset_params(columns, after, before, limit))
+
+
+def build_page(rows, key_names, after=None, before=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    Обрезает лишнюю строку и вычисляет курсоры соседних страниц.
+
+    Возвращает (rows, next_cursor, prev_cursor).
+    """
+    rows = list(rows)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    def cursor_of(row):
+        return encode_cursor(getattr(row, name) for name in key_names)
+
+    if before:
+        # Строки выбраны в обратном порядке - разворачиваем
+        rows.reverse()
+        next_cursor = cursor_of(rows[-1]) if rows else None
+        prev_cursor = cursor_of(rows[0]) if rows and has_more else None
+    else:
+        next_cursor = cursor_of(rows[-1]) if rows and has_more else None
+        prev_cursor = cursor_of(rows[0]) if rows and after else None
+
+    return rows, next_cursor, prev_cursor
@@ -0,0 +1,111 @@
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+
+from models import *
+from catalog import BOOK_SORT_KEY, BOOK_TOTAL_COUNT, BOOK_AVAILABLE_COUNT, book_filters
+from pagination import apply_keyset, build_page, clamp_limit, MAX_PAGE_SIZE
+
+
+def _authors():
+    """Авторы книги списком имен (коррелированный подзапрос)."""
+    return select(func.array_agg(aggregate_order_by(Author.author_name, Author.author_name)))\
+        .join(AuthorBook, AuthorBook.author_id == Author.author_id)\
+        .filter(AuthorBook.book_id == Book.book_id)\
+        .scalar_subquery()
+
+
+# Поля книги, которые можно запросить через fields=
+BOOK_FIELDS = {
+    "id": lambda: Book.book_id,
+    "name": lambda: Book.book_name,
+    "authors": _authors,
+    "publisher_id": lambda: Book.publisher_id,
+    "publisher": lambda: Publisher.publisher_name,
+    "theme_id": lambda: Book.theme_id,
+    "theme": lambda: Theme.theme_name,
+    "isbn": lambda: Book.isbn,
+    "release_date": lambda: Book.release_date,
+    "total_count": lambda: BOOK_TOTAL_COUNT,
+    "available_book_count": lambda: BOOK_AVAILABLE_COUNT,
+}
+
+DEFAULT_BOOK_FIELDS = ["id", "name", "theme", "publisher", "release_date", "isbn", "available_book_count"]
+
+# Столбцы ключа сортировки выбираются всегда - по ним строятся курсоры
+KEY_NAMES = ("book_name", "book_id")
+
+
+def parse_fields(fields):
+    """Список полей из строки "id,name,authors"; пустая строка - поля по умолчанию."""
+    if not fields or not fields.strip():
+        return DEFAULT_BOOK_FIELDS
+
+    names = list(dict.fromkeys(name.strip() for name in fields.split(",") if name.strip()))
+    unknown = [name for name in names if name not in BOOK_FIELDS]
+    if unknown:
+        raise ValueError(f"Неизвестные поля: {', '.join(unknown)}. Доступны: {', '.join(BOOK_FIELDS)}")
+    return names
+
+
+def parse_ids(ids):
+    """Список id из строки "1,2,3" (не больше MAX_PAGE_SIZE, без повторов)."""
+    try:
+        values = list(dict.fromkeys(int(value) for value in ids.split(",") if value.strip()))
+    except ValueError:
+        raise ValueError("ids должен быть списком целых чисел через запятую")
+    if len(values) > MAX_PAGE_SIZE:
+        raise ValueError(f"Не больше {MAX_PAGE_SIZE} id за один запрос")
+    return values
+
+
+def books_projection_statement(fields, search="", publisher_id=None, theme_id=None, author_id=None,
+                               year_from=None, year_to=None, available=None):
+    """
+    Книги только с запрошенными полями. Названия издателя и темы
+    присоединяются, только если запрошены, авторы собираются подзапросом -
+    все поля выбираются одним запросом.
+    """
+    stmt = select(
+        *[BOOK_FIELDS[name]().label(name) for name in fields],
+        Book.book_name.label("book_name"),
+        Book.book_id.label("book_id")
+    ).select_from(Book)
+
+    if "publisher" in fields:
+        stmt = stmt.outerjoin(Publisher, Book.publisher_id == Publisher.publisher_id)
+    if "theme" in fields:
+        stmt = stmt.outerjoin(Theme, Book.theme_id == Theme.theme_id)
+
+    return stmt.filter(*book_filters(search, publisher_id, theme_id, author_id, year_from, year_to, available))
+
+
+def _to_dict(row, fields):
+    mapping = row._mapping
+    return {name: mapping[name] for name in fields}
+
+
+async def fetch_books_projection(db, fields, filters, after=None, before=None, limit=None):
+    """Страница каталога с выбранными полями, сортировка (book_name, book_id)."""
+    limit = clamp_limit(limit)
+    stmt = apply_keyset(books_projection_statement(fields, **filters), BOOK_SORT_KEY,
+                        after=after, before=before, limit=limit)
+    rows = (await db.execute(stmt)).all()
+    rows, next_cursor, prev_cursor = build_page(rows, KEY_NAMES, after=after, before=before, limit=limit)
+
+    return {
+        "items": [_to_dict(row, fields) for row in rows],
+        "next_cursor": next_cursor,
+        "prev_cursor": prev_cursor,
+        "limit": limit
+    }
+
+
+async def fetch_books_by_ids(db, fields, ids, filters=None):
+    """Книги по списку id одним запросом, в порядке списка; отсутствующие id - в missing."""
+    stmt = books_projection_statement(fields, **(filters or {})).filter(Book.book_id.in_(ids))
+    found = {row.book_id: _to_dict(row, fields) for row in (await db.execute(stmt)).all()}
+
+    return {
+        "items": [found[book_id] for book_id in ids if book_id in found],
+        "missing": [book_id for book_id in ids if book_id not in found]
+    }
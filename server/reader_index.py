@@ -0,0 +1,172 @@
+import asyncio
+import bisect
+import threading
+import time
+
+from sqlalchemy import event, func, select, text
+from sqlalchemy.orm import Session
+
+from database import AsyncSessionLocal, Settings
+from models import Reader
+
+
+AUTOCOMPLETE_LIMIT = 10
+MAX_AUTOCOMPLETE_LIMIT = 50
+
+
+def normalize(value):
+    return value.strip().lower()
+
+
+def prefix_upper_bound(prefix):
+    """Наименьшая строка больше всех строк с данным префиксом (None - не существует)."""
+    last = prefix[-1]
+    if ord(last) >= 0x10FFFF:
+        return None
+    return prefix[:-1] + chr(ord(last) + 1)
+
+
+def readers_prefix_statement(prefix, limit=AUTOCOMPLETE_LIMIT):
+    """
+    Читатели, чье ФИО начинается с prefix (без учета регистра), по индексу
+    readers_fio_lower_prefix_idx. Префикс задается диапазоном операторов
+    text_pattern_ops, а не LIKE: такое условие использует индекс и в общем
+    плане подготовленного запроса.
+    """
+    key = func.lower(Reader.fio)
+    stmt = select(Reader.reader_id, Reader.fio).filter(key.op("~>=~")(prefix))
+    upper = prefix_upper_bound(prefix)
+    if upper is not None:
+        stmt = stmt.filter(key.op("~<~")(upper))
+    return stmt.order_by(text("lower(readers.fio) USING ~<~")).limit(limit)
+
+
+class ReaderPrefixIndex:
+    """
+    Отсортированный в памяти список ФИО читателей: поиск по префиксу - двоичный
+    поиск и перебор подходящих записей, без обращения к базе.
+
+    Индекс перестраивается целиком в фоне: после записи в readers через ORM
+    в этом процессе и при изменении версии таблицы (current_table_versions) - так
+    учитываются записи других процессов. Запрос подсказки перестройку не ждет.
+    """
+
+    def __init__(self, check_interval):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._keys = []
+        self._entries = []
+        self.loaded = False
+        self.version = None
+        self.stale = False
+        self.checked_at = 0.0
+        self.loaded_at = None
+        self.load_ms = None
+        self._refresh_task = None
+
+    def search(self, prefix, limit=AUTOCOMPLETE_LIMIT):
+        prefix = normalize(prefix)
+        with self._lock:
+            keys, entries = self._keys, self._entries
+        if not prefix:
+            return []
+
+        results = []
+        position = bisect.bisect_left(keys, prefix)
+        while position < len(keys) and len(results) < limit and keys[position].startswith(prefix):
+            reader_id, fio = entries[position]
+            results.append({"id": reader_id, "fio": fio})
+            position += 1
+        return results
+
+    async def load(self):
+        started = time.perf_counter()
+        async with AsyncSessionLocal() as db:
+            # Версия читается до данных: запись между ними вызовет еще одну перестройку
+            version = await db.scalar(text("SELECT version FROM current_table_versions WHERE table_name = 'readers'"))
+            rows = (await db.execute(select(Reader.reader_id, Reader.fio))).all()
+
+        pairs = sorted((normalize(fio), reader_id, fio) for reader_id, fio in rows)
+        keys = [key for key, reader_id, fio in pairs]
+        entries = [(reader_id, fio) for key, reader_id, fio in pairs]
+
+        with self._lock:
+            self._keys, self._entries = keys, entries
+            self.version = version
+            self.loaded = True
+            self.loaded_at = time.time()
+            self.load_ms = round((time.perf_counter() - started) * 1000, 1)
+
+    async def refresh(self, force=False):
+        """Перестраивает индекс, если изменилась версия таблицы readers."""
+        self.checked_at = time.monotonic()
+        if not force and not self.stale and self.loaded:
+            async with AsyncSessionLocal() as db:
+                version = await db.scalar(text("SELECT version FROM current_table_versions WHERE table_name = 'readers'"))
+            if version == self.version:
+                return
+        self.stale = False
+        await self.load()
+
+    def schedule_refresh(self):
+        """Запускает проверку в фоне, если индекс устарел или давно не проверялся."""
+        due = self.stale or not self.loaded or time.monotonic() - self.checked_at >= self.check_interval
+        if not due or (self._refresh_task and not self._refresh_task.done()):
+            return
+        self._refresh_task = asyncio.create_task(self._refresh_quietly())
+
+    async def _refresh_quietly(self):
+        try:
+            await self.refresh()
+        except Exception as e:
+            print(f"Error refreshing reader index: {e}")
+
+    def stats(self):
+        with self._lock:
+            size = len(self._keys)
+        return {
+            "size": size,
+            "loaded": self.loaded,
+            "version": self.version,
+            "load_ms": self.load_ms,
+            "loaded_at": self.loaded_at
+        }
+
+
+reader_index = ReaderPrefixIndex(Settings.READER_INDEX_CHECK_SECONDS)
+
+
+async def autocomplete_readers(db, prefix, limit=AUTOCOMPLETE_LIMIT):
+    """Подсказки ФИО: из индекса в памяти, до его первой загрузки - из базы."""
+    limit = max(1, min(int(limit), MAX_AUTOCOMPLETE_LIMIT))
+    reader_index.schedule_refresh()
+
+    if reader_index.loaded:
+        return reader_index.search(prefix, limit)
+
+    prefix = normalize(prefix)
+    if not prefix:
+        return []
+    rows = (await db.execute(readers_prefix_statement(prefix, limit))).all()
+    return [{"id": row.reader_id, "fio": row.fio} for row in rows]
+
+
+# Изменение читателей через ORM в этом процессе - индекс перестраивается
+# после фиксации транзакции
+def _mark_changed(mapper, connection, target):
+    Session.object_session(target).info["reader_index_changed"] = True
+
+
+for _event in ("after_insert", "after_update", "after_delete"):
+    event.listen(Reader, _event, _mark_changed)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_on_commit(session):
+    if session.info.pop("reader_index_changed", False):
+        reader_index.stale = True
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_on_rollback(session):
+    session.info.pop("reader_index_changed", None)
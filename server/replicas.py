@@ -0,0 +1,190 @@
+import asyncio
+import itertools
+import time
+
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+
+# streaming - реплика получает WAL от первичного сервера. Без этого сравнение
+# позиций ниже бессмысленно: после обрыва соединения все полученное уже
+# применено, и реплика выглядела бы догнавшей, отдавая устаревшие данные.
+# Статус приемника виден ролям с pg_read_all_stats (pg_monitor); без этого
+# права видно только, что процесс приемника запущен.
+# lag - отставание в секундах. Если все полученные WAL уже применены,
+# реплика догнала первичный сервер (при простое время последней транзакции
+# стареет, но отставания нет). Сервер не в режиме восстановления (например,
+# подписчик логической репликации) считается не отстающим. NULL - реплика
+# еще не применила ни одной транзакции.
+LAG_QUERY = text("""
+    SELECT
+        NOT pg_is_in_recovery() OR EXISTS (
+            SELECT 1 FROM pg_stat_wal_receiver
+            WHERE pid IS NOT NULL AND coalesce(status, 'streaming') = 'streaming'
+        ) AS streaming,
+        CASE
+            WHEN NOT pg_is_in_recovery() THEN 0
+            WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp())
+        END AS lag
+""")
+
+# Cookie с временем последней записи клиента
+WRITE_COOKIE = "db_write_at"
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+
+class Replica:
+    def __init__(self, name, url, engine_options):
+        self.name = name
+        self.url = make_url(url).set(drivername="postgresql+asyncpg")
+        self.engine = create_async_engine(self.url, **engine_options)
+        self.sessionmaker = async_sessionmaker(
+            bind=self.engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+        )
+        # До первой проверки реплика не используется
+        self.healthy = False
+        self.lag = None
+        self.error = None
+        self.checked_at = None
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "url": self.url.render_as_string(hide_password=True),
+            "healthy": self.healthy,
+            "lag_seconds": None if self.lag is None else round(self.lag, 3),
+            "error": self.error,
+            "checked_ago_seconds": None if self.checked_at is None else round(time.monotonic() - self.checked_at, 1),
+        }
+
+
+class ReplicaRouter:
+    """
+    Реплики для маршрутов только для чтения.
+
+    Фоновая проверка (monitor_loop) измеряет отставание каждой реплики;
+    отстающие больше max_lag секунд, недоступные и потерявшие соединение
+    с первичным сервером реплики не выбираются, и
+    чтение идет на первичный сервер. Клиент, который сам недавно записывал
+    (cookie db_write_at моложе write_window секунд), читает с первичного
+    сервера, чтобы увидеть свои изменения.
+    """
+
+    def __init__(self, urls, max_lag, write_window, check_interval, engine_options):
+        self.replicas = [
+            Replica(f"replica{number}", url, engine_options)
+            for number, url in enumerate(urls, start=1)
+        ]
+        self.max_lag = max_lag
+        self.write_window = write_window
+        self.check_interval = check_interval
+        self._next = itertools.cycle(self.replicas)
+        self.routed = {"replica": 0, "read_your_writes": 0, "fallback": 0}
+
+    @property
+    def enabled(self):
+        return bool(self.replicas)
+
+    def wrote_recently(self, cookies):
+        try:
+            written_at = float(cookies.get(WRITE_COOKIE, ""))
+        except ValueError:
+            return False
+        return time.time() - written_at < self.write_window
+
+    def choose(self, cookies):
+        """Реплика для чтения или None, если читать нужно с первичного сервера."""
+        if not self.enabled:
+            return None
+        if self.wrote_recently(cookies):
+            self.routed["read_your_writes"] += 1
+            return None
+        # Круговой обход, начиная со следующей реплики
+        for _ in range(len(self.replicas)):
+            replica = next(self._next)
+            if replica.healthy:
+                self.routed["replica"] += 1
+                return replica
+        self.routed["fallback"] += 1
+        return None
+
+    def mark_failed(self, replica, error):
+        # До следующей успешной проверки чтение идет мимо реплики
+        replica.healthy = False
+        replica.error = str(error)
+
+    async def check(self, replica):
+        try:
+            async with replica.engine.connect() as connection:
+                row = (await connection.execute(LAG_QUERY)).one()
+            replica.lag = None if row.lag is None else float(row.lag)
+            if not row.streaming:
+                replica.healthy = False
+                replica.error = "Реплика не получает WAL от первичного сервера"
+            elif replica.lag is None:
+                replica.healthy = False
+                replica.error = "Реплика еще не применила ни одной транзакции"
+            else:
+                replica.healthy = replica.lag <= self.max_lag
+                replica.error = None
+        except Exception as e:
+            replica.healthy = False
+            replica.lag = None
+            replica.error = str(e)
+        replica.checked_at = time.monotonic()
+
+    async def monitor_loop(self):
+        """Периодическая проверка реплик, запускается при старте приложения."""
+        while True:
+            await asyncio.gather(*(self.check(replica) for replica in self.replicas))
+            await asyncio.sleep(self.check_interval)
+
+    def stats(self):
+        return {
+            "max_lag_seconds": self.max_lag,
+            "read_your_writes_seconds": self.write_window,
+            "routed": dict(self.routed),
+            "replicas": [replica.stats() for replica in self.replicas],
+        }
+
+    async def dispose(self):
+        for replica in self.replicas:
+            await replica.engine.dispose()
+
+
+class ReadYourWritesMiddleware:
+    """
+    После успешной записи ставит клиенту cookie с временем записи: пока она
+    действует, get_read_db читает с первичного сервера. Добавляет к ответу
+    заголовок X-DB-Source - откуда прочитаны данные.
+    """
+
+    def __init__(self, app, router):
+        self.app = app
+        self.router = router
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        is_write = scope["method"] in WRITE_METHODS
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                source = scope.get("state", {}).get("db_source")
+                if source:
+                    headers.append((b"x-db-source", source.encode()))
+                if is_write and message["status"] < 400:
+                    cookie = (
+                        f"{WRITE_COOKIE}={time.time():.3f}; Max-Age={int(self.router.write_window) + 1}; "
+                        "Path=/; HttpOnly; SameSite=Lax"
+                    )
+                    headers.append((b"set-cookie", cookie.encode()))
+                message["headers"] = headers
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
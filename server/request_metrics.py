@@ -0,0 +1,248 @@
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+
+# Границы корзин гистограмм (секунды и число запросов к БД)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+# Длина текста SQL в журнале медленных запросов
+SLOW_LOG_STATEMENT_LENGTH = 300
+
+_current_request = ContextVar("current_request", default=None)
+
+
+class RequestStats:
+    """Запросы к БД одного HTTP-запроса; заполняется событиями движка."""
+
+    def __init__(self, capture_statements):
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.statements = [] if capture_statements else None
+
+    def record(self, statement, seconds):
+        self.sql_count += 1
+        self.sql_time += seconds
+        if self.statements is not None:
+            self.statements.append((statement, seconds))
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f'{name}_bucket{{{labels},le="+Inf"}} {self.count}'
+        yield f'{name}_sum{{{labels}}} {self.sum:.6f}'
+        yield f'{name}_count{{{labels}}} {self.count}'
+
+
+class RequestMetrics:
+    """Гистограммы по маршрутам: время ответа, число запросов к БД и время в БД."""
+
+    def __init__(self, slow_request_ms=0, slow_log_statements=50):
+        self._lock = threading.Lock()
+        self.slow_request_ms = slow_request_ms
+        self.slow_log_statements = slow_log_statements
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.routes = {}
+            self.responses = Counter()
+            self.slow_requests = 0
+
+    def attach(self, engine):
+        """Подписывается на события выполнения запросов (для async - engine.sync_engine)."""
+        event.listen(engine, "before_cursor_execute", self._before_execute)
+        event.listen(engine, "after_cursor_execute", self._after_execute)
+        event.listen(engine, "handle_error", self._on_error)
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        stats = _current_request.get()
+        if stats is not None:
+            stats.record(statement, time.perf_counter() - started)
+
+    def _on_error(self, exception_context):
+        # Запрос с ошибкой не доходит до after_cursor_execute
+        conn = exception_context.connection
+        if conn is None or not conn.info.get("query_started"):
+            return
+        started = conn.info["query_started"].pop()
+        stats = _current_request.get()
+        if stats is not None:
+            stats.record(exception_context.statement, time.perf_counter() - started)
+
+    def start_request(self):
+        stats = RequestStats(capture_statements=self.slow_request_ms > 0)
+        return stats, _current_request.set(stats)
+
+    def finish_request(self, token, stats, method, route, status, seconds):
+        _current_request.reset(token)
+
+        with self._lock:
+            histograms = self.routes.get((method, route))
+            if histograms is None:
+                histograms = self.routes[(method, route)] = {
+                    "latency": Histogram(LATENCY_BUCKETS),
+                    "sql_statements": Histogram(STATEMENT_BUCKETS),
+                    "sql_time": Histogram(LATENCY_BUCKETS)
+                }
+            histograms["latency"].observe(seconds)
+            histograms["sql_statements"].observe(stats.sql_count)
+            histograms["sql_time"].observe(stats.sql_time)
+            self.responses[(method, route, status)] += 1
+
+            slow = self.slow_request_ms > 0 and seconds * 1000 >= self.slow_request_ms
+            if slow:
+                self.slow_requests += 1
+
+        if slow:
+            self.log_slow_request(stats, method, route, status, seconds)
+
+    def log_slow_request(self, stats, method, route, status, seconds):
+        """Печатает медленный запрос вместе с выполненным SQL; одинаковые запросы
+        сворачиваются в одну строку с числом повторов, так что N+1 видно сразу."""
+        print(f"Медленный запрос {method} {route} -> {status}: {seconds * 1000:.1f} мс, "
+              f"запросов к БД {stats.sql_count}, время в БД {stats.sql_time * 1000:.1f} мс")
+
+        grouped = {}
+        for statement, duration in stats.statements:
+            text = " ".join(statement.split())
+            count, total = grouped.get(text, (0, 0.0))
+            grouped[text] = (count + 1, total + duration)
+
+        ordered = sorted(grouped.items(), key=lambda item: item[1][1], reverse=True)
+        for text, (count, total) in ordered[:self.slow_log_statements]:
+            if len(text) > SLOW_LOG_STATEMENT_LENGTH:
+                text = text[:SLOW_LOG_STATEMENT_LENGTH] + "..."
+            print(f"    {count:>4} x {total * 1000:8.1f} мс  {text}")
+        if len(ordered) > self.slow_log_statements:
+            print(f"    ... еще {len(ordered) - self.slow_log_statements} различных запросов")
+
+    def render(self):
+        """Текстовый формат Prometheus."""
+        lines = []
+        with self._lock:
+            routes = sorted(self.routes.items())
+            responses = sorted(self.responses.items())
+            slow_requests = self.slow_requests
+
+        for name, key, help_text in (
+            ("http_request_duration_seconds", "latency", "Время обработки запроса"),
+            ("http_request_sql_statements", "sql_statements", "Число запросов к БД за один HTTP-запрос"),
+            ("http_request_sql_duration_seconds", "sql_time", "Время выполнения запросов к БД за один HTTP-запрос"),
+        ):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for (method, route), histograms in routes:
+                lines.extend(histograms[key].lines(name, label_pairs(method=method, route=route)))
+
+        lines.append("# HELP http_responses_total Ответы по маршрутам и кодам статуса")
+        lines.append("# TYPE http_responses_total counter")
+        for (method, route, status), count in responses:
+            lines.append(f"http_responses_total{{{label_pairs(method=method, route=route, status=status)}}} {count}")
+
+        lines.append("# HELP http_slow_requests_total Запросы дольше порога журнала медленных запросов")
+        lines.append("# TYPE http_slow_requests_total counter")
+        lines.append(f"http_slow_requests_total {slow_requests}")
+        return "\n".join(lines) + "\n"
+
+
+# Поля PoolMetrics.snapshot: имя метрики и тип
+POOL_METRICS = {
+    "size": ("db_pool_size", "gauge"),
+    "checked_out": ("db_pool_checked_out", "gauge"),
+    "checked_in": ("db_pool_checked_in", "gauge"),
+    "overflow": ("db_pool_overflow", "gauge"),
+    "connects": ("db_pool_connects_total", "counter"),
+    "checkouts": ("db_pool_checkouts_total", "counter"),
+    "checkins": ("db_pool_checkins_total", "counter"),
+    "invalidations": ("db_pool_invalidations_total", "counter"),
+    "timeouts": ("db_pool_timeouts_total", "counter"),
+    "wait_count": ("db_pool_wait_count_total", "counter"),
+    "wait_total_ms": ("db_pool_wait_seconds_total", "counter"),
+    "wait_max_ms": ("db_pool_wait_max_seconds", "gauge"),
+}
+
+
+def render_pool(snapshot):
+    """Состояние пула соединений (PoolMetrics.snapshot) в формате Prometheus."""
+    lines = []
+    for key, (name, kind) in POOL_METRICS.items():
+        value = snapshot[key] / 1000 if key.endswith("_ms") else snapshot[key]
+        lines.append(f"# TYPE {name} {kind}")
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def label_pairs(**labels):
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return ",".join(f'{name}="{escape(value)}"' for name, value in labels.items())
+
+
+def route_template(scope):
+    """Шаблон пути маршрута (/api/books/{book_id}), а не сам путь - чтобы число
+    меток не росло с числом разных id."""
+    path = getattr(scope.get("route"), "path", None)
+    if path:
+        return path
+    # Смонтированные приложения (/static) маршрут не сохраняют, но дописывают
+    # свой префикс к root_path
+    prefix = scope.get("root_path", "")[len(scope.get("app_root_path", "")):]
+    return prefix if "app_root_path" in scope and prefix else "<unmatched>"
+
+
+class RequestMetricsMiddleware:
+    """ASGI-middleware: время запроса считается до отправки последнего фрагмента
+    тела, так что потоковые выгрузки учитываются целиком."""
+
+    def __init__(self, app, metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        stats, token = self.metrics.start_request()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.metrics.finish_request(
+                token, stats, scope["method"], route_template(scope), status, time.perf_counter() - started
+            )
@@ -0,0 +1,13 @@
+import orjson
+from fastapi.responses import JSONResponse
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSON через orjson: сериализация в несколько раз быстрее стандартного json,
+    вывод без пробелов. Обработчик возвращает ответ сам, чтобы FastAPI не
+    прогонял данные через jsonable_encoder.
+    """
+
+    def render(self, content):
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
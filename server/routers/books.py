@@ -1,43 +1,122 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy import func, and_
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import func, and_, select, delete
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from database import get_db
+from database import get_db, get_read_db
 from models import *
+from pagination import DEFAULT_PAGE_SIZE
+from search import search_books, SEARCH_LIMIT
+from importer import import_books
+from export import stream_export, books_export_statement, EXPORT_FORMATS
+from lookup_cache import resolve_id, resolve_ids
+from circulation import checkout_book, available_counts, READER_BY_FIO
+from change_versions import conditional
+from projection import parse_fields, parse_ids, fetch_books_projection, fetch_books_by_ids, books_projection_statement
+from responses import FastJSONResponse
+from facets import fetch_facets
 
 router = APIRouter(prefix="/api/books", tags=["books"])
 
-@router.get("/{book_id}")
-async def get_book(book_id: int, db: Session = Depends(get_db)):
+@router.get("", response_class=FastJSONResponse,
+            dependencies=[conditional("books", "book_counts_delta", "publishers", "themes", "authors", "author_book")])
+@router.get("/", response_class=FastJSONResponse, include_in_schema=False,
+            dependencies=[conditional("books", "book_counts_delta", "publishers", "themes", "authors", "author_book")])
+async def list_books(search: str = "", fields: str = None, ids: str = None,
+                     publisher_id: int = None, theme_id: int = None, author_id: int = None,
+                     year_from: int = None, year_to: int = None, available: bool = None,
+                     after: str = None, before: str = None,
+                     limit: int = DEFAULT_PAGE_SIZE, db: AsyncSession = Depends(get_db)):
+    """
+    Список книг: fields= - только нужные поля (id,name,authors,...),
+    ids= - выборка по списку id одним запросом, остальные параметры - фильтры.
+    """
     try:
-        book = db.query(Book).filter(Book.book_id == book_id).first()
+        field_names = parse_fields(fields)
+        filters = {
+            "search": search, "publisher_id": publisher_id, "theme_id": theme_id, "author_id": author_id,
+            "year_from": year_from, "year_to": year_to, "available": available
+        }
+
+        if ids is not None:
+            return FastJSONResponse(await fetch_books_by_ids(db, field_names, parse_ids(ids), filters))
+
+        return FastJSONResponse(
+            await fetch_books_projection(db, field_names, filters, after=after, before=before, limit=limit)
+        )
+
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print(f"Error listing books: {e}")
+        raise HTTPException(status_code=500, detail=f"Ошибка при получении списка книг: {str(e)}")
+
+@router.get("/facets", response_class=FastJSONResponse,
+            dependencies=[conditional("books", "book_counts_delta", "publishers", "themes", "authors", "author_book")])
+async def book_facets(request: Request, search: str = "", publisher_id: int = None, theme_id: int = None,
+                      author_id: int = None, year_from: int = None, year_to: int = None, available: bool = None,
+                      db: AsyncSession = Depends(get_db)):
+    """Количество книг по темам, издателям, авторам и десятилетиям для фильтра."""
+    try:
+        return FastJSONResponse(await fetch_facets(
+            db, versions=request.state.table_versions, search=search, publisher_id=publisher_id, theme_id=theme_id, author_id=author_id,
+            year_from=year_from, year_to=year_to, available=available
+        ))
+
+    except Exception as e:
+        print(f"Error counting book facets: {e}")
+        raise HTTPException(status_code=500, detail=f"Ошибка при подсчете фасетов каталога: {str(e)}")
+
+@router.get("/search", dependencies=[conditional("books", "publishers", "themes")])
+async def search_books_route(q: str = "", limit: int = SEARCH_LIMIT, db: AsyncSession = Depends(get_db)):
+    try:
+        return {"query": q, "results": await search_books(db, q, limit)}
+
+    except Exception as e:
+        print(f"Error searching books: {e}")
+        raise HTTPException(status_code=500, detail=f"Ошибка при поиске книг: {str(e)}")
+
+@router.get("/export")
+async def export_books_route(format: str = "csv"):
+    """Выгрузка всего каталога в CSV или JSONL потоком с серверного курсора."""
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="Поддерживаются форматы csv и jsonl")
+
+    return StreamingResponse(
+        stream_export(books_export_statement(), format),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="books.{format}"'}
+    )
+
+@router.get("/{book_id}", dependencies=[conditional("books", "publishers", "themes", "authors", "author_book", replica=True)])
+async def get_book(book_id: int, db: AsyncSession = Depends(get_read_db)):
+    try:
+        # Книга, издатель, тема и авторы - одним запросом
+        book = (await db.execute(
+            books_projection_statement(["id", "name", "authors", "publisher", "isbn", "release_date", "theme"])
+            .filter(Book.book_id == book_id)
+        )).first()
         if not book:
             raise HTTPException(status_code=404, detail="Книга не найдена")
         
-        # Получаем авторов книги
-        authors = db.query(Author.author_name)\
-                   .join(AuthorBook, Author.author_id == AuthorBook.author_id)\
-                   .filter(AuthorBook.book_id == book_id)\
-                   .all()
-        
-        author_names = [author.author_name for author in authors]
-        
         return {
-            "id": book.book_id,
-            "name": book.book_name,
-            "authors": ", ".join(author_names),
-            "publisher": book.publisher.publisher_name if book.publisher else "",
+            "id": book.id,
+            "name": book.name,
+            "authors": ", ".join(book.authors or []),
+            "publisher": book.publisher or "",
             "isbn": book.isbn or "",
             "release_date": book.release_date or "",
-            "theme": book.theme.theme_name if book.theme else ""
+            "theme": book.theme or ""
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error getting book: {e}")
         raise HTTPException(status_code=500, detail=f"Ошибка при получении данных книги: {str(e)}")
 
 @router.post("/")
-async def add_book(book_data: dict, db: Session = Depends(get_db)):
+async def add_book(book_data: dict, db: AsyncSession = Depends(get_db)):
     try:
         import datetime
         
@@ -70,47 +149,27 @@ async def add_book(book_data: dict, db: Session = Depends(get_db)):
         # Получаем текущую дату
         acquisition_date = datetime.date.today()
         
-        # Находим или создаем издателя
-        publisher_obj = None
-        if publisher:
-            publisher_obj = db.query(Publisher).filter(Publisher.publisher_name == publisher).first()
-            if not publisher_obj:
-                publisher_obj = Publisher(publisher_name=publisher)
-                db.add(publisher_obj)
-                db.flush()  # Получаем ID
-        
-        # Находим или создаем тему
-        theme_obj = None
-        if theme:
-            theme_obj = db.query(Theme).filter(Theme.theme_name == theme).first()
-            if not theme_obj:
-                theme_obj = Theme(theme_name=theme)
-                db.add(theme_obj)
-                db.flush()  # Получаем ID
+        # Находим или создаем издателя и тему (через кэш справочников)
+        publisher_id = await resolve_id(db, Publisher, publisher)
+        theme_id = await resolve_id(db, Theme, theme)
         
         # Создаем книгу
         book = Book(
             book_name=book_name,
-            publisher_id=publisher_obj.publisher_id if publisher_obj else None,
+            publisher_id=publisher_id,
             isbn=isbn if isbn else None,
             release_date=release_date,
-            theme_id=theme_obj.theme_id if theme_obj else None
+            theme_id=theme_id
         )
         db.add(book)
-        db.flush()  # Получаем ID книги
+        await db.flush()  # Получаем ID книги
         
         # Добавляем авторов
         if authors:
-            author_names = [name.strip() for name in authors.split(',') if name.strip()]
-            for author_name in author_names:
-                author = db.query(Author).filter(Author.author_name == author_name).first()
-                if not author:
-                    author = Author(author_name=author_name)
-                    db.add(author)
-                    db.flush()  # Получаем ID автора
-                
+            author_ids = await resolve_ids(db, Author, authors.split(','))
+            for author_id in author_ids.values():
                 # Связываем автора с книгой
-                author_book = AuthorBook(author_id=author.author_id, book_id=book.book_id)
+                author_book = AuthorBook(author_id=author_id, book_id=book.book_id)
                 db.add(author_book)
         
         # Создаем экземпляры книг
@@ -123,20 +182,41 @@ async def add_book(book_data: dict, db: Session = Depends(get_db)):
             db.add(book_item)
         
         # Сохраняем все изменения
-        db.commit()
+        await db.commit()
         
-        return {"message": "Книга успешно добавлена"}
+        return {"message": "Книга успешно добавлена", "book_id": book.book_id}
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(f"Error adding book: {e}")
         raise HTTPException(status_code=500, detail=f"Ошибка при добавлении книги: {str(e)}")
 
+@router.post("/import")
+async def import_books_route(request: Request, format: str = None, db: AsyncSession = Depends(get_db)):
+    """
+    Массовая загрузка каталога. Тело запроса - CSV с заголовком или JSONL
+    с полями book_name, authors, publisher, isbn, release_date, theme,
+    number_of_books, acquisition_date. Формат берется из параметра format
+    или из Content-Type.
+    """
+    content_type = request.headers.get("content-type", "")
+    file_format = format or ("jsonl" if "json" in content_type else "csv")
+    if file_format not in ("csv", "jsonl"):
+        raise HTTPException(status_code=400, detail="Поддерживаются форматы csv и jsonl")
+
+    try:
+        return await import_books(db, request.stream(), file_format)
+
+    except Exception as e:
+        await db.rollback()
+        print(f"Error importing books: {e}")
+        raise HTTPException(status_code=500, detail=f"Ошибка при импорте книг: {str(e)}")
+
 @router.put("/{book_id}")
-async def update_book(book_id: int, book_data: dict, db: Session = Depends(get_db)):
+async def update_book(book_id: int, book_data: dict, db: AsyncSession = Depends(get_db)):
     try:
         # Находим книгу
-        book = db.query(Book).filter(Book.book_id == book_id).first()
+        book = await db.scalar(select(Book).filter(Book.book_id == book_id))
         if not book:
             raise HTTPException(status_code=404, detail="Книга не найдена")
         
@@ -159,74 +239,56 @@ async def update_book(book_id: int, book_data: dict, db: Session = Depends(get_d
             except ValueError:
                 release_date = None
         
-        # Обновляем издателя
-        publisher_obj = None
-        if publisher:
-            publisher_obj = db.query(Publisher).filter(Publisher.publisher_name == publisher).first()
-            if not publisher_obj:
-                publisher_obj = Publisher(publisher_name=publisher)
-                db.add(publisher_obj)
-                db.flush()
-        
-        # Обновляем тему
-        theme_obj = None
-        if theme:
-            theme_obj = db.query(Theme).filter(Theme.theme_name == theme).first()
-            if not theme_obj:
-                theme_obj = Theme(theme_name=theme)
-                db.add(theme_obj)
-                db.flush()
+        # Обновляем издателя и тему (через кэш справочников)
+        publisher_id = await resolve_id(db, Publisher, publisher)
+        theme_id = await resolve_id(db, Theme, theme)
         
         # Обновляем данные книги
         book.book_name = book_name
-        book.publisher_id = publisher_obj.publisher_id if publisher_obj else None
+        book.publisher_id = publisher_id
         book.isbn = isbn if isbn else None
         book.release_date = release_date
-        book.theme_id = theme_obj.theme_id if theme_obj else None
+        book.theme_id = theme_id
         
         # Обновляем авторов
         if authors:
             # Удаляем старых авторов
-            db.query(AuthorBook).filter(AuthorBook.book_id == book_id).delete()
+            await db.execute(delete(AuthorBook).filter(AuthorBook.book_id == book_id))
             
             # Добавляем новых авторов
-            author_names = [name.strip() for name in authors.split(',') if name.strip()]
-            for author_name in author_names:
-                author = db.query(Author).filter(Author.author_name == author_name).first()
-                if not author:
-                    author = Author(author_name=author_name)
-                    db.add(author)
-                    db.flush()
-                
+            author_ids = await resolve_ids(db, Author, authors.split(','))
+            for author_id in author_ids.values():
                 # Связываем автора с книгой
-                author_book = AuthorBook(author_id=author.author_id, book_id=book.book_id)
+                author_book = AuthorBook(author_id=author_id, book_id=book.book_id)
                 db.add(author_book)
         
-        db.commit()
+        await db.commit()
         
         return {"message": "Книга успешно обновлена"}
         
     except HTTPException:
-        db.rollback()
+        await db.rollback()
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(f"Error updating book: {e}")
         raise HTTPException(status_code=500, detail=f"Ошибка при обновлении книги: {str(e)}")
 
 @router.delete("/{book_id}")
-async def delete_book(book_id: int, db: Session = Depends(get_db)):
+async def delete_book(book_id: int, db: AsyncSession = Depends(get_db)):
     try:
         # Находим книгу
-        book = db.query(Book).filter(Book.book_id == book_id).first()
+        book = await db.scalar(select(Book).filter(Book.book_id == book_id))
         if not book:
             raise HTTPException(status_code=404, detail="Книга не найдена")
         
         # Проверяем, есть ли активные займы для этой книги
-        active_loans = db.query(BookLoan).join(BookItem).filter(
-            BookItem.book_id == book_id,
-            BookLoan.loan_return_date == None
-        ).count()
+        active_loans = await db.scalar(
+            select(func.count(BookLoan.loan_id)).join(BookItem).filter(
+                BookItem.book_id == book_id,
+                BookLoan.loan_return_date == None
+            )
+        )
         
         if active_loans > 0:
             raise HTTPException(
@@ -235,22 +297,22 @@ async def delete_book(book_id: int, db: Session = Depends(get_db)):
             )
         
         # Удаляем связи с авторами
-        db.query(AuthorBook).filter(AuthorBook.book_id == book_id).delete()
+        await db.execute(delete(AuthorBook).filter(AuthorBook.book_id == book_id))
         
         # Удаляем экземпляры книг
-        db.query(BookItem).filter(BookItem.book_id == book_id).delete()
+        await db.execute(delete(BookItem).filter(BookItem.book_id == book_id))
         
         # Удаляем саму книгу
-        db.delete(book)
-        db.commit()
+        await db.delete(book)
+        await db.commit()
         
         return {"message": "Книга успешно удалена"}
         
     except HTTPException:
-        db.rollback()
+        await db.rollback()
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(f"Error deleting book: {e}")
         raise HTTPException(status_code=500, detail=f"Ошибка при удалении книги: {str(e)}")
 
@@ -259,7 +321,7 @@ async def delete_book(book_id: int, db: Session = Depends(get_db)):
 
 # books.py - добавь этот endpoint
 @router.post("/{book_id}/loan")
-async def loan_book_to_reader(book_id: int, loan_data: dict, db: Session = Depends(get_db)):
+async def loan_book_to_reader(book_id: int, loan_data: dict, db: AsyncSession = Depends(get_db)):
     try:
         import datetime
         
@@ -279,35 +341,28 @@ async def loan_book_to_reader(book_id: int, loan_data: dict, db: Session = Depen
             raise HTTPException(status_code=400, detail="Неверный формат даты. Используйте YYYY-MM-DD")
         
         # Проверяем существование читателя
-        reader = db.query(Reader).filter(Reader.fio == reader_fio).first()
+        reader = await db.scalar(READER_BY_FIO, {'fio': reader_fio})
         if not reader:
             raise HTTPException(status_code=404, detail="Читатель не найден")
         
-        # Находим доступный экземпляр книги
-        book_item = db.query(BookItem)\
-                     .join(Book, BookItem.book_id == Book.book_id)\
-                     .filter(
-                         Book.book_id == book_id,
-                         BookItem.book_state == 'Доступна'
-                     )\
-                     .first()
-        
-        if not book_item:
+        # Быстрая проверка по счетчику книги, без блокировок экземпляров
+        available = (await available_counts(db, [book_id])).get(book_id)
+        if available is None:
+            raise HTTPException(status_code=404, detail="Книга не найдена")
+        if available == 0:
             raise HTTPException(status_code=400, detail="Нет доступных экземпляров этой книги")
         
-        # Создаем запись о выдаче
-        loan = BookLoan(
+        # Захватываем свободный экземпляр и создаем запись о выдаче одним оператором
+        loan = await checkout_book(
+            db, book_id, reader.reader_id,
             loan_date=datetime.date.today(),
-            loan_due_date=loan_due_date,
-            book_item_id=book_item.book_item_id,
-            reader_id=reader.reader_id
+            loan_due_date=loan_due_date
         )
         
-        # Обновляем статус экземпляра
-        book_item.book_state = 'Займ'
+        if not loan:
+            raise HTTPException(status_code=400, detail="Нет доступных экземпляров этой книги")
         
-        db.add(loan)
-        db.commit()
+        await db.commit()
         
         return {
             "message": f"Книга успешно выдана читателю {reader_fio}",
@@ -316,10 +371,10 @@ async def loan_book_to_reader(book_id: int, loan_data: dict, db: Session = Depen
         }
         
     except HTTPException:
-        db.rollback()
+        await db.rollback()
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(f"Error loaning book: {e}")
         raise HTTPException(status_code=500, detail=f"Ошибка при выдаче книги: {str(e)}")
 
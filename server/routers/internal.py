@@ -0,0 +1,88 @@
+from fastapi import APIRouter, Depends
+
+from database import Settings, async_engine, pool_metrics, get_db, replica_router
+import lookup_cache
+from overdue import refresh_overdue_report
+from reader_index import reader_index
+from facets import facet_cache
+from statement_cache import statement_cache
+import loan_archive
+
+router = APIRouter(prefix="/internal", tags=["internal"])
+
+@router.get("/pool")
+async def get_pool_stats():
+    return {
+        "settings": {
+            "pool_size": Settings.DB_POOL_SIZE,
+            "max_overflow": Settings.DB_MAX_OVERFLOW,
+            "pool_timeout": Settings.DB_POOL_TIMEOUT,
+            "pool_recycle": Settings.DB_POOL_RECYCLE,
+            "pool_pre_ping": Settings.DB_POOL_PRE_PING,
+            "statement_timeout_ms": Settings.DB_STATEMENT_TIMEOUT
+        },
+        "pool": pool_metrics.snapshot(async_engine.pool)
+    }
+
+@router.get("/lookup-cache")
+async def get_lookup_cache_stats():
+    return lookup_cache.stats()
+
+@router.delete("/lookup-cache")
+async def clear_lookup_cache():
+    lookup_cache.clear_all()
+    return {"message": "Кэш справочников очищен"}
+
+@router.post("/overdue/refresh")
+async def refresh_overdue():
+    elapsed = await refresh_overdue_report()
+    if elapsed is None:
+        return {"message": "Отчет уже обновляется другим процессом"}
+    return {"message": "Отчет о просрочках обновлен", "elapsed_ms": round(elapsed * 1000, 1)}
+
+@router.get("/reader-index")
+async def get_reader_index_stats():
+    return reader_index.stats()
+
+@router.post("/reader-index/refresh")
+async def refresh_reader_index():
+    await reader_index.refresh(force=True)
+    return {"message": "Индекс ФИО читателей перестроен", **reader_index.stats()}
+
+@router.get("/facet-cache")
+async def get_facet_cache_stats():
+    return facet_cache.stats()
+
+@router.delete("/facet-cache")
+async def clear_facet_cache():
+    facet_cache.clear()
+    return {"message": "Кэш фасетов каталога очищен"}
+
+@router.get("/loans/partitions")
+async def get_loan_partitions(db=Depends(get_db)):
+    return {
+        "archive_years": Settings.LOAN_ARCHIVE_YEARS,
+        "archive_dir": Settings.LOAN_ARCHIVE_DIR,
+        "partitions": await loan_archive.list_loan_partitions(db)
+    }
+
+@router.post("/loans/archive")
+async def archive_loans(years: int = None):
+    years = years or Settings.LOAN_ARCHIVE_YEARS
+    if years <= 0:
+        return {"message": "Архивирование выключено: задайте LOAN_ARCHIVE_YEARS или параметр years"}
+    archived = await loan_archive.archive_old_loans(years)
+    if archived is None:
+        return {"message": "Архивирование уже выполняется другим процессом"}
+    return {"message": f"Архивировано секций: {len(archived)}", "archived": archived}
+
+@router.get("/replicas")
+async def get_replica_stats():
+    return replica_router.stats()
+
+@router.get("/statement-cache")
+async def get_statement_cache_stats():
+    return {
+        "prepared_statement_cache_size": Settings.DB_PREPARED_STATEMENT_CACHE_SIZE,
+        **statement_cache.stats()
+    }
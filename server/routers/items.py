@@ -0,0 +1,37 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import get_db
+from inventory import parse_item_selection, change_item_states
+
+router = APIRouter(prefix="/api/items", tags=["items"])
+
+
+@router.post("/state")
+async def change_items_state(state_data: dict, db: AsyncSession = Depends(get_db)):
+    """
+    Пакетная смена состояния экземпляров (write_off, lost, restore) по списку
+    book_item_ids или диапазону from_id..to_id. dry_run - только сводка, без изменений.
+    """
+    try:
+        ids, id_range = parse_item_selection(state_data)
+        dry_run = bool(state_data.get('dry_run', False))
+
+        summary = await change_item_states(
+            db, state_data.get('action'), ids=ids, id_range=id_range, reason=state_data.get('reason')
+        )
+
+        if dry_run:
+            await db.rollback()
+        else:
+            await db.commit()
+
+        return {"dry_run": dry_run, **summary}
+
+    except ValueError as e:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        await db.rollback()
+        print(f"Error changing item states: {e}")
+        raise HTTPException(status_code=500, detail=f"Ошибка при изменении состояния экземпляров: {str(e)}")
@@ -1,40 +1,192 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from datetime import datetime
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime, date
 
 from database import get_db
 from models import *
+from circulation import checkout_books, return_loans, READER_BY_FIO, MAX_BATCH_SIZE
+from export import stream_export, loans_export_statement, EXPORT_FORMATS
+from overdue import fetch_overdue_page
+from pagination import DEFAULT_PAGE_SIZE
 
 router = APIRouter(prefix="/api/loans", tags=["loans"])
 
+
+# Наибольшее значение столбца integer: большие id не проходят в запрос
+MAX_ID = 2**31 - 1
+
+
+def parse_id(value, key):
+    # bool - подкласс int, а int() отбрасывает дробную часть: ни true,
+    # ни 1.5 не должны стать id 1
+    if isinstance(value, (bool, float)):
+        raise HTTPException(status_code=400, detail=f"Поле {key} должно быть целым числом")
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail=f"Поле {key} должно быть целым числом")
+    if not 0 < value <= MAX_ID:
+        raise HTTPException(status_code=400, detail=f"Поле {key} вне допустимого диапазона")
+    return value
+
+
+def parse_id_list(data, key):
+    ids = data.get(key)
+    if not isinstance(ids, list) or not ids:
+        raise HTTPException(status_code=400, detail=f"Поле {key} должно быть непустым списком")
+    if len(ids) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"Не более {MAX_BATCH_SIZE} позиций за один запрос")
+    try:
+        return [parse_id(item_id, key) for item_id in ids]
+    except HTTPException:
+        raise HTTPException(status_code=400, detail=f"Поле {key} должно содержать целые числа")
+
+
+def parse_checkout_request(data):
+    """
+    Проверка тела пакетной выдачи до обращения к базе. Возвращает
+    (book_ids, reader_id или None, reader_fio или None, loan_due_date).
+    """
+    book_ids = parse_id_list(data, 'book_ids')
+    reader_id = data.get('reader_id')
+    reader_fio = data.get('reader_fio')
+    loan_due_date = data.get('loan_due_date')
+
+    # Пустое поле формы - читатель не указан
+    if reader_id == '':
+        reader_id = None
+    if reader_id is None and not reader_fio:
+        raise HTTPException(status_code=400, detail="Укажите читателя (reader_id или reader_fio)")
+    if reader_id is not None:
+        reader_id, reader_fio = parse_id(reader_id, 'reader_id'), None
+    elif not isinstance(reader_fio, str):
+        raise HTTPException(status_code=400, detail="Поле reader_fio должно быть строкой")
+
+    if not loan_due_date:
+        raise HTTPException(status_code=400, detail="Дата возврата обязательна")
+    if not isinstance(loan_due_date, str):
+        raise HTTPException(status_code=400, detail="Неверный формат даты. Используйте YYYY-MM-DD")
+    try:
+        loan_due_date = datetime.strptime(loan_due_date, '%Y-%m-%d').date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Неверный формат даты. Используйте YYYY-MM-DD")
+
+    return book_ids, reader_id, reader_fio, loan_due_date
+
+
+@router.get("/export")
+async def export_loans(format: str = "csv", date_from: date = None, date_to: date = None):
+    """Выгрузка истории займов в CSV или JSONL потоком с серверного курсора."""
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="Поддерживаются форматы csv и jsonl")
+
+    return StreamingResponse(
+        stream_export(loans_export_statement(date_from, date_to), format),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="loans.{format}"'}
+    )
+
+
+@router.get("/overdue")
+async def list_overdue(sort: str = "days", reader_id: int = None, min_days: int = None,
+                       after: str = None, before: str = None, limit: int = DEFAULT_PAGE_SIZE,
+                       db: AsyncSession = Depends(get_db)):
+    """Просроченные займы по всей библиотеке: sort=days (сначала самые давние) или sort=reader."""
+    try:
+        return await fetch_overdue_page(
+            db, sort=sort, reader_id=reader_id, min_days=min_days, after=after, before=before, limit=limit
+        )
+
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print(f"Error getting overdue loans: {e}")
+        raise HTTPException(status_code=500, detail=f"Ошибка при получении просроченных займов: {str(e)}")
+
+
+@router.post("/checkout")
+async def checkout_batch(checkout_data: dict, db: AsyncSession = Depends(get_db)):
+    """Выдача нескольких книг одному читателю: одна транзакция, результат по каждой книге."""
+    try:
+        book_ids, reader_id, reader_fio, loan_due_date = parse_checkout_request(checkout_data)
+
+        # Читатель определяется один раз на весь пакет
+        if reader_id is not None:
+            reader = await db.get(Reader, reader_id)
+        else:
+            reader = await db.scalar(READER_BY_FIO, {'fio': reader_fio})
+        if not reader:
+            raise HTTPException(status_code=404, detail="Читатель не найден")
+
+        results = await checkout_books(
+            db, book_ids, reader.reader_id,
+            loan_date=datetime.now().date(),
+            loan_due_date=loan_due_date
+        )
+        await db.commit()
+
+        return {
+            "reader_id": reader.reader_id,
+            "reader_fio": reader.fio,
+            "due_date": loan_due_date.isoformat(),
+            "issued": sum(1 for result in results if result["ok"]),
+            "failed": sum(1 for result in results if not result["ok"]),
+            "results": results
+        }
+
+    except HTTPException:
+        await db.rollback()
+        raise
+    except Exception as e:
+        await db.rollback()
+        print(f"Error in batch checkout: {e}")
+        raise HTTPException(status_code=500, detail=f"Ошибка при выдаче книг: {str(e)}")
+
+
+@router.post("/return")
+async def return_batch(return_data: dict, db: AsyncSession = Depends(get_db)):
+    """Возврат нескольких займов: одна транзакция, результат по каждому займу."""
+    try:
+        loan_ids = parse_id_list(return_data, 'loan_ids')
+
+        results = await return_loans(db, loan_ids, return_date=datetime.now().date())
+        await db.commit()
+
+        return {
+            "returned": sum(1 for result in results if result["ok"]),
+            "failed": sum(1 for result in results if not result["ok"]),
+            "results": results
+        }
+
+    except HTTPException:
+        await db.rollback()
+        raise
+    except Exception as e:
+        await db.rollback()
+        print(f"Error in batch return: {e}")
+        raise HTTPException(status_code=500, detail=f"Ошибка при возврате книг: {str(e)}")
+
+
 @router.post("/{loan_id}/return")
-async def return_loan(loan_id: int, return_data: dict, db: Session = Depends(get_db)):
+async def return_loan(loan_id: int, return_data: dict, db: AsyncSession = Depends(get_db)):
     try:
-        # Находим займ
-        loan = db.query(BookLoan).filter(BookLoan.loan_id == loan_id).first()
-        if not loan:
-            raise HTTPException(status_code=404, detail="Займ не найден")
-        
-        # Проверяем, не возвращена ли уже книга
-        if loan.loan_return_date:
-            raise HTTPException(status_code=400, detail="Книга уже возвращена")
-        
-        # Обновляем дату возврата
-        loan.loan_return_date = datetime.now().date()
-        
-        # Обновляем статус книги
-        book_item = db.query(BookItem).filter(BookItem.book_item_id == loan.book_item_id).first()
-        if book_item:
-            book_item.book_state = 'Доступна'
-        
-        db.commit()
+        # Тот же оператор, что и у пакетного возврата: займ закрывается, только
+        # если он еще открыт, параллельный возврат не приводит к ошибке
+        result, = await return_loans(db, [loan_id], return_date=datetime.now().date())
+        if not result["ok"]:
+            status_code = 404 if result["error"] == "Займ не найден" else 400
+            raise HTTPException(status_code=status_code, detail=result["error"])
+
+        await db.commit()
         
         return {"message": "Книга успешно возвращена"}
         
     except HTTPException:
-        db.rollback()
+        await db.rollback()
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(f"Error returning loan: {e}")
         raise HTTPException(status_code=500, detail=f"Ошибка при возврате книги: {str(e)}")
@@ -1,17 +1,43 @@
-from datetime import datetime
+from datetime import date
 
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy import func, select, delete
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from database import get_db
+from database import get_db, get_read_db
 from models import *
+from catalog import fetch_readers_page, fetch_reader_loans_page
+from pagination import DEFAULT_PAGE_SIZE
+from change_versions import conditional
+from reader_index import autocomplete_readers, AUTOCOMPLETE_LIMIT
 
 router = APIRouter(prefix="/api/readers", tags=["readers"])
 
-@router.get("/{reader_id}")
-async def get_reader(reader_id: int, db: Session = Depends(get_db)):
+@router.get("/", dependencies=[conditional("readers", "book_loans")])
+async def list_readers(search: str = "", after: str = None, before: str = None,
+                       limit: int = DEFAULT_PAGE_SIZE, db: AsyncSession = Depends(get_db)):
     try:
-        reader = db.query(Reader).filter(Reader.reader_id == reader_id).first()
+        return await fetch_readers_page(db, search, after=after, before=before, limit=limit)
+
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print(f"Error listing readers: {e}")
+        raise HTTPException(status_code=500, detail=f"Ошибка при получении списка читателей: {str(e)}")
+
+@router.get("/autocomplete")
+async def autocomplete(q: str = "", limit: int = AUTOCOMPLETE_LIMIT, db: AsyncSession = Depends(get_db)):
+    try:
+        return {"query": q, "results": await autocomplete_readers(db, q, limit)}
+
+    except Exception as e:
+        print(f"Error autocompleting readers: {e}")
+        raise HTTPException(status_code=500, detail=f"Ошибка при подборе читателей: {str(e)}")
+
+@router.get("/{reader_id}", dependencies=[conditional("readers")])
+async def get_reader(reader_id: int, db: AsyncSession = Depends(get_db)):
+    try:
+        reader = await db.scalar(select(Reader).filter(Reader.reader_id == reader_id))
         if not reader:
             raise HTTPException(status_code=404, detail="Читатель не найден")
         
@@ -27,7 +53,7 @@ async def get_reader(reader_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"Ошибка при получении данных читателя: {str(e)}")
 
 @router.post("/")
-async def add_reader(reader_data: dict, db: Session = Depends(get_db)):
+async def add_reader(reader_data: dict, db: AsyncSession = Depends(get_db)):
     try:
         # Получаем данные из запроса
         fio = reader_data.get('fio')
@@ -39,7 +65,7 @@ async def add_reader(reader_data: dict, db: Session = Depends(get_db)):
             raise HTTPException(status_code=400, detail="ФИО обязательно")
         
         # Проверяем, нет ли уже читателя с таким ФИО
-        existing_reader = db.query(Reader).filter(Reader.fio == fio).first()
+        existing_reader = await db.scalar(select(Reader).filter(Reader.fio == fio))
         if existing_reader:
             raise HTTPException(status_code=400, detail="Читатель с таким ФИО уже существует")
         
@@ -51,23 +77,23 @@ async def add_reader(reader_data: dict, db: Session = Depends(get_db)):
         )
         
         db.add(reader)
-        db.commit()
+        await db.commit()
         
-        return {"message": "Читатель успешно добавлен"}
+        return {"message": "Читатель успешно добавлен", "reader_id": reader.reader_id}
         
     except HTTPException:
-        db.rollback()
+        await db.rollback()
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(f"Error adding reader: {e}")
         raise HTTPException(status_code=500, detail=f"Ошибка при добавлении читателя: {str(e)}")
 
 @router.put("/{reader_id}")
-async def update_reader(reader_id: int, reader_data: dict, db: Session = Depends(get_db)):
+async def update_reader(reader_id: int, reader_data: dict, db: AsyncSession = Depends(get_db)):
     try:
         # Находим читателя
-        reader = db.query(Reader).filter(Reader.reader_id == reader_id).first()
+        reader = await db.scalar(select(Reader).filter(Reader.reader_id == reader_id))
         if not reader:
             raise HTTPException(status_code=404, detail="Читатель не найден")
         
@@ -81,10 +107,10 @@ async def update_reader(reader_id: int, reader_data: dict, db: Session = Depends
             raise HTTPException(status_code=400, detail="ФИО обязательно")
         
         # Проверяем, нет ли другого читателя с таким ФИО
-        existing_reader = db.query(Reader).filter(
+        existing_reader = await db.scalar(select(Reader).filter(
             Reader.fio == fio,
             Reader.reader_id != reader_id
-        ).first()
+        ))
         if existing_reader:
             raise HTTPException(status_code=400, detail="Читатель с таким ФИО уже существует")
         
@@ -93,31 +119,31 @@ async def update_reader(reader_id: int, reader_data: dict, db: Session = Depends
         reader.dolzhnost = dolzhnost.strip() if dolzhnost else None
         reader.uchenaya_stepen = uchenaya_stepen.strip() if uchenaya_stepen else None
         
-        db.commit()
+        await db.commit()
         
         return {"message": "Читатель успешно обновлен"}
         
     except HTTPException:
-        db.rollback()
+        await db.rollback()
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(f"Error updating reader: {e}")
         raise HTTPException(status_code=500, detail=f"Ошибка при обновлении читателя: {str(e)}")
 
 @router.delete("/{reader_id}")
-async def delete_reader(reader_id: int, db: Session = Depends(get_db)):
+async def delete_reader(reader_id: int, db: AsyncSession = Depends(get_db)):
     try:
         # Находим читателя
-        reader = db.query(Reader).filter(Reader.reader_id == reader_id).first()
+        reader = await db.scalar(select(Reader).filter(Reader.reader_id == reader_id))
         if not reader:
             raise HTTPException(status_code=404, detail="Читатель не найден")
         
         # Проверяем, есть ли активные займы у читателя
-        active_loans = db.query(BookLoan).filter(
+        active_loans = await db.scalar(select(func.count(BookLoan.loan_id)).filter(
             BookLoan.reader_id == reader_id,
             BookLoan.loan_return_date == None
-        ).count()
+        ))
         
         if active_loans > 0:
             raise HTTPException(
@@ -126,19 +152,19 @@ async def delete_reader(reader_id: int, db: Session = Depends(get_db)):
             )
         
         # Удаляем все займы читателя (историю)
-        db.query(BookLoan).filter(BookLoan.reader_id == reader_id).delete()
+        await db.execute(delete(BookLoan).filter(BookLoan.reader_id == reader_id))
         
         # Удаляем самого читателя
-        db.delete(reader)
-        db.commit()
+        await db.delete(reader)
+        await db.commit()
         
         return {"message": "Читатель успешно удален"}
         
     except HTTPException:
-        db.rollback()
+        await db.rollback()
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(f"Error deleting reader: {e}")
         raise HTTPException(status_code=500, detail=f"Ошибка при удалении читателя: {str(e)}")
 
@@ -147,58 +173,35 @@ async def delete_reader(reader_id: int, db: Session = Depends(get_db)):
 
 # Добавьте этот endpoint в readers.py после существующих функций
 
-@router.get("/{reader_id}/loans")
-async def get_reader_loans(reader_id: int, db: Session = Depends(get_db)):
+@router.get("/{reader_id}/loans", dependencies=[conditional("readers", "book_loans", "book_items", "books", replica=True)])
+async def get_reader_loans(reader_id: int, status: str = None, date_from: date = None, date_to: date = None,
+                           after: str = None, before: str = None, limit: int = DEFAULT_PAGE_SIZE,
+                           db: AsyncSession = Depends(get_read_db)):
     try:
         # Проверяем существование читателя
-        reader = db.query(Reader).filter(Reader.reader_id == reader_id).first()
+        reader = await db.scalar(select(Reader).filter(Reader.reader_id == reader_id))
         if not reader:
             raise HTTPException(status_code=404, detail="Читатель не найден")
         
-        # Получаем все займы читателя
-        loans = db.query(
-            BookLoan.loan_id,
-            BookLoan.loan_date,
-            BookLoan.loan_due_date,
-            BookLoan.loan_return_date,
-            BookLoan.book_item_id,
-            BookLoan.reader_id,
-            BookLoan.loan_return_date
-        ).filter(BookLoan.reader_id == reader_id).all()
-        
-        # Получаем информацию о книгах для каждого займа
-        loans_with_books = []
-        for loan in loans:
-            # Находим книгу через book_item
-            book_item = db.query(BookItem).filter(BookItem.book_item_id == loan.book_item_id).first()
-            if book_item:
-                book = db.query(Book).filter(Book.book_id == book_item.book_id).first()
-                if book:
-                    # Определяем статус займа
-                    status = "Возвращена" if loan.loan_return_date else "На руках"
-                    if loan.loan_return_date and loan.loan_return_date > loan.loan_due_date:
-                        status = "Возвращена с опозданием"
-                    elif not loan.loan_return_date and loan.loan_due_date < datetime.now().date():
-                        status = "Просрочена"
-                    
-                    loans_with_books.append({
-                        "loan_id": loan.loan_id,
-                        "book_name": book.book_name,
-                        "loan_date": loan.loan_date.isoformat() if loan.loan_date else None,
-                        "loan_due_date": loan.loan_due_date.isoformat() if loan.loan_due_date else None,
-                        "loan_return_date": loan.loan_return_date.isoformat() if loan.loan_return_date else None,
-                        "status": status,
-                        "book_item_id": loan.book_item_id
-                    })
+        # Займы вместе с названиями книг и статусами - одним запросом
+        page = await fetch_reader_loans_page(
+            db, reader_id, status=status, date_from=date_from, date_to=date_to,
+            after=after, before=before, limit=limit
+        )
         
         return {
             "reader_id": reader_id,
             "reader_fio": reader.fio,
-            "loans": loans_with_books
+            "loans": page["items"],
+            "next_cursor": page["next_cursor"],
+            "prev_cursor": page["prev_cursor"],
+            "limit": page["limit"]
         }
         
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         print(f"Error getting reader loans: {e}")
         raise HTTPException(status_code=500, detail=f"Ошибка при получении займов читателя: {str(e)}")
-
-
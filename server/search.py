@@ -0,0 +1,59 @@
+from sqlalchemy import func, literal_column, or_
+
+from models import *
+from catalog import books_statement, book_to_dict
+
+
+SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+
+# Конфигурация должна совпадать с выражением индекса books_name_fts_idx
+SEARCH_CONFIG = literal_column("'russian'")
+
+
+def escape_like(value):
+    """Экранирует спецсимволы LIKE, чтобы запрос искался как обычная подстрока."""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def search_books_statement(query, limit=SEARCH_LIMIT):
+    """
+    Поиск книг по названию с ранжированием.
+
+    Совпадения ищутся по полнотекстовому индексу (слова с учетом морфологии)
+    и по триграммному индексу (произвольная подстрока). Ранг - лучший из
+    ts_rank и word_similarity.
+    """
+    document = func.to_tsvector(SEARCH_CONFIG, Book.book_name)
+    ts_query = func.plainto_tsquery(SEARCH_CONFIG, query)
+
+    rank = func.greatest(
+        func.ts_rank(document, ts_query),
+        func.word_similarity(query, Book.book_name)
+    ).label('rank')
+
+    return books_statement()\
+        .add_columns(rank)\
+        .filter(or_(
+            document.op('@@')(ts_query),
+            Book.book_name.ilike(f"%{escape_like(query)}%", escape="\\")
+        ))\
+        .order_by(rank.desc(), Book.book_name, Book.book_id)\
+        .limit(limit)
+
+
+async def search_books(db, query, limit=SEARCH_LIMIT):
+    query = (query or "").strip()
+    if not query:
+        return []
+
+    limit = max(1, min(int(limit), MAX_SEARCH_LIMIT))
+    rows = (await db.execute(search_books_statement(query, limit))).all()
+
+    results = []
+    for row in rows:
+        book = book_to_dict(row)
+        book["rank"] = round(float(row.rank), 4)
+        results.append(book)
+
+    return results
@@ -0,0 +1,34 @@
+class StatementCache:
+    """
+    Готовые объекты запросов горячих маршрутов.
+
+    Запрос строится один раз для своей формы (какие фильтры заданы, направление
+    страницы), значения передаются параметрами при выполнении. Повторное
+    выполнение того же объекта не строит выражение заново, ключ кэша
+    компиляции SQLAlchemy запоминается в самом объекте, а asyncpg находит
+    подготовленный на соединении оператор по тексту SQL. Форм конечное число
+    (комбинации фильтров), поэтому размер кэша не ограничивается.
+    """
+
+    def __init__(self):
+        self._statements = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, build):
+        stmt = self._statements.get(key)
+        if stmt is None:
+            self.misses += 1
+            stmt = self._statements[key] = build()
+        else:
+            self.hits += 1
+        return stmt
+
+    def clear(self):
+        self._statements.clear()
+
+    def stats(self):
+        return {"statements": len(self._statements), "hits": self.hits, "misses": self.misses}
+
+
+statement_cache = StatementCache()
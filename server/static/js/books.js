@@ -263,8 +263,10 @@ function openLoanBookModal() {
                                 ФИО читателя *
                             </label>
                             <input type="text" id="reader_fio" name="reader_fio" required
+                                   list="reader_fio_suggestions" autocomplete="off"
                                    class="w-full px-3 py-2 border border-gray-300 rounded-md focus:outline-none focus:ring-2 focus:ring-blue-500"
                                    placeholder="Иванов Иван Иванович">
+                            <datalist id="reader_fio_suggestions"></datalist>
                         </div>
 
                         <div class="mb-4">
@@ -297,6 +299,11 @@ function openLoanBookModal() {
                 closeLoanBookModal();
             }
         });
+
+        document.getElementById('reader_fio').addEventListener('input', function() {
+            clearTimeout(readerSuggestTimer);
+            readerSuggestTimer = setTimeout(() => suggestReaders(this.value), 150);
+        });
     }
     
     document.getElementById('loan_book_id').value = selectedItemId;
@@ -313,11 +320,47 @@ function openLoanBookModal() {
     loanModal.classList.remove('hidden');
 }
 
+let readerSuggestTimer = null;
+let readerSuggestController = null;
+
+// Подсказки ФИО читателя по первым буквам
+async function suggestReaders(prefix) {
+    const datalist = document.getElementById('reader_fio_suggestions');
+    if (readerSuggestController) {
+        readerSuggestController.abort();
+    }
+    if (!prefix.trim()) {
+        datalist.innerHTML = '';
+        return;
+    }
+
+    readerSuggestController = new AbortController();
+    try {
+        const response = await fetch(`/api/readers/autocomplete?q=${encodeURIComponent(prefix)}&limit=10`, {
+            signal: readerSuggestController.signal
+        });
+        if (!response.ok) return;
+
+        const data = await response.json();
+        datalist.innerHTML = '';
+        data.results.forEach(reader => {
+            const option = document.createElement('option');
+            option.value = reader.fio;
+            datalist.appendChild(option);
+        });
+    } catch (error) {
+        if (error.name !== 'AbortError') {
+            console.error('Error:', error);
+        }
+    }
+}
+
 function closeLoanBookModal() {
     const loanModal = document.getElementById('loanBookModal');
     if (loanModal) {
         loanModal.classList.add('hidden');
         document.getElementById('loanBookForm').reset();
+        document.getElementById('reader_fio_suggestions').innerHTML = '';
     }
 }
 
@@ -145,24 +145,99 @@ async function updateReader(event) {
     }
 }
 
+// Состояние модального окна займов (постраничная загрузка)
+let loansReaderId = null;
+let loansNextCursor = null;
+let loansShown = 0;
+
+async function fetchReaderLoans(readerId, cursor = null) {
+    const params = new URLSearchParams();
+    const status = document.getElementById('loansStatusFilter').value;
+    const dateFrom = document.getElementById('loansDateFrom').value;
+    const dateTo = document.getElementById('loansDateTo').value;
+
+    if (status) params.set('status', status);
+    if (dateFrom) params.set('date_from', dateFrom);
+    if (dateTo) params.set('date_to', dateTo);
+    if (cursor) params.set('after', cursor);
+
+    const response = await fetch(`/api/readers/${readerId}/loans?${params}`);
+    if (!response.ok) {
+        throw new Error('Ошибка загрузки данных о займах');
+    }
+    return response.json();
+}
+
 async function viewReaderLoans() {
     if (selectedItemId) {
-        try {
-            const response = await fetch(`/api/readers/${selectedItemId}/loans`);
-            if (!response.ok) {
-                throw new Error('Ошибка загрузки данных о займах');
-            }
-            
-            const loansData = await response.json();
-            openViewLoansModal(loansData);
-            
-        } catch (error) {
-            console.error('Error loading reader loans:', error);
-            alert('Ошибка при загрузке данных о займах');
-        }
+        loansReaderId = selectedItemId;
+        document.getElementById('loansStatusFilter').value = '';
+        document.getElementById('loansDateFrom').value = '';
+        document.getElementById('loansDateTo').value = '';
+        await reloadReaderLoans();
+    }
+}
+
+async function reloadReaderLoans() {
+    if (!loansReaderId) return;
+
+    try {
+        const loansData = await fetchReaderLoans(loansReaderId);
+        openViewLoansModal(loansData);
+    } catch (error) {
+        console.error('Error loading reader loans:', error);
+        alert('Ошибка при загрузке данных о займах');
     }
 }
 
+async function loadMoreReaderLoans() {
+    if (!loansReaderId || !loansNextCursor) return;
+
+    try {
+        const loansData = await fetchReaderLoans(loansReaderId, loansNextCursor);
+        const tableBody = document.getElementById('loansTableBody');
+        tableBody.insertAdjacentHTML('beforeend', loansData.loans.map(
+            (loan, index) => renderLoanRow(loan, loansShown + index)
+        ).join(''));
+        loansShown += loansData.loans.length;
+        setLoansNextCursor(loansData.next_cursor);
+    } catch (error) {
+        console.error('Error loading reader loans:', error);
+        alert('Ошибка при загрузке данных о займах');
+    }
+}
+
+function setLoansNextCursor(cursor) {
+    loansNextCursor = cursor;
+    const loadMoreButton = document.getElementById('loadMoreLoans');
+    if (loadMoreButton) {
+        loadMoreButton.classList.toggle('hidden', !cursor);
+    }
+}
+
+function renderLoanRow(loan, index) {
+    return `
+        <tr class="mai-table-row border-custom">
+            <td class="px-6 py-4 border-custom text-center">${index + 1}</td>
+            <td class="px-6 py-4 border-custom">${loan.book_name}</td>
+            <td class="px-6 py-4 border-custom">${formatDate(loan.loan_date)}</td>
+            <td class="px-6 py-4 border-custom">${formatDate(loan.loan_due_date)}</td>
+            <td class="px-6 py-4 border-custom">${loan.loan_return_date ? formatDate(loan.loan_return_date) : '-'}</td>
+            <td class="px-6 py-4 border-custom">
+                <span class="mai-status-${getStatusClass(loan.status)}">${loan.status}</span>
+            </td>
+            <td class="px-6 py-4 border-custom text-center">
+                ${!loan.loan_return_date ? `
+                <button onclick="returnBook(${loan.loan_id}, ${loan.book_item_id})" 
+                        class="mai-btn mai-btn-sm bg-green-600 hover:bg-green-700 text-white">
+                    Вернуть
+                </button>
+                ` : '-'}
+            </td>
+        </tr>
+    `;
+}
+
 function openViewLoansModal(loansData) {
     hideContextMenu();
 
@@ -183,27 +258,11 @@ function openViewLoansModal(loansData) {
             </tr>
         `;
     } else {
-        tableBody.innerHTML = loansData.loans.map((loan, index) => `
-            <tr class="mai-table-row border-custom">
-                <td class="px-6 py-4 border-custom text-center">${index + 1}</td>
-                <td class="px-6 py-4 border-custom">${loan.book_name}</td>
-                <td class="px-6 py-4 border-custom">${formatDate(loan.loan_date)}</td>
-                <td class="px-6 py-4 border-custom">${formatDate(loan.loan_due_date)}</td>
-                <td class="px-6 py-4 border-custom">${loan.loan_return_date ? formatDate(loan.loan_return_date) : '-'}</td>
-                <td class="px-6 py-4 border-custom">
-                    <span class="mai-status-${getStatusClass(loan.status)}">${loan.status}</span>
-                </td>
-                <td class="px-6 py-4 border-custom text-center">
-                    ${!loan.loan_return_date ? `
-                    <button onclick="returnBook(${loan.loan_id}, ${loan.book_item_id})" 
-                            class="mai-btn mai-btn-sm bg-green-600 hover:bg-green-700 text-white">
-                        Вернуть
-                    </button>
-                    ` : '-'}
-                </td>
-            </tr>
-        `).join('');
+        tableBody.innerHTML = loansData.loans.map(renderLoanRow).join('');
     }
+
+    loansShown = loansData.loans.length;
+    setLoansNextCursor(loansData.next_cursor);
     
     modal.classList.remove('hidden');
 }
@@ -232,7 +291,7 @@ async function returnBook(loanId, bookItemId) {
         });
 
         if (response.ok) {
-            viewReaderLoans();
+            reloadReaderLoans();
             setTimeout(() => window.location.reload(), 1000);
         } else {
             const error = await response.json();
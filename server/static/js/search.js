@@ -1,14 +1,122 @@
-document.getElementById('searchInput').addEventListener('input', function (event) {
-    const searchTerm = event.target.value.toLowerCase();
-    const listItems = document.querySelectorAll('#book_rows tr');
-
-    listItems.forEach(function (item) {
-        const bookNameCell = item.querySelector('.book-name-cell');
-        const bookName = bookNameCell.textContent.toLowerCase();
-        if (bookName.includes(searchTerm)) {
-            item.style.display = '';
-        } else {
-            item.style.display = 'none';
+// search.js - поиск книг на сервере по мере ввода
+
+const SEARCH_DEBOUNCE_MS = 300;
+const SEARCH_LIMIT = 50;
+
+let searchTimer = null;
+let searchController = null;
+let initialBookRows = null;
+
+function escapeHtml(value) {
+    return String(value)
+        .replace(/&/g, '&amp;')
+        .replace(/</g, '&lt;')
+        .replace(/>/g, '&gt;')
+        .replace(/"/g, '&quot;')
+        .replace(/'/g, '&#39;');
+}
+
+function renderBookStatus(count) {
+    if (count > 10) {
+        return `
+            <div class="flex items-center">
+                <div class="mai-status-dot mai-status-dot-available"></div>
+                <span class="mai-status-available">Доступны (${count}шт.)</span>
+            </div>`;
+    } else if (count > 0) {
+        return `
+            <div class="flex items-center">
+                <div class="mai-status-dot mai-status-dot-warning"></div>
+                <span class="mai-status-warning">Доступны (${count}шт.)</span>
+            </div>`;
+    }
+    return `
+        <div class="flex items-center">
+            <div class="mai-status-dot mai-status-dot-unavailable"></div>
+            <span class="mai-status-unavailable">Нет в наличии</span>
+        </div>`;
+}
+
+function renderBookRows(books) {
+    if (books.length === 0) {
+        return `
+            <tr>
+                <td colspan="7" class="px-6 py-4 text-center text-gray-500">
+                    Ничего не найдено
+                </td>
+            </tr>`;
+    }
+
+    return books.map((book, index) => `
+        <tr class="mai-table-row context-menu-trigger border-custom"
+            data-book-id="${book.id}"
+            data-book-name="${escapeHtml(book.name)}">
+            <td class="px-6 py-4 border-custom text-center">${index + 1}</td>
+            <td class="px-6 py-4 border-custom">${escapeHtml(book.name)}</td>
+            <td class="px-6 py-4 border-custom">${escapeHtml(book.theme)}</td>
+            <td class="px-6 py-4 border-custom">${escapeHtml(book.publisher)}</td>
+            <td class="px-6 py-4 border-custom">${escapeHtml(book.release_date)}</td>
+            <td class="px-6 py-4 border-custom">${escapeHtml(book.isbn)}</td>
+            <td class="px-6 py-4 border-custom">${renderBookStatus(book.available_book_count)}</td>
+        </tr>
+    `).join('');
+}
+
+function setPaginationVisible(visible) {
+    const pagination = document.getElementById('pagination');
+    if (pagination) {
+        pagination.style.display = visible ? '' : 'none';
+    }
+}
+
+async function searchBooks(term) {
+    const tableBody = document.getElementById('book_rows');
+
+    // Пустой запрос - возвращаем страницу, отрисованную сервером
+    if (!term) {
+        tableBody.innerHTML = initialBookRows;
+        setPaginationVisible(true);
+        initContextMenu();
+        return;
+    }
+
+    // Отменяем предыдущий запрос, чтобы устаревший ответ не перезаписал новый
+    if (searchController) {
+        searchController.abort();
+    }
+    searchController = new AbortController();
+
+    try {
+        const params = new URLSearchParams({ q: term, limit: SEARCH_LIMIT });
+        const response = await fetch(`/api/books/search?${params}`, { signal: searchController.signal });
+        if (!response.ok) {
+            throw new Error('Ошибка поиска книг');
         }
+
+        const data = await response.json();
+        tableBody.innerHTML = renderBookRows(data.results);
+        setPaginationVisible(false);
+        initContextMenu();
+    } catch (error) {
+        if (error.name !== 'AbortError') {
+            console.error('Error searching books:', error);
+        }
+    }
+}
+
+document.addEventListener('DOMContentLoaded', function () {
+    const searchInput = document.getElementById('searchInput');
+    const tableBody = document.getElementById('book_rows');
+
+    // Живой поиск есть только в каталоге книг, у читателей остается отправка формы
+    if (!searchInput || !tableBody) return;
+
+    initialBookRows = tableBody.innerHTML;
+
+    searchInput.addEventListener('input', function (event) {
+        const term = event.target.value.trim();
+
+        clearTimeout(searchTimer);
+        searchTimer = setTimeout(() => searchBooks(term), SEARCH_DEBOUNCE_MS);
     });
-});
\ No newline at end of file
+});
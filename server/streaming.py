@@ -0,0 +1,40 @@
+from fastapi.responses import StreamingResponse
+
+
+# Мелкие фрагменты вывода шаблона собираются в куски такого размера:
+# GZipMiddleware сбрасывает сжатие после каждого куска, и слишком мелкие
+# куски сжимаются плохо
+STREAM_CHUNK_SIZE = 8192
+
+
+def streaming_environment(templates):
+    """Асинхронная копия окружения Jinja2Templates (те же загрузчик, фильтры и
+    глобальные имена): в шаблоне можно перебирать async-итераторы."""
+    return templates.env.overlay(enable_async=True)
+
+
+async def render_chunks(template, context, error_html):
+    buffered = []
+    size = 0
+    try:
+        async for part in template.generate_async(context):
+            buffered.append(part)
+            size += len(part)
+            if size >= STREAM_CHUNK_SIZE:
+                yield "".join(buffered)
+                buffered, size = [], 0
+        yield "".join(buffered)
+
+    except Exception as e:
+        # Заголовки уже отправлены - ошибку можно только дописать в страницу
+        print(e)
+        yield "".join(buffered) + error_html
+
+
+def stream_template(env, name, context, error_html="<h1>Server Error</h1>"):
+    """
+    Потоковый ответ с шаблоном: начало страницы и первые строки уходят
+    клиенту, пока остальные строки еще читаются из базы.
+    """
+    template = env.get_template(name)
+    return StreamingResponse(render_chunks(template, context, error_html), media_type="text/html; charset=utf-8")
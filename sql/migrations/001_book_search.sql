@@ -0,0 +1,18 @@
+-- migrate: no-transaction
+-- Индексы для поиска книг по названию (триграммы и полнотекстовый поиск).
+-- Строятся CONCURRENTLY, чтобы не блокировать запись в книги на время
+-- построения, поэтому миграция выполняется вне транзакции.
+
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+
+-- Подстрочный поиск: book_name ILIKE '%...%' и word_similarity
+CREATE INDEX CONCURRENTLY IF NOT EXISTS books_name_trgm_idx
+	ON books USING gin (book_name gin_trgm_ops);
+
+-- Полнотекстовый поиск по словам названия с учетом морфологии
+CREATE INDEX CONCURRENTLY IF NOT EXISTS books_name_fts_idx
+	ON books USING gin (to_tsvector('russian', book_name));
+
+
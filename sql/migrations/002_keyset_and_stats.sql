@@ -0,0 +1,224 @@
+-- Объекты, добавленные в scheme.sql после первой версии схемы: счетчики
+-- главной страницы и выдача через SKIP LOCKED. Индексы для постраничного
+-- вывода строятся без блокировки записи в 003_hot_path_indexes.sql.
+-- Повторный запуск безопасен.
+
+
+-- Счетчики для главной страницы (одна строка, поддерживается триггерами)
+CREATE TABLE IF NOT EXISTS library_stats (
+	stats_id smallint PRIMARY KEY DEFAULT 1 CHECK (stats_id = 1),
+	total_books bigint NOT NULL DEFAULT 0,
+	total_available bigint NOT NULL DEFAULT 0,
+	total_readers bigint NOT NULL DEFAULT 0,
+	active_loans bigint NOT NULL DEFAULT 0
+);
+
+
+-- Пересчет счетчиков с нуля (после массовой загрузки или TRUNCATE)
+CREATE OR replace FUNCTION reconcile_library_stats() RETURNS void AS $$
+BEGIN
+
+	INSERT INTO library_stats (stats_id, total_books, total_available, total_readers, active_loans)
+	SELECT
+		1,
+		(SELECT count(*) FROM books),
+		(SELECT count(*) FROM book_items WHERE book_state = 'Доступна'),
+		(SELECT count(*) FROM readers),
+		(SELECT count(*) FROM book_loans WHERE loan_return_date IS NULL)
+	ON conflict (stats_id) do UPDATE SET
+		total_books = excluded.total_books,
+		total_available = excluded.total_available,
+		total_readers = excluded.total_readers,
+		active_loans = excluded.active_loans;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Триггеры уровня оператора: одна запись в library_stats на весь INSERT/UPDATE/DELETE,
+-- строка счетчиков не блокируется, если изменение не влияет на счетчик
+CREATE OR replace FUNCTION library_stats_books() RETURNS trigger AS $$
+DECLARE
+	v_delta bigint;
+BEGIN
+
+	IF TG_OP = 'INSERT' THEN
+		SELECT count(*) INTO v_delta FROM new_rows;
+	ELSE
+		SELECT -count(*) INTO v_delta FROM old_rows;
+	END IF;
+
+	IF v_delta <> 0 THEN
+		UPDATE library_stats SET total_books = total_books + v_delta WHERE stats_id = 1;
+	END IF;
+
+	RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+CREATE OR replace FUNCTION library_stats_readers() RETURNS trigger AS $$
+DECLARE
+	v_delta bigint;
+BEGIN
+
+	IF TG_OP = 'INSERT' THEN
+		SELECT count(*) INTO v_delta FROM new_rows;
+	ELSE
+		SELECT -count(*) INTO v_delta FROM old_rows;
+	END IF;
+
+	IF v_delta <> 0 THEN
+		UPDATE library_stats SET total_readers = total_readers + v_delta WHERE stats_id = 1;
+	END IF;
+
+	RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+CREATE OR replace FUNCTION library_stats_book_items() RETURNS trigger AS $$
+DECLARE
+	v_delta bigint := 0;
+BEGIN
+
+	IF TG_OP IN ('INSERT', 'UPDATE') THEN
+		v_delta := v_delta + (SELECT count(*) FROM new_rows WHERE book_state = 'Доступна');
+	END IF;
+
+	IF TG_OP IN ('DELETE', 'UPDATE') THEN
+		v_delta := v_delta - (SELECT count(*) FROM old_rows WHERE book_state = 'Доступна');
+	END IF;
+
+	IF v_delta <> 0 THEN
+		UPDATE library_stats SET total_available = total_available + v_delta WHERE stats_id = 1;
+	END IF;
+
+	RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+CREATE OR replace FUNCTION library_stats_book_loans() RETURNS trigger AS $$
+DECLARE
+	v_delta bigint := 0;
+BEGIN
+
+	IF TG_OP IN ('INSERT', 'UPDATE') THEN
+		v_delta := v_delta + (SELECT count(*) FROM new_rows WHERE loan_return_date IS NULL);
+	END IF;
+
+	IF TG_OP IN ('DELETE', 'UPDATE') THEN
+		v_delta := v_delta - (SELECT count(*) FROM old_rows WHERE loan_return_date IS NULL);
+	END IF;
+
+	IF v_delta <> 0 THEN
+		UPDATE library_stats SET active_loans = active_loans + v_delta WHERE stats_id = 1;
+	END IF;
+
+	RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+DROP TRIGGER IF EXISTS books_stats_insert ON books;
+DROP TRIGGER IF EXISTS books_stats_delete ON books;
+DROP TRIGGER IF EXISTS readers_stats_insert ON readers;
+DROP TRIGGER IF EXISTS readers_stats_delete ON readers;
+DROP TRIGGER IF EXISTS book_items_stats_insert ON book_items;
+DROP TRIGGER IF EXISTS book_items_stats_update ON book_items;
+DROP TRIGGER IF EXISTS book_items_stats_delete ON book_items;
+DROP TRIGGER IF EXISTS book_loans_stats_insert ON book_loans;
+DROP TRIGGER IF EXISTS book_loans_stats_update ON book_loans;
+DROP TRIGGER IF EXISTS book_loans_stats_delete ON book_loans;
+
+CREATE TRIGGER books_stats_insert AFTER INSERT ON books
+	REFERENCING NEW TABLE AS new_rows
+	FOR EACH STATEMENT EXECUTE FUNCTION library_stats_books();
+CREATE TRIGGER books_stats_delete AFTER DELETE ON books
+	REFERENCING OLD TABLE AS old_rows
+	FOR EACH STATEMENT EXECUTE FUNCTION library_stats_books();
+
+CREATE TRIGGER readers_stats_insert AFTER INSERT ON readers
+	REFERENCING NEW TABLE AS new_rows
+	FOR EACH STATEMENT EXECUTE FUNCTION library_stats_readers();
+CREATE TRIGGER readers_stats_delete AFTER DELETE ON readers
+	REFERENCING OLD TABLE AS old_rows
+	FOR EACH STATEMENT EXECUTE FUNCTION library_stats_readers();
+
+CREATE TRIGGER book_items_stats_insert AFTER INSERT ON book_items
+	REFERENCING NEW TABLE AS new_rows
+	FOR EACH STATEMENT EXECUTE FUNCTION library_stats_book_items();
+CREATE TRIGGER book_items_stats_update AFTER UPDATE ON book_items
+	REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+	FOR EACH STATEMENT EXECUTE FUNCTION library_stats_book_items();
+CREATE TRIGGER book_items_stats_delete AFTER DELETE ON book_items
+	REFERENCING OLD TABLE AS old_rows
+	FOR EACH STATEMENT EXECUTE FUNCTION library_stats_book_items();
+
+CREATE TRIGGER book_loans_stats_insert AFTER INSERT ON book_loans
+	REFERENCING NEW TABLE AS new_rows
+	FOR EACH STATEMENT EXECUTE FUNCTION library_stats_book_loans();
+CREATE TRIGGER book_loans_stats_update AFTER UPDATE ON book_loans
+	REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+	FOR EACH STATEMENT EXECUTE FUNCTION library_stats_book_loans();
+CREATE TRIGGER book_loans_stats_delete AFTER DELETE ON book_loans
+	REFERENCING OLD TABLE AS old_rows
+	FOR EACH STATEMENT EXECUTE FUNCTION library_stats_book_loans();
+
+
+-- Счетчики заполняются по текущим данным
+SELECT reconcile_library_stats();
+
+
+create or replace function loan_book(
+	p_READER_FIO text,
+	p_BOOK_TO_LOAN text,
+	p_LOAN_DATE date,
+	p_LOAN_DUE_DATE date
+) returns void as $$
+DECLARE 
+	v_book_id int;
+	v_book_item_id int;
+	v_reader_id int;	
+BEGIN
+
+	SELECT reader_id INTO v_reader_id FROM readers WHERE FIO = p_READER_FIO;
+	IF NOT FOUND THEN 
+		raise EXCEPTION 'Читатель "%" не найден!', p_READER_FIO;
+	END IF;
+	
+	
+	SELECT book_id INTO v_book_id FROM books WHERE book_name = p_BOOK_TO_LOAN;
+	IF NOT FOUND THEN
+		raise EXCEPTION 'Книги "%" в библиотеке нет!', p_BOOK_TO_LOAN;
+	END IF;
+	
+	
+	-- SKIP LOCKED: параллельные выдачи берут разные экземпляры, а не ждут один;
+	-- блокируется только экземпляр, строка книги остается свободной
+	SELECT book_item_id INTO v_book_item_id 
+	FROM book_items 
+	JOIN books
+	ON book_items.book_id = books.book_id
+	WHERE book_items.book_state = 'Доступна'
+	AND books.book_name = p_BOOK_TO_LOAN
+	LIMIT 1
+	FOR UPDATE OF book_items SKIP LOCKED;
+	
+	
+	IF NOT FOUND THEN
+		raise EXCEPTION 'Все экземлпяры книги "%" разданы!', p_BOOK_TO_LOAN;
+	ELSE 
+		INSERT INTO book_loans (loan_date, loan_due_date, book_item_id, reader_id)
+		SELECT p_LOAN_DATE, p_LOAN_DUE_DATE, v_book_item_id, v_reader_id;
+	
+	
+		UPDATE book_items SET book_state = 'Займ'
+		WHERE book_item_id = v_book_item_id;
+
+		
+	END IF;
+	
+	
+END;
+$$ language plpgsql;
@@ -0,0 +1,40 @@
+-- migrate: no-transaction
+-- Индексы под запросы приложения. Строятся CONCURRENTLY, чтобы не блокировать
+-- запись в рабочей базе, поэтому миграция выполняется вне транзакции.
+-- Проверка планов: python scripts/explain_check.py --generate
+
+
+-- Постраничный вывод по ключу сортировки: каталог книг, список читателей,
+-- история займов читателя
+CREATE INDEX CONCURRENTLY IF NOT EXISTS books_name_id_idx
+	ON books (book_name, book_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS readers_fio_id_idx
+	ON readers (FIO, reader_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS book_loans_reader_date_idx
+	ON book_loans (reader_id, loan_date, loan_id);
+
+-- Экземпляры книги: карточка книги, удаление книги, внешний ключ
+CREATE INDEX CONCURRENTLY IF NOT EXISTS book_items_book_id_idx
+	ON book_items (book_id);
+
+-- Свободные экземпляры: выдача (SKIP LOCKED) и количество доступных в каталоге
+CREATE INDEX CONCURRENTLY IF NOT EXISTS book_items_available_idx
+	ON book_items (book_id) WHERE book_state = 'Доступна';
+
+-- Займы экземпляра: соединение займов с экземплярами, внешний ключ
+CREATE INDEX CONCURRENTLY IF NOT EXISTS book_loans_book_item_id_idx
+	ON book_loans (book_item_id);
+
+-- Открытые займы экземпляра: проверка активных займов при удалении книги
+CREATE INDEX CONCURRENTLY IF NOT EXISTS book_loans_active_item_idx
+	ON book_loans (book_item_id) WHERE loan_return_date IS NULL;
+
+-- Открытые займы читателя: список читателей и удаление читателя
+CREATE INDEX CONCURRENTLY IF NOT EXISTS book_loans_active_reader_idx
+	ON book_loans (reader_id) WHERE loan_return_date IS NULL;
+
+-- Авторы книги: первичный ключ (author_id, book_id) не подходит для поиска по книге
+CREATE INDEX CONCURRENTLY IF NOT EXISTS author_book_book_id_idx
+	ON author_book (book_id);
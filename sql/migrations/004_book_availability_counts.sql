@@ -0,0 +1,121 @@
+-- Количество экземпляров книги (всего и доступных) хранится в самой книге и
+-- поддерживается триггерами на book_items: каталог не считает экземпляры,
+-- а выдача сразу видит, что свободных экземпляров нет.
+
+
+-- Столбец с постоянным значением по умолчанию добавляется без перезаписи таблицы
+ALTER TABLE books ADD COLUMN IF NOT EXISTS total_count int NOT NULL DEFAULT 0;
+ALTER TABLE books ADD COLUMN IF NOT EXISTS available_count int NOT NULL DEFAULT 0;
+
+
+-- Триггер уровня оператора: изменения по всем строкам оператора сводятся
+-- в одно приращение на книгу
+CREATE OR replace FUNCTION book_counts_book_items() RETURNS trigger AS $$
+DECLARE
+	v_book_ids int[];
+	v_total int[];
+	v_available int[];
+BEGIN
+
+	IF TG_OP = 'INSERT' THEN
+		SELECT array_agg(book_id ORDER BY book_id),
+			array_agg(total ORDER BY book_id),
+			array_agg(available ORDER BY book_id)
+		INTO v_book_ids, v_total, v_available
+		FROM (
+			SELECT book_id, count(*) AS total, count(*) FILTER (WHERE book_state = 'Доступна') AS available
+			FROM new_rows WHERE book_id IS NOT NULL GROUP BY book_id
+		) AS deltas;
+
+	ELSIF TG_OP = 'DELETE' THEN
+		SELECT array_agg(book_id ORDER BY book_id),
+			array_agg(total ORDER BY book_id),
+			array_agg(available ORDER BY book_id)
+		INTO v_book_ids, v_total, v_available
+		FROM (
+			SELECT book_id, -count(*) AS total, -count(*) FILTER (WHERE book_state = 'Доступна') AS available
+			FROM old_rows WHERE book_id IS NOT NULL GROUP BY book_id
+		) AS deltas;
+
+	ELSE
+		SELECT array_agg(book_id ORDER BY book_id),
+			array_agg(total ORDER BY book_id),
+			array_agg(available ORDER BY book_id)
+		INTO v_book_ids, v_total, v_available
+		FROM (
+			SELECT book_id, sum(total) AS total, sum(available) AS available
+			FROM (
+				SELECT book_id, 1 AS total, (book_state = 'Доступна')::int AS available FROM new_rows
+				UNION ALL
+				SELECT book_id, -1, -(book_state = 'Доступна')::int FROM old_rows
+			) AS changes
+			WHERE book_id IS NOT NULL
+			GROUP BY book_id
+			HAVING sum(total) <> 0 OR sum(available) <> 0
+		) AS deltas;
+	END IF;
+
+	IF v_book_ids IS NULL THEN
+		RETURN NULL;
+	END IF;
+
+	-- Строки книг блокируются по возрастанию id, чтобы пакетные выдачи
+	-- с пересекающимися книгами не приводили к взаимной блокировке
+	PERFORM 1 FROM books WHERE book_id = ANY(v_book_ids) ORDER BY book_id FOR NO KEY UPDATE;
+
+	UPDATE books SET
+		total_count = total_count + deltas.total,
+		available_count = available_count + deltas.available
+	FROM unnest(v_book_ids, v_total, v_available) AS deltas(book_id, total, available)
+	WHERE books.book_id = deltas.book_id;
+
+	RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+DROP TRIGGER IF EXISTS book_items_counts_insert ON book_items;
+DROP TRIGGER IF EXISTS book_items_counts_update ON book_items;
+DROP TRIGGER IF EXISTS book_items_counts_delete ON book_items;
+
+CREATE TRIGGER book_items_counts_insert AFTER INSERT ON book_items
+	REFERENCING NEW TABLE AS new_rows
+	FOR EACH STATEMENT EXECUTE FUNCTION book_counts_book_items();
+CREATE TRIGGER book_items_counts_update AFTER UPDATE ON book_items
+	REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+	FOR EACH STATEMENT EXECUTE FUNCTION book_counts_book_items();
+CREATE TRIGGER book_items_counts_delete AFTER DELETE ON book_items
+	REFERENCING OLD TABLE AS old_rows
+	FOR EACH STATEMENT EXECUTE FUNCTION book_counts_book_items();
+
+
+-- Пересчет количества экземпляров по book_items (для всех книг или одной);
+-- возвращает число исправленных книг
+CREATE OR replace FUNCTION reconcile_book_counts(p_book_id int DEFAULT NULL) RETURNS int AS $$
+DECLARE
+	v_fixed int;
+BEGIN
+
+	UPDATE books SET
+		total_count = actual.total,
+		available_count = actual.available
+	FROM (
+		SELECT b.book_id,
+			count(i.book_item_id) AS total,
+			count(i.book_item_id) FILTER (WHERE i.book_state = 'Доступна') AS available
+		FROM books AS b
+		LEFT JOIN book_items AS i ON i.book_id = b.book_id
+		WHERE p_book_id IS NULL OR b.book_id = p_book_id
+		GROUP BY b.book_id
+	) AS actual
+	WHERE books.book_id = actual.book_id
+	AND (books.total_count <> actual.total OR books.available_count <> actual.available);
+
+	GET DIAGNOSTICS v_fixed = ROW_COUNT;
+	RETURN v_fixed;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Заполнение для существующих книг
+SELECT reconcile_book_counts();
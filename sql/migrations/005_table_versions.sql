@@ -0,0 +1,46 @@
+-- Версии таблиц для условных GET-запросов: каждая запись в таблицу каталога
+-- увеличивает ее версию, ETag страницы строится из версий таблиц, которые она
+-- читает. Версия меняется в той же транзакции, что и данные, поэтому новую
+-- версию видно только вместе с новыми данными.
+
+
+CREATE TABLE IF NOT EXISTS table_versions (
+	table_name text PRIMARY KEY,
+	version bigint NOT NULL DEFAULT 0
+);
+
+INSERT INTO table_versions (table_name)
+VALUES ('publishers'), ('themes'), ('authors'), ('books'), ('author_book'),
+	('readers'), ('book_items'), ('book_loans'), ('library_stats')
+ON conflict (table_name) do NOTHING;
+
+
+-- Триггер BEFORE STATEMENT: версии блокируются до первой измененной строки
+-- оператора и до триггеров AFTER (счетчики library_stats и books), а все
+-- строки версий - в одном порядке. Транзакции, пишущие в разные таблицы
+-- в разном порядке, ждут друг друга, но не блокируются взаимно.
+CREATE OR replace FUNCTION bump_table_version() RETURNS trigger AS $$
+BEGIN
+
+	PERFORM 1 FROM table_versions ORDER BY table_name FOR UPDATE;
+	UPDATE table_versions SET version = version + 1 WHERE table_name = TG_TABLE_NAME;
+
+	RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+DO $$
+DECLARE
+	v_table text;
+BEGIN
+	FOR v_table IN SELECT table_name FROM table_versions LOOP
+		EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I', v_table || '_version', v_table);
+		EXECUTE format(
+			'CREATE TRIGGER %I BEFORE INSERT OR UPDATE OR DELETE OR TRUNCATE ON %I '
+			'FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version()',
+			v_table || '_version', v_table
+		);
+	END LOOP;
+END;
+$$;
@@ -0,0 +1,36 @@
+-- migrate: no-transaction
+-- Отчет о просроченных займах: материализованное представление обновляется
+-- приложением в фоне (REFRESH ... CONCURRENTLY, см. server/overdue.py), отчет
+-- читается по индексам представления, а не полным просмотром book_loans.
+
+
+-- Открытые займы по сроку возврата: построение и обновление представления
+CREATE INDEX CONCURRENTLY IF NOT EXISTS book_loans_active_due_idx
+	ON book_loans (loan_due_date) WHERE loan_return_date IS NULL;
+
+-- Займ попадает в представление, когда срок возврата прошел; дни просрочки
+-- считаются при чтении отчета, возвращенные после обновления займы
+-- отсеиваются по book_loans
+CREATE MATERIALIZED VIEW IF NOT EXISTS overdue_loans AS
+SELECT
+	l.loan_id,
+	l.loan_date,
+	l.loan_due_date,
+	l.book_item_id,
+	i.book_id,
+	b.book_name,
+	l.reader_id,
+	r.fio,
+	now() AS refreshed_at
+FROM book_loans AS l
+JOIN book_items AS i ON i.book_item_id = l.book_item_id
+JOIN books AS b ON b.book_id = i.book_id
+JOIN readers AS r ON r.reader_id = l.reader_id
+WHERE l.loan_return_date IS NULL AND l.loan_due_date < current_date;
+
+-- Уникальный индекс обязателен для REFRESH MATERIALIZED VIEW CONCURRENTLY
+CREATE UNIQUE INDEX IF NOT EXISTS overdue_loans_loan_id_idx ON overdue_loans (loan_id);
+
+-- Сортировки отчета: по дням просрочки и по читателю
+CREATE INDEX IF NOT EXISTS overdue_loans_due_idx ON overdue_loans (loan_due_date, loan_id);
+CREATE INDEX IF NOT EXISTS overdue_loans_reader_idx ON overdue_loans (fio, reader_id, loan_due_date, loan_id);
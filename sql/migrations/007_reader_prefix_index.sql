@@ -0,0 +1,8 @@
+-- migrate: no-transaction
+-- Подсказки ФИО читателя при выдаче книги: поиск по началу ФИО без учета
+-- регистра. text_pattern_ops сравнивает строки побайтно, поэтому индекс
+-- подходит для условия-диапазона по префиксу при любой локали базы.
+
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS readers_fio_lower_prefix_idx
+	ON readers (lower(fio) text_pattern_ops);
@@ -0,0 +1,22 @@
+-- migrate: no-transaction
+-- Фасетный просмотр каталога: фильтры по теме, издателю и годам выпуска
+-- (по автору - первичный ключ author_book). Индексы по теме и издателю
+-- продолжаются ключом сортировки каталога, поэтому страница отфильтрованного
+-- каталога читается по индексу без сортировки.
+
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS books_theme_name_idx
+	ON books (theme_id, book_name, book_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS books_publisher_name_idx
+	ON books (publisher_id, book_name, book_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS books_release_date_idx
+	ON books (release_date);
+
+-- Авторы отобранных книг (фасет "Автор") и карточка книги: индекс с author_id
+-- читается без обращения к таблице и заменяет индекс только по book_id
+CREATE INDEX CONCURRENTLY IF NOT EXISTS author_book_book_author_idx
+	ON author_book (book_id, author_id);
+
+DROP INDEX CONCURRENTLY IF EXISTS author_book_book_id_idx;
@@ -0,0 +1,129 @@
+-- Секционирование истории займов. Открытые займы лежат в отдельной небольшой
+-- секции book_loans_open: условие loan_return_date IS NULL отсекает остальные
+-- секции, и запросы активных займов не читают историю. Закрытые займы
+-- разложены по годам loan_date (book_loans_closed_ГГГГ); при возврате книги
+-- строка сама переходит из book_loans_open в секцию года выдачи. Старые
+-- годовые секции выгружаются в архив и удаляются приложением
+-- (server/loan_archive.py).
+--
+-- Ключ верхнего уровня - выражение, поэтому у book_loans нет первичного
+-- ключа: уникальность loan_id обеспечивает последовательность, для поиска
+-- по id есть индекс book_loans_loan_id_idx во всех секциях.
+
+
+-- Отчет о просрочках ссылается на таблицу и пересоздается после нее
+DROP MATERIALIZED VIEW IF EXISTS overdue_loans;
+
+ALTER TABLE book_loans RENAME TO book_loans_unpartitioned;
+ALTER SEQUENCE book_loans_loan_id_seq OWNED BY NONE;
+
+CREATE TABLE book_loans (
+	loan_id int NOT NULL DEFAULT nextval('book_loans_loan_id_seq'),
+	loan_date date NOT NULL,
+	loan_due_date date,
+	loan_return_date date default null,
+
+	book_item_id int REFERENCES book_items(book_item_id),
+	reader_id int REFERENCES readers(reader_id)
+) PARTITION BY LIST ((loan_return_date IS NULL));
+
+ALTER SEQUENCE book_loans_loan_id_seq OWNED BY book_loans.loan_id;
+
+CREATE TABLE book_loans_open PARTITION OF book_loans FOR VALUES IN (true);
+CREATE TABLE book_loans_closed PARTITION OF book_loans FOR VALUES IN (false)
+	PARTITION BY RANGE (loan_date);
+-- Займы года, для которого секции еще нет; обычно пуста
+CREATE TABLE book_loans_closed_default PARTITION OF book_loans_closed DEFAULT;
+
+
+-- Секция закрытых займов года. Займы этого года из секции по умолчанию
+-- переносятся в новую секцию. Возвращает имя созданной секции или NULL,
+-- если она уже есть.
+CREATE OR replace FUNCTION create_book_loans_partition(p_year int) RETURNS text AS $$
+DECLARE
+	v_name text := 'book_loans_closed_' || p_year;
+	v_from date := make_date(p_year, 1, 1);
+	v_to date := make_date(p_year + 1, 1, 1);
+BEGIN
+
+	IF to_regclass(v_name) IS NOT NULL THEN
+		RETURN NULL;
+	END IF;
+
+	EXECUTE format('CREATE TABLE %I (LIKE book_loans_closed INCLUDING DEFAULTS)', v_name);
+	EXECUTE format(
+		'WITH moved AS (DELETE FROM book_loans_closed_default WHERE loan_date >= %L AND loan_date < %L RETURNING *) '
+		'INSERT INTO %I SELECT * FROM moved',
+		v_from, v_to, v_name
+	);
+	EXECUTE format(
+		'ALTER TABLE book_loans_closed ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+		v_name, v_from, v_to
+	);
+
+	RETURN v_name;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Секции с года первого займа по следующий год
+SELECT create_book_loans_partition(y::int)
+FROM generate_series(
+	coalesce((SELECT extract(year FROM min(loan_date)) FROM book_loans_unpartitioned), extract(year FROM current_date)),
+	extract(year FROM current_date) + 1
+) AS y;
+
+-- Перенос данных до создания триггеров: счетчики library_stats не меняются
+INSERT INTO book_loans (loan_id, loan_date, loan_due_date, loan_return_date, book_item_id, reader_id)
+SELECT loan_id, loan_date, loan_due_date, loan_return_date, book_item_id, reader_id
+FROM book_loans_unpartitioned;
+
+DROP TABLE book_loans_unpartitioned;
+
+
+-- Индексы создаются во всех секциях. Частичные индексы открытых займов
+-- (миграции 003, 006) заменены индексами секции book_loans_open.
+CREATE INDEX book_loans_loan_id_idx ON book_loans (loan_id);
+CREATE INDEX book_loans_reader_date_idx ON book_loans (reader_id, loan_date, loan_id);
+CREATE INDEX book_loans_book_item_id_idx ON book_loans (book_item_id);
+-- Отчет о просрочках: открытые займы по сроку возврата
+CREATE INDEX book_loans_open_due_idx ON book_loans_open (loan_due_date);
+
+
+CREATE TRIGGER book_loans_stats_insert AFTER INSERT ON book_loans
+	REFERENCING NEW TABLE AS new_rows
+	FOR EACH STATEMENT EXECUTE FUNCTION library_stats_book_loans();
+CREATE TRIGGER book_loans_stats_update AFTER UPDATE ON book_loans
+	REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+	FOR EACH STATEMENT EXECUTE FUNCTION library_stats_book_loans();
+CREATE TRIGGER book_loans_stats_delete AFTER DELETE ON book_loans
+	REFERENCING OLD TABLE AS old_rows
+	FOR EACH STATEMENT EXECUTE FUNCTION library_stats_book_loans();
+
+CREATE TRIGGER book_loans_version BEFORE INSERT OR UPDATE OR DELETE OR TRUNCATE ON book_loans
+	FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+
+UPDATE table_versions SET version = version + 1 WHERE table_name = 'book_loans';
+
+
+-- Отчет о просрочках (как в миграции 006)
+CREATE MATERIALIZED VIEW overdue_loans AS
+SELECT
+	l.loan_id,
+	l.loan_date,
+	l.loan_due_date,
+	l.book_item_id,
+	i.book_id,
+	b.book_name,
+	l.reader_id,
+	r.fio,
+	now() AS refreshed_at
+FROM book_loans AS l
+JOIN book_items AS i ON i.book_item_id = l.book_item_id
+JOIN books AS b ON b.book_id = i.book_id
+JOIN readers AS r ON r.reader_id = l.reader_id
+WHERE l.loan_return_date IS NULL AND l.loan_due_date < current_date;
+
+CREATE UNIQUE INDEX overdue_loans_loan_id_idx ON overdue_loans (loan_id);
+CREATE INDEX overdue_loans_due_idx ON overdue_loans (loan_due_date, loan_id);
+CREATE INDEX overdue_loans_reader_idx ON overdue_loans (fio, reader_id, loan_due_date, loan_id);
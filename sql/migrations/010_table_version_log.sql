@@ -0,0 +1,62 @@
+-- Версии таблиц без блокировок. Раньше триггер изменял строку table_versions
+-- (и блокировал все строки версий) до конца транзакции, и пишущие транзакции
+-- выстраивались в одну очередь, даже если писали в разные таблицы. Теперь
+-- триггер только добавляет строку в журнал table_version_log - одну на
+-- транзакцию и таблицу, ключ у каждой транзакции свой, поэтому вставка
+-- никого не ждет.
+--
+-- Текущая версия таблицы - table_versions.version плюс число ее строк журнала
+-- (представление current_table_versions). Строка журнала видна вместе с
+-- данными своей транзакции, поэтому новую версию, как и раньше, видно только
+-- вместе с новыми данными. Приложение периодически переносит журнал в
+-- table_versions (fold_table_versions); перенос - одна транзакция, текущая
+-- версия при нем не меняется.
+
+
+CREATE TABLE IF NOT EXISTS table_version_log (
+	table_name text NOT NULL,
+	xact_id xid8 NOT NULL DEFAULT pg_current_xact_id(),
+	PRIMARY KEY (table_name, xact_id)
+);
+
+
+CREATE OR replace FUNCTION bump_table_version() RETURNS trigger AS $$
+BEGIN
+
+	-- Повторные операторы той же транзакции попадают в ту же строку
+	INSERT INTO table_version_log (table_name) VALUES (TG_TABLE_NAME)
+	ON conflict do NOTHING;
+
+	RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+CREATE OR replace VIEW current_table_versions AS
+SELECT
+	v.table_name,
+	v.version + (SELECT count(*) FROM table_version_log AS l WHERE l.table_name = v.table_name) AS version
+FROM table_versions AS v;
+
+
+-- Перенос журнала в table_versions. Строки незавершенных транзакций не видны
+-- и остаются в журнале до следующего переноса. Возвращает число таблиц,
+-- версии которых перенесены.
+CREATE OR replace FUNCTION fold_table_versions() RETURNS bigint AS $$
+DECLARE
+	v_count bigint;
+BEGIN
+
+	WITH moved AS (
+		DELETE FROM table_version_log RETURNING table_name
+	), counts AS (
+		SELECT table_name, count(*) AS changes FROM moved GROUP BY table_name
+	)
+	UPDATE table_versions AS v SET version = v.version + counts.changes
+	FROM counts
+	WHERE v.table_name = counts.table_name;
+
+	GET DIAGNOSTICS v_count = ROW_COUNT;
+	RETURN v_count;
+END;
+$$ LANGUAGE plpgsql;
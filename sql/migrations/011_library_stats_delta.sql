@@ -0,0 +1,193 @@
+-- Счетчики главной страницы без общей строки. Раньше каждая выдача и возврат
+-- изменяли строку library_stats и держали ее блокировку до конца транзакции,
+-- так что все выдачи выстраивались в очередь на одной строке. Теперь триггеры
+-- добавляют приращения в журнал library_stats_delta (вставка никого не ждет),
+-- а приложение периодически переносит их в library_stats (fold_library_stats).
+-- Текущие значения - строка library_stats плюс сумма журнала
+-- (представление current_library_stats).
+
+
+CREATE TABLE IF NOT EXISTS library_stats_delta (
+	total_books bigint NOT NULL DEFAULT 0,
+	total_available bigint NOT NULL DEFAULT 0,
+	total_readers bigint NOT NULL DEFAULT 0,
+	active_loans bigint NOT NULL DEFAULT 0
+);
+
+-- Журнал входит в версию счетчиков: ETag главной страницы меняется сразу
+-- после записи, а не после переноса
+INSERT INTO table_versions (table_name) VALUES ('library_stats_delta')
+ON conflict (table_name) do NOTHING;
+
+DROP TRIGGER IF EXISTS library_stats_delta_version ON library_stats_delta;
+CREATE TRIGGER library_stats_delta_version BEFORE INSERT OR UPDATE OR DELETE OR TRUNCATE ON library_stats_delta
+	FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+
+
+CREATE OR replace VIEW current_library_stats AS
+SELECT
+	s.stats_id,
+	s.total_books + d.total_books AS total_books,
+	s.total_available + d.total_available AS total_available,
+	s.total_readers + d.total_readers AS total_readers,
+	s.active_loans + d.active_loans AS active_loans
+FROM library_stats AS s
+CROSS JOIN (
+	SELECT
+		coalesce(sum(total_books), 0)::bigint AS total_books,
+		coalesce(sum(total_available), 0)::bigint AS total_available,
+		coalesce(sum(total_readers), 0)::bigint AS total_readers,
+		coalesce(sum(active_loans), 0)::bigint AS active_loans
+	FROM library_stats_delta
+) AS d;
+
+
+-- Перенос журнала в строку счетчиков. Приращения незавершенных транзакций
+-- не видны и остаются в журнале до следующего переноса. Возвращает число
+-- перенесенных строк журнала.
+CREATE OR replace FUNCTION fold_library_stats() RETURNS bigint AS $$
+DECLARE
+	v_count bigint;
+BEGIN
+
+	-- Пустой журнал не трогаем: триггеры версий library_stats и журнала
+	-- сработали бы и без измененных строк, и ETag главной страницы менялся
+	-- бы при каждом переносе
+	IF NOT EXISTS (SELECT 1 FROM library_stats_delta) THEN
+		RETURN 0;
+	END IF;
+
+	WITH moved AS (
+		DELETE FROM library_stats_delta RETURNING *
+	), totals AS (
+		SELECT
+			count(*) AS changes,
+			coalesce(sum(total_books), 0) AS total_books,
+			coalesce(sum(total_available), 0) AS total_available,
+			coalesce(sum(total_readers), 0) AS total_readers,
+			coalesce(sum(active_loans), 0) AS active_loans
+		FROM moved
+	)
+	UPDATE library_stats AS s SET
+		total_books = s.total_books + totals.total_books,
+		total_available = s.total_available + totals.total_available,
+		total_readers = s.total_readers + totals.total_readers,
+		active_loans = s.active_loans + totals.active_loans
+	FROM totals
+	WHERE s.stats_id = 1 AND totals.changes > 0
+	RETURNING totals.changes INTO v_count;
+
+	RETURN coalesce(v_count, 0);
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Пересчет с нуля заменяет и строку, и журнал: видимые приращения уже
+-- учтены в подсчете
+CREATE OR replace FUNCTION reconcile_library_stats() RETURNS void AS $$
+BEGIN
+
+	DELETE FROM library_stats_delta;
+
+	INSERT INTO library_stats (stats_id, total_books, total_available, total_readers, active_loans)
+	SELECT
+		1,
+		(SELECT count(*) FROM books),
+		(SELECT count(*) FROM book_items WHERE book_state = 'Доступна'),
+		(SELECT count(*) FROM readers),
+		(SELECT count(*) FROM book_loans WHERE loan_return_date IS NULL)
+	ON conflict (stats_id) do UPDATE SET
+		total_books = excluded.total_books,
+		total_available = excluded.total_available,
+		total_readers = excluded.total_readers,
+		active_loans = excluded.active_loans;
+END;
+$$ LANGUAGE plpgsql;
+
+
+CREATE OR replace FUNCTION library_stats_books() RETURNS trigger AS $$
+DECLARE
+	v_delta bigint;
+BEGIN
+
+	IF TG_OP = 'INSERT' THEN
+		SELECT count(*) INTO v_delta FROM new_rows;
+	ELSE
+		SELECT -count(*) INTO v_delta FROM old_rows;
+	END IF;
+
+	IF v_delta <> 0 THEN
+		INSERT INTO library_stats_delta (total_books) VALUES (v_delta);
+	END IF;
+
+	RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+CREATE OR replace FUNCTION library_stats_readers() RETURNS trigger AS $$
+DECLARE
+	v_delta bigint;
+BEGIN
+
+	IF TG_OP = 'INSERT' THEN
+		SELECT count(*) INTO v_delta FROM new_rows;
+	ELSE
+		SELECT -count(*) INTO v_delta FROM old_rows;
+	END IF;
+
+	IF v_delta <> 0 THEN
+		INSERT INTO library_stats_delta (total_readers) VALUES (v_delta);
+	END IF;
+
+	RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+CREATE OR replace FUNCTION library_stats_book_items() RETURNS trigger AS $$
+DECLARE
+	v_delta bigint := 0;
+BEGIN
+
+	IF TG_OP IN ('INSERT', 'UPDATE') THEN
+		v_delta := v_delta + (SELECT count(*) FROM new_rows WHERE book_state = 'Доступна');
+	END IF;
+
+	IF TG_OP IN ('DELETE', 'UPDATE') THEN
+		v_delta := v_delta - (SELECT count(*) FROM old_rows WHERE book_state = 'Доступна');
+	END IF;
+
+	IF v_delta <> 0 THEN
+		INSERT INTO library_stats_delta (total_available) VALUES (v_delta);
+	END IF;
+
+	RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+CREATE OR replace FUNCTION library_stats_book_loans() RETURNS trigger AS $$
+DECLARE
+	v_delta bigint := 0;
+BEGIN
+
+	IF TG_OP IN ('INSERT', 'UPDATE') THEN
+		v_delta := v_delta + (SELECT count(*) FROM new_rows WHERE loan_return_date IS NULL);
+	END IF;
+
+	IF TG_OP IN ('DELETE', 'UPDATE') THEN
+		v_delta := v_delta - (SELECT count(*) FROM old_rows WHERE loan_return_date IS NULL);
+	END IF;
+
+	IF v_delta <> 0 THEN
+		INSERT INTO library_stats_delta (active_loans) VALUES (v_delta);
+	END IF;
+
+	RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Счетчики пересчитываются по текущим данным
+SELECT reconcile_library_stats();
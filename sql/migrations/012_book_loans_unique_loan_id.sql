@@ -0,0 +1,36 @@
+-- Уникальность loan_id в секциях book_loans. У секционированной таблицы нет
+-- первичного ключа (ключ секционирования - выражение, его нельзя включить
+-- в уникальный индекс), поэтому уникальный индекс по loan_id создается в
+-- каждой секции: новые годовые секции получают его при создании, у
+-- book_loans_open, секции по умолчанию и годовых секций из миграции 009 он
+-- строится в миграции 013, без блокировки записи. Уникальность проверяется внутри секции: повторная
+-- загрузка года из архива или ручная вставка займа с тем же id отклоняются.
+
+
+CREATE OR replace FUNCTION create_book_loans_partition(p_year int) RETURNS text AS $$
+DECLARE
+	v_name text := 'book_loans_closed_' || p_year;
+	v_from date := make_date(p_year, 1, 1);
+	v_to date := make_date(p_year + 1, 1, 1);
+BEGIN
+
+	IF to_regclass(v_name) IS NOT NULL THEN
+		RETURN NULL;
+	END IF;
+
+	EXECUTE format('CREATE TABLE %I (LIKE book_loans_closed INCLUDING DEFAULTS)', v_name);
+	EXECUTE format(
+		'WITH moved AS (DELETE FROM book_loans_closed_default WHERE loan_date >= %L AND loan_date < %L RETURNING *) '
+		'INSERT INTO %I SELECT * FROM moved',
+		v_from, v_to, v_name
+	);
+	-- Таблица еще не присоединена, индекс никого не блокирует
+	EXECUTE format('CREATE UNIQUE INDEX %I ON %I (loan_id)', v_name || '_loan_id_key', v_name);
+	EXECUTE format(
+		'ALTER TABLE book_loans_closed ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+		v_name, v_from, v_to
+	);
+
+	RETURN v_name;
+END;
+$$ LANGUAGE plpgsql;
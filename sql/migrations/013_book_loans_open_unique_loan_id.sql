@@ -0,0 +1,25 @@
+-- migrate: no-transaction
+-- Уникальный индекс по loan_id в секции открытых займов, в секции закрытых
+-- займов по умолчанию и в годовых секциях, созданных миграцией 009 (см.
+-- 012_book_loans_unique_loan_id.sql). Строятся CONCURRENTLY: в book_loans_open
+-- пишет каждая выдача и каждый возврат, а в годовые секции - возвраты.
+
+
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS book_loans_open_loan_id_key
+	ON book_loans_open (loan_id);
+
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS book_loans_closed_default_loan_id_key
+	ON book_loans_closed_default (loan_id);
+
+-- Годовые секции: их список зависит от дат займов, поэтому операторы
+-- строит запрос (\gexec, см. scripts/migrate.py). Секции, созданные уже
+-- функцией из 012, индекс с этим именем имеют и пропускаются
+SELECT format(
+	'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS %I ON %I (loan_id)',
+	c.relname || '_loan_id_key', c.relname
+)
+FROM pg_partition_tree('book_loans') AS t
+JOIN pg_class AS c ON c.oid = t.relid
+WHERE t.isleaf AND c.relname ~ '^book_loans_closed_[0-9]+$'
+ORDER BY c.relname
+\gexec
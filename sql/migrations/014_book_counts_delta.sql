@@ -0,0 +1,129 @@
+-- Количество экземпляров книги без блокировки строки books. Раньше триггер
+-- на book_items изменял books.available_count в транзакции выдачи и держал
+-- блокировку строки книги до ее конца: параллельные выдачи разных
+-- экземпляров одной книги выстраивались в очередь (сводя на нет SKIP LOCKED),
+-- а каждая выдача меняла версию books и ETag каталога. Теперь триггер
+-- добавляет приращения в журнал book_counts_delta (вставка никого не ждет),
+-- а приложение периодически переносит их в books (fold_book_counts).
+-- Текущее количество - значение в books плюс сумма строк журнала этой книги.
+
+
+CREATE TABLE IF NOT EXISTS book_counts_delta (
+	book_id int NOT NULL,
+	total_count int NOT NULL DEFAULT 0,
+	available_count int NOT NULL DEFAULT 0
+);
+
+-- Таблица новая и пустая: индекс строится сразу, в транзакции миграции
+CREATE INDEX IF NOT EXISTS book_counts_delta_book_id_idx ON book_counts_delta (book_id);
+
+-- Журнал входит в версию каталога: ETag страниц с количеством экземпляров
+-- меняется сразу после выдачи, а не после переноса
+INSERT INTO table_versions (table_name) VALUES ('book_counts_delta')
+ON conflict (table_name) do NOTHING;
+
+DROP TRIGGER IF EXISTS book_counts_delta_version ON book_counts_delta;
+CREATE TRIGGER book_counts_delta_version BEFORE INSERT OR UPDATE OR DELETE OR TRUNCATE ON book_counts_delta
+	FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+
+-- Версия books меняется только при изменении описания книги: перенос
+-- количества экземпляров меняет версию журнала (удаление его строк)
+DROP TRIGGER IF EXISTS books_version ON books;
+CREATE TRIGGER books_version
+	BEFORE INSERT OR DELETE OR TRUNCATE OR UPDATE OF book_id, book_name, publisher_id, isbn, release_date, theme_id ON books
+	FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+
+
+-- Триггер уровня оператора: изменения по всем строкам оператора сводятся
+-- в одну строку журнала на книгу
+CREATE OR replace FUNCTION book_counts_book_items() RETURNS trigger AS $$
+BEGIN
+
+	IF TG_OP = 'INSERT' THEN
+		INSERT INTO book_counts_delta (book_id, total_count, available_count)
+		SELECT book_id, count(*), count(*) FILTER (WHERE book_state = 'Доступна')
+		FROM new_rows WHERE book_id IS NOT NULL GROUP BY book_id;
+
+	ELSIF TG_OP = 'DELETE' THEN
+		INSERT INTO book_counts_delta (book_id, total_count, available_count)
+		SELECT book_id, -count(*), -count(*) FILTER (WHERE book_state = 'Доступна')
+		FROM old_rows WHERE book_id IS NOT NULL GROUP BY book_id;
+
+	ELSE
+		INSERT INTO book_counts_delta (book_id, total_count, available_count)
+		SELECT book_id, sum(total), sum(available)
+		FROM (
+			SELECT book_id, 1 AS total, (book_state = 'Доступна')::int AS available FROM new_rows
+			UNION ALL
+			SELECT book_id, -1, -(book_state = 'Доступна')::int FROM old_rows
+		) AS changes
+		WHERE book_id IS NOT NULL
+		GROUP BY book_id
+		HAVING sum(total) <> 0 OR sum(available) <> 0;
+	END IF;
+
+	RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Перенос журнала в books. Приращения незавершенных транзакций не видны и
+-- остаются в журнале до следующего переноса. Возвращает число измененных книг.
+CREATE OR replace FUNCTION fold_book_counts() RETURNS bigint AS $$
+DECLARE
+	v_count bigint;
+BEGIN
+
+	-- Пустой журнал не трогаем: триггер версии сработал бы и без строк
+	IF NOT EXISTS (SELECT 1 FROM book_counts_delta) THEN
+		RETURN 0;
+	END IF;
+
+	WITH moved AS (
+		DELETE FROM book_counts_delta RETURNING *
+	), totals AS (
+		SELECT book_id, sum(total_count) AS total, sum(available_count) AS available
+		FROM moved
+		GROUP BY book_id
+	)
+	UPDATE books SET
+		total_count = books.total_count + totals.total,
+		available_count = books.available_count + totals.available
+	FROM totals
+	WHERE books.book_id = totals.book_id
+	AND (totals.total <> 0 OR totals.available <> 0);
+
+	GET DIAGNOSTICS v_count = ROW_COUNT;
+	RETURN v_count;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Пересчет по book_items заменяет и значения в books, и строки журнала
+-- пересчитанных книг: видимые приращения уже учтены в подсчете
+CREATE OR replace FUNCTION reconcile_book_counts(p_book_id int DEFAULT NULL) RETURNS int AS $$
+DECLARE
+	v_fixed int;
+BEGIN
+
+	DELETE FROM book_counts_delta WHERE p_book_id IS NULL OR book_id = p_book_id;
+
+	UPDATE books SET
+		total_count = actual.total,
+		available_count = actual.available
+	FROM (
+		SELECT b.book_id,
+			count(i.book_item_id) AS total,
+			count(i.book_item_id) FILTER (WHERE i.book_state = 'Доступна') AS available
+		FROM books AS b
+		LEFT JOIN book_items AS i ON i.book_id = b.book_id
+		WHERE p_book_id IS NULL OR b.book_id = p_book_id
+		GROUP BY b.book_id
+	) AS actual
+	WHERE books.book_id = actual.book_id
+	AND (books.total_count <> actual.total OR books.available_count <> actual.available);
+
+	GET DIAGNOSTICS v_fixed = ROW_COUNT;
+	RETURN v_fixed;
+END;
+$$ LANGUAGE plpgsql;
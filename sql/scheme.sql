@@ -11,6 +11,15 @@ DROP TABLE IF EXISTS authors CASCADE;
 DROP TABLE IF EXISTS author_book CASCADE;
 DROP TABLE IF EXISTS readers CASCADE;
 DROP TABLE IF EXISTS book_loans CASCADE;
+DROP TABLE IF EXISTS library_stats CASCADE;
+DROP TABLE IF EXISTS library_stats_delta CASCADE;
+
+-- Таблицы миграций (sql/migrations) пересоздаются вместе со схемой: иначе
+-- scripts/migrate.py счел бы миграции примененными к новым таблицам
+DROP TABLE IF EXISTS book_counts_delta CASCADE;
+DROP TABLE IF EXISTS table_version_log CASCADE;
+DROP TABLE IF EXISTS table_versions CASCADE;
+DROP TABLE IF EXISTS schema_migrations CASCADE;
 
 
 create domain book_states as text
@@ -68,6 +77,10 @@ CREATE TABLE readers (
 	Uchenaya_Stepen text
 );
 
+-- Миграция 009 секционирует таблицу, и первичный ключ loan_id исчезает
+-- (ключ секционирования - выражение): уникальность loan_id после нее
+-- обеспечивают последовательность и уникальные индексы каждой секции
+-- (миграции 012, 013)
 CREATE TABLE book_loans (
 	loan_id serial PRIMARY KEY,
 	loan_date date NOT NULL,
@@ -79,6 +92,231 @@ CREATE TABLE book_loans (
 );
 
 
+-- Индексы для постраничного вывода по ключу сортировки
+CREATE INDEX books_name_id_idx ON books (book_name, book_id);
+CREATE INDEX readers_fio_id_idx ON readers (FIO, reader_id);
+CREATE INDEX book_loans_reader_date_idx ON book_loans (reader_id, loan_date, loan_id);
+
+
+-- Счетчики для главной страницы: одна строка плюс журнал приращений, который
+-- пишут триггеры; приложение периодически переносит журнал в строку
+CREATE TABLE library_stats (
+	stats_id smallint PRIMARY KEY DEFAULT 1 CHECK (stats_id = 1),
+	total_books bigint NOT NULL DEFAULT 0,
+	total_available bigint NOT NULL DEFAULT 0,
+	total_readers bigint NOT NULL DEFAULT 0,
+	active_loans bigint NOT NULL DEFAULT 0
+);
+
+INSERT INTO library_stats DEFAULT VALUES;
+
+CREATE TABLE library_stats_delta (
+	total_books bigint NOT NULL DEFAULT 0,
+	total_available bigint NOT NULL DEFAULT 0,
+	total_readers bigint NOT NULL DEFAULT 0,
+	active_loans bigint NOT NULL DEFAULT 0
+);
+
+
+CREATE OR replace VIEW current_library_stats AS
+SELECT
+	s.stats_id,
+	s.total_books + d.total_books AS total_books,
+	s.total_available + d.total_available AS total_available,
+	s.total_readers + d.total_readers AS total_readers,
+	s.active_loans + d.active_loans AS active_loans
+FROM library_stats AS s
+CROSS JOIN (
+	SELECT
+		coalesce(sum(total_books), 0)::bigint AS total_books,
+		coalesce(sum(total_available), 0)::bigint AS total_available,
+		coalesce(sum(total_readers), 0)::bigint AS total_readers,
+		coalesce(sum(active_loans), 0)::bigint AS active_loans
+	FROM library_stats_delta
+) AS d;
+
+
+-- Перенос журнала в строку счетчиков
+CREATE OR replace FUNCTION fold_library_stats() RETURNS bigint AS $$
+DECLARE
+	v_count bigint;
+BEGIN
+
+	-- Пустой журнал не трогаем: триггеры версий library_stats и журнала
+	-- сработали бы и без измененных строк, и ETag главной страницы менялся
+	-- бы при каждом переносе
+	IF NOT EXISTS (SELECT 1 FROM library_stats_delta) THEN
+		RETURN 0;
+	END IF;
+
+	WITH moved AS (
+		DELETE FROM library_stats_delta RETURNING *
+	), totals AS (
+		SELECT
+			count(*) AS changes,
+			coalesce(sum(total_books), 0) AS total_books,
+			coalesce(sum(total_available), 0) AS total_available,
+			coalesce(sum(total_readers), 0) AS total_readers,
+			coalesce(sum(active_loans), 0) AS active_loans
+		FROM moved
+	)
+	UPDATE library_stats AS s SET
+		total_books = s.total_books + totals.total_books,
+		total_available = s.total_available + totals.total_available,
+		total_readers = s.total_readers + totals.total_readers,
+		active_loans = s.active_loans + totals.active_loans
+	FROM totals
+	WHERE s.stats_id = 1 AND totals.changes > 0
+	RETURNING totals.changes INTO v_count;
+
+	RETURN coalesce(v_count, 0);
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Пересчет счетчиков с нуля (после массовой загрузки или TRUNCATE)
+CREATE OR replace FUNCTION reconcile_library_stats() RETURNS void AS $$
+BEGIN
+
+	DELETE FROM library_stats_delta;
+
+	INSERT INTO library_stats (stats_id, total_books, total_available, total_readers, active_loans)
+	SELECT
+		1,
+		(SELECT count(*) FROM books),
+		(SELECT count(*) FROM book_items WHERE book_state = 'Доступна'),
+		(SELECT count(*) FROM readers),
+		(SELECT count(*) FROM book_loans WHERE loan_return_date IS NULL)
+	ON conflict (stats_id) do UPDATE SET
+		total_books = excluded.total_books,
+		total_available = excluded.total_available,
+		total_readers = excluded.total_readers,
+		active_loans = excluded.active_loans;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Триггеры уровня оператора: одна строка журнала на весь INSERT/UPDATE/DELETE,
+-- и только если изменение влияет на счетчик
+CREATE OR replace FUNCTION library_stats_books() RETURNS trigger AS $$
+DECLARE
+	v_delta bigint;
+BEGIN
+
+	IF TG_OP = 'INSERT' THEN
+		SELECT count(*) INTO v_delta FROM new_rows;
+	ELSE
+		SELECT -count(*) INTO v_delta FROM old_rows;
+	END IF;
+
+	IF v_delta <> 0 THEN
+		INSERT INTO library_stats_delta (total_books) VALUES (v_delta);
+	END IF;
+
+	RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+CREATE OR replace FUNCTION library_stats_readers() RETURNS trigger AS $$
+DECLARE
+	v_delta bigint;
+BEGIN
+
+	IF TG_OP = 'INSERT' THEN
+		SELECT count(*) INTO v_delta FROM new_rows;
+	ELSE
+		SELECT -count(*) INTO v_delta FROM old_rows;
+	END IF;
+
+	IF v_delta <> 0 THEN
+		INSERT INTO library_stats_delta (total_readers) VALUES (v_delta);
+	END IF;
+
+	RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+CREATE OR replace FUNCTION library_stats_book_items() RETURNS trigger AS $$
+DECLARE
+	v_delta bigint := 0;
+BEGIN
+
+	IF TG_OP IN ('INSERT', 'UPDATE') THEN
+		v_delta := v_delta + (SELECT count(*) FROM new_rows WHERE book_state = 'Доступна');
+	END IF;
+
+	IF TG_OP IN ('DELETE', 'UPDATE') THEN
+		v_delta := v_delta - (SELECT count(*) FROM old_rows WHERE book_state = 'Доступна');
+	END IF;
+
+	IF v_delta <> 0 THEN
+		INSERT INTO library_stats_delta (total_available) VALUES (v_delta);
+	END IF;
+
+	RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+CREATE OR replace FUNCTION library_stats_book_loans() RETURNS trigger AS $$
+DECLARE
+	v_delta bigint := 0;
+BEGIN
+
+	IF TG_OP IN ('INSERT', 'UPDATE') THEN
+		v_delta := v_delta + (SELECT count(*) FROM new_rows WHERE loan_return_date IS NULL);
+	END IF;
+
+	IF TG_OP IN ('DELETE', 'UPDATE') THEN
+		v_delta := v_delta - (SELECT count(*) FROM old_rows WHERE loan_return_date IS NULL);
+	END IF;
+
+	IF v_delta <> 0 THEN
+		INSERT INTO library_stats_delta (active_loans) VALUES (v_delta);
+	END IF;
+
+	RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+CREATE TRIGGER books_stats_insert AFTER INSERT ON books
+	REFERENCING NEW TABLE AS new_rows
+	FOR EACH STATEMENT EXECUTE FUNCTION library_stats_books();
+CREATE TRIGGER books_stats_delete AFTER DELETE ON books
+	REFERENCING OLD TABLE AS old_rows
+	FOR EACH STATEMENT EXECUTE FUNCTION library_stats_books();
+
+CREATE TRIGGER readers_stats_insert AFTER INSERT ON readers
+	REFERENCING NEW TABLE AS new_rows
+	FOR EACH STATEMENT EXECUTE FUNCTION library_stats_readers();
+CREATE TRIGGER readers_stats_delete AFTER DELETE ON readers
+	REFERENCING OLD TABLE AS old_rows
+	FOR EACH STATEMENT EXECUTE FUNCTION library_stats_readers();
+
+CREATE TRIGGER book_items_stats_insert AFTER INSERT ON book_items
+	REFERENCING NEW TABLE AS new_rows
+	FOR EACH STATEMENT EXECUTE FUNCTION library_stats_book_items();
+CREATE TRIGGER book_items_stats_update AFTER UPDATE ON book_items
+	REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+	FOR EACH STATEMENT EXECUTE FUNCTION library_stats_book_items();
+CREATE TRIGGER book_items_stats_delete AFTER DELETE ON book_items
+	REFERENCING OLD TABLE AS old_rows
+	FOR EACH STATEMENT EXECUTE FUNCTION library_stats_book_items();
+
+CREATE TRIGGER book_loans_stats_insert AFTER INSERT ON book_loans
+	REFERENCING NEW TABLE AS new_rows
+	FOR EACH STATEMENT EXECUTE FUNCTION library_stats_book_loans();
+CREATE TRIGGER book_loans_stats_update AFTER UPDATE ON book_loans
+	REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+	FOR EACH STATEMENT EXECUTE FUNCTION library_stats_book_loans();
+CREATE TRIGGER book_loans_stats_delete AFTER DELETE ON book_loans
+	REFERENCING OLD TABLE AS old_rows
+	FOR EACH STATEMENT EXECUTE FUNCTION library_stats_book_loans();
+
+
 -- Регистрация книг (ОК)
 create or replace function register_book(
 	p_BOOK_NAME text,
@@ -169,6 +407,8 @@ BEGIN
 	END IF;
 	
 	
+	-- SKIP LOCKED: параллельные выдачи берут разные экземпляры, а не ждут один;
+	-- блокируется только экземпляр, строка книги остается свободной
 	SELECT book_item_id INTO v_book_item_id 
 	FROM book_items 
 	JOIN books
@@ -176,7 +416,7 @@ BEGIN
 	WHERE book_items.book_state = 'Доступна'
 	AND books.book_name = p_BOOK_TO_LOAN
 	LIMIT 1
-	FOR UPDATE;
+	FOR UPDATE OF book_items SKIP LOCKED;
 	
 	
 	IF NOT FOUND THEN